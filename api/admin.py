@@ -1,3 +1,117 @@
+import json
+
 from django.contrib import admin
+from django.http import Http404, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import path, reverse
+from django.utils.html import format_html, format_html_join
+
+from api.models import (
+    MediaBlob,
+    MediaInventoryScan,
+    MediaLocation,
+    MediaManifest,
+    RequestProfile,
+    UploadSession,
+)
 
 # Register your models here.
+
+
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ["id", "target", "object_id", "key", "status", "date"]
+    list_filter = ["target", "status"]
+    search_fields = ["key"]
+
+
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ["name", "refs", "date"]
+    search_fields = ["name", "sha256"]
+
+
+class MediaLocationAdmin(admin.ModelAdmin):
+    list_display = ["key", "tier", "date"]
+    list_filter = ["tier"]
+    search_fields = ["key"]
+
+
+class MediaManifestAdmin(admin.ModelAdmin):
+    list_display = ["key", "tier", "size", "modified", "seen"]
+    list_filter = ["tier"]
+    search_fields = ["key"]
+
+
+class MediaInventoryScanAdmin(admin.ModelAdmin):
+    list_display = ["tier", "entries", "started", "finished"]
+
+
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ["path", "method", "status", "duration", "queries", "mode", "trigger", "date"]
+    list_filter = ["mode", "trigger", "view"]
+    search_fields = ["path", "view"]
+    exclude = ["sql", "stacks", "stats"]
+    readonly_fields = [
+        "date", "method", "path", "view", "status", "duration", "mode", "trigger",
+        "user", "queries", "db_time", "downloads", "slowest_queries", "report",
+    ]
+
+    # Profiles come from requests, never from the admin
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        download = self.admin_site.admin_view(self.download)
+        return [
+            path("<int:pk>/download/<str:kind>/", download, name="api_requestprofile_download"),
+        ] + super().get_urls()
+
+    def download(self, request, pk, kind):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        if kind == "stacks":
+            content, content_type, extension = profile.stacks, "text/plain", "folded"
+        elif kind == "sql":
+            content, content_type, extension = json.dumps(profile.sql, indent=2), "application/json", "json"
+        elif kind == "pstats" and profile.stats:
+            content, content_type, extension = bytes(profile.stats), "application/octet-stream", "prof"
+        else:
+            raise Http404
+        response = HttpResponse(content, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="profile-{pk}.{extension}"'
+        return response
+
+    @admin.display(description="Download")
+    def downloads(self, obj):
+        kinds = [("stacks", "Collapsed stacks"), ("sql", "SQL")]
+        if obj.stats:
+            kinds.append(("pstats", "pstats"))
+        return format_html_join(
+            " | ",
+            '<a href="{}">{}</a>',
+            (
+                (reverse("admin:api_requestprofile_download", args=[obj.pk, kind]), label)
+                for kind, label in kinds
+            ),
+        )
+
+    @admin.display(description="Slowest queries")
+    def slowest_queries(self, obj):
+        queries = sorted(obj.sql, key=lambda query: query["ms"], reverse=True)[:10]
+        return format_html(
+            "<table>{}</table>",
+            format_html_join(
+                "",
+                "<tr><td>{}ms</td><td>{}</td><td><code>{}</code></td></tr>",
+                ((query["ms"], query["origin"], query["sql"]) for query in queries),
+            ),
+        )
+
+
+admin.site.register(UploadSession, UploadSessionAdmin)
+admin.site.register(MediaBlob, MediaBlobAdmin)
+admin.site.register(MediaLocation, MediaLocationAdmin)
+admin.site.register(MediaManifest, MediaManifestAdmin)
+admin.site.register(MediaInventoryScan, MediaInventoryScanAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
@@ -0,0 +1,58 @@
+import logging
+import mimetypes
+
+from django.http import Http404, HttpResponse
+
+from api import resilience
+from api.tiered_storage import get_media_storage
+from api.views import PLACEHOLDER_SVG, media_names, media_unavailable
+
+logger = logging.getLogger(__name__)
+
+# Async variants of the media views, routed instead of the sync ones with
+# ASYNC_VIEWS. Served by an ASGI worker a request waiting on Cloudinary or
+# S3 holds no thread, see api.async_http
+
+
+async def serve_media(path):
+    """
+    serve_media for async views
+    """
+    storage = get_media_storage()
+    unavailable = False
+    for name in media_names(path):
+        try:
+            tier, content, content_type, seconds = await storage.alocate(name)
+        except FileNotFoundError:
+            continue
+        except resilience.ServiceUnavailable:
+            unavailable = True
+            continue
+
+        content_type = content_type or mimetypes.guess_type(name)[0]
+        response = HttpResponse(content, content_type=content_type or 'application/octet-stream')
+        response['Cache-Control'] = 'max-age=86400, public'
+        response['X-Media-Tier'] = tier
+        response['Server-Timing'] = f'media;desc="{tier}";dur={seconds * 1000:.1f}'
+        return response
+
+    if unavailable:
+        return media_unavailable(path)
+    logger.warning(f"Media file not found on any tier: {path}")
+    return HttpResponse(PLACEHOLDER_SVG, content_type='image/svg+xml', status=404)
+
+
+async def media_proxy(request, path):
+    """
+    Serve media files through the tiered media storage
+    """
+    return await serve_media(path)
+
+
+async def proxy_s3_media(request, path):
+    """
+    Older media proxy URL, served the same way as media_proxy
+    """
+    if not path:
+        raise Http404("No path specified")
+    return await serve_media(path)
@@ -0,0 +1,362 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+
+import requests
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import Resolver404, resolve
+from mailersend import emails
+
+from api import metrics
+from store.models import Product
+from userauths.models import User
+from vendor.models import Vendor
+
+# One request of a journey, label is the method and URL pattern so runs
+# against different rows compare
+Sample = namedtuple("Sample", ["label", "status", "seconds", "queries"])
+
+SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class JourneyError(Exception):
+    """
+    Raised when a step fails and the rest of the journey cannot run
+    """
+
+
+def route_label(method, path):
+    try:
+        route = resolve(path.split("?", 1)[0]).route
+    except Resolver404:
+        route = path
+    return f"{method.upper()} /{route}"
+
+
+def accept_email(self, message):
+    # What emails.NewEmail.send returns for an email MailerSend accepted
+    return "202\n"
+
+
+class ClientDriver:
+    """
+    Requests through the Django test client in this process, queries are
+    counted on the database connections
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def settings(self):
+        # No order email may leave a benchmark, and timings must not depend
+        # on the network: MailerSend accepts every email without a request,
+        # mail sent by Django goes to the in-memory backend
+        stack = ExitStack()
+        stack.enter_context(
+            override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"],
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+            )
+        )
+        stack.enter_context(mock.patch.object(emails.NewEmail, "send", accept_email))
+        return stack
+
+    def request(self, method, path, data=None):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = Client()
+
+        counter = metrics.RequestMetrics()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            started = time.perf_counter()
+            if method == "get":
+                response = client.get(path)
+            else:
+                response = getattr(client, method)(
+                    path, json.dumps(data or {}), content_type="application/json"
+                )
+            if response.streaming:
+                content = b"".join(response.streaming_content)
+            else:
+                content = response.content
+            seconds = time.perf_counter() - started
+
+        return response.status_code, body(content), seconds, counter.queries
+
+
+class HttpDriver:
+    """
+    Requests to a running server, queries are read from the Server-Timing
+    header the server adds when METRICS_SERVER_TIMING is on
+    """
+
+    def __init__(self, base_url, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def settings(self):
+        return ExitStack()
+
+    def request(self, method, path, data=None):
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = requests.Session()
+
+        started = time.perf_counter()
+        response = session.request(
+            method, self.base_url + path, json=data, timeout=self.timeout
+        )
+        seconds = time.perf_counter() - started
+
+        match = SERVER_TIMING_QUERIES.search(response.headers.get("Server-Timing", ""))
+        queries = int(match[1]) if match else None
+        return response.status_code, body(response.content), seconds, queries
+
+
+def body(content):
+    try:
+        return json.loads(content)
+    except ValueError:
+        return None
+
+
+class Session:
+    """
+    One run of a journey, recording a sample per request
+    """
+
+    def __init__(self, driver, fixtures, rng):
+        self.driver = driver
+        self.fixtures = fixtures
+        self.rng = rng
+        self.samples = []
+
+    def request(self, method, path, data=None):
+        status, payload, seconds, queries = self.driver.request(method, path, data)
+        self.samples.append(Sample(route_label(method, path), status, seconds, queries))
+        if status >= 400:
+            raise JourneyError(f"{method.upper()} {path} returned {status}")
+        return payload
+
+    def get(self, path):
+        return self.request("get", path)
+
+    def post(self, path, data):
+        return self.request("post", path, data)
+
+
+def shopper(session):
+    """
+    Browse, open a product, add it to a cart and pay for it cash on delivery
+    """
+    fixtures, rng = session.fixtures, session.rng
+    product = rng.choice(fixtures["products"])
+    user_id = rng.choice(fixtures["buyers"])
+    cart_id = uuid.uuid4().hex[:12]
+
+    session.get("/api/v1/products/")
+    session.get(f"/api/v1/products/{product['slug']}/")
+    session.post(
+        "/api/v1/cart-view/",
+        {
+            "product_id": product["id"],
+            "user_id": user_id,
+            "qty": rng.choice([1, 1, 2]),
+            "price": str(product["price"]),
+            "shipping_amount": str(product["shipping_amount"]),
+            "country": "Nepal",
+            "size": "",
+            "color": "",
+            "cart_id": cart_id,
+        },
+    )
+    session.get(f"/api/v1/cart-list/{cart_id}/{user_id}/")
+    order = session.post(
+        "/api/v1/create-order/",
+        {
+            "full_name": "Benchmark Buyer",
+            "email": "benchmark@example.com",
+            "mobile": "0000000000",
+            "address": "1 Benchmark Street",
+            "city": "Kathmandu",
+            "state": "Bagmati",
+            "country": "Nepal",
+            "cart_id": cart_id,
+            "user_id": user_id,
+            "payment_method": "cod",
+        },
+    )
+    session.post(f"/api/v1/order/cod/{order['order_oid']}/", {"cart_id": cart_id})
+
+
+def vendor(session):
+    """
+    A vendor going through the dashboard pages
+    """
+    vendor_id = session.rng.choice(session.fixtures["vendors"])
+    for path in (
+        "vendor/stats/{}/",
+        "vendor/overview/{}/",
+        "vendor/orders/{}/",
+        "vendor/products/{}/",
+        "vendor-earning/{}/",
+        "vendor-orders-chart/{}/",
+        "vendor-noti-list/{}/",
+        "vendor-reviews/{}/",
+    ):
+        session.get("/api/v1/" + path.format(vendor_id))
+
+
+JOURNEYS = {"shopper": shopper, "vendor": vendor}
+
+
+def load_fixtures(limit=200):
+    """
+    Rows journeys pick from, the most sold products and largest vendors
+    first as those are the ones real traffic hits
+    """
+    products = list(
+        Product.objects.filter(status="published", slug__isnull=False)
+        .order_by("-units_sold")
+        .values("id", "slug", "price", "shipping_amount")[:limit]
+    )
+    buyers = list(
+        User.objects.filter(vendor__isnull=True).order_by("pk").values_list("pk", flat=True)[:limit]
+    )
+    vendors = list(
+        Vendor.objects.annotate(products=Count("product"))
+        .order_by("-products")
+        .values_list("pk", flat=True)[:limit]
+    )
+    return {"products": products, "buyers": buyers, "vendors": vendors}
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def summarize(samples):
+    seconds = sorted(sample.seconds for sample in samples)
+    queries = [sample.queries for sample in samples if sample.queries is not None]
+    return {
+        "requests": len(samples),
+        "errors": sum(sample.status >= 400 for sample in samples),
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(seconds, 0.99) * 1000, 2),
+        "mean_ms": round(sum(seconds) / len(seconds) * 1000, 2),
+        "queries": round(sum(queries) / len(queries), 1) if queries else None,
+    }
+
+
+def journey_summary(runs, failures):
+    seconds = sorted(sum(sample.seconds for sample in samples) for samples in runs)
+    return {
+        "runs": len(runs),
+        "failed": len(failures),
+        "errors": failures[:5],
+        "p50_ms": round(percentile(seconds, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(seconds, 0.95) * 1000, 2),
+    }
+
+
+def run(driver, journeys, iterations, concurrency=1, warmup=0, seed=None, fixtures=None):
+    """
+    Run each journey `iterations` times over `concurrency` threads and
+    return the report
+    """
+    fixtures = fixtures or load_fixtures()
+    for name, rows in fixtures.items():
+        if not rows:
+            raise JourneyError(f"No {name} to run journeys with, generate some data first")
+
+    seeds = random.Random(seed)
+    runs = [name for name in journeys for _ in range(iterations)]
+    seeds.shuffle(runs)
+    tasks = [(name, seeds.randrange(2**32)) for name in runs]
+
+    def play(task):
+        name, journey_seed = task
+        session = Session(driver, fixtures, random.Random(journey_seed))
+        try:
+            JOURNEYS[name](session)
+            error = None
+        except JourneyError as e:
+            error = str(e)
+        return name, session.samples, error
+
+    with driver.settings():
+        for task in tasks[:warmup]:
+            play(task)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(play, tasks))
+        seconds = time.perf_counter() - started
+
+    by_label = defaultdict(list)
+    by_journey = defaultdict(list)
+    failures = defaultdict(list)
+    for name, samples, error in results:
+        by_journey[name].append(samples)
+        if error:
+            failures[name].append(error)
+        for sample in samples:
+            by_label[sample.label].append(sample)
+
+    requests = sum(len(samples) for samples in by_label.values())
+    return {
+        "driver": type(driver).__name__,
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "requests": requests,
+        "throughput_rps": round(requests / seconds, 2) if seconds else None,
+        "journeys": {
+            name: journey_summary(runs, failures[name])
+            for name, runs in sorted(by_journey.items())
+        },
+        "endpoints": {label: summarize(samples) for label, samples in sorted(by_label.items())},
+    }
+
+
+def compare(report, baseline, threshold=10):
+    """
+    (label, metric, baseline, current, change %, regressed) for each endpoint
+    metric in both reports, a regression being a p95 more than threshold
+    percent slower or any extra query
+    """
+    rows = []
+    for label, current in report["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(label)
+        if before is None:
+            continue
+        for metric in ("p50_ms", "p95_ms", "p99_ms", "queries"):
+            old, new = before.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else (0 if new == old else math.inf)
+            if metric == "queries":
+                regressed = new > old
+            else:
+                regressed = metric == "p95_ms" and change > threshold
+            rows.append((label, metric, old, new, change, regressed))
+    return rows
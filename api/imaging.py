@@ -0,0 +1,248 @@
+import base64
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, models, transaction
+
+try:
+    from PIL import ExifTags, Image, ImageOps
+except ImportError:  # Pillow is optional, images are then left unprocessed
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Longest side in pixels of each generated variant
+VARIANT_SIZES = {
+    "small": 160,
+    "medium": 480,
+    "large": 1024,
+}
+VARIANT_QUALITY = 80
+
+# Longest side of the blurred placeholder embedded in the row
+LQIP_SIZE = 16
+
+_executor = None
+
+
+class ProcessedImageModel(models.Model):
+    """
+    Dimensions, placeholder and resized variants of a model's `image`,
+    filled in after the image is saved, see process_image
+    """
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_lqip = models.TextField(blank=True, default="", editable=False)
+    image_variants = models.JSONField(blank=True, default=dict, editable=False)
+    # Name of the image the fields above were computed from
+    image_source = models.CharField(max_length=500, blank=True, default="", editable=False)
+
+    class Meta:
+        abstract = True
+
+    def image_thumbnails(self):
+        """
+        URLs of the resized variants by size name, empty until processed
+        """
+        if not self.image or self.image_source != self.image.name:
+            return {}
+        storage = self.image.storage
+        return {size: storage.url(name) for size, name in self.image_variants.items()}
+
+
+def variant_name(name, size):
+    directory, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(directory, "variants", f"{stem}_{size}.webp")
+
+
+def encode(image, format, **options):
+    buffer = BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def strip_metadata(content):
+    """
+    The image in `content` re-encoded without its EXIF block (GPS position,
+    camera, ...), None when it has none or is not an image Pillow reads.
+    The orientation is applied to the pixels since its tag goes too
+    """
+    if Image is None:
+        return None
+    try:
+        content.seek(0)
+        image = Image.open(content)
+        exif = image.getexif()
+    except Exception:
+        content.seek(0)
+        return None
+    if not exif:
+        content.seek(0)
+        return None
+
+    try:
+        format = image.format
+        options = {}
+        if image.info.get("icc_profile"):
+            options["icc_profile"] = image.info["icc_profile"]
+        if exif.get(ExifTags.Base.Orientation, 1) != 1:
+            image = ImageOps.exif_transpose(image)
+            if format == "JPEG":
+                options["quality"] = 95
+        elif format == "JPEG":
+            # Same quantization tables, no visible recompression
+            options["quality"] = "keep"
+        data = encode(image, format, **options)
+    except Exception as e:
+        logger.warning(f"Could not strip the metadata of {content}: {e}")
+        return None
+    finally:
+        content.seek(0)
+    return ContentFile(data, name=getattr(content, "name", None))
+
+
+def process_image(model_label, pk, name):
+    """
+    Generate the variants and placeholder of one stored image and write
+    them with an UPDATE that only applies while the row still has that image
+    """
+    model = apps.get_model(model_label)
+    # Variants are written as they are, not through content-hash naming
+    storage = model._meta.get_field("image").storage
+    storage = getattr(storage, "backing", storage)
+
+    # Rows sharing a deduplicated image share its variants too
+    processed = (
+        model.objects.filter(image_source=name)
+        .exclude(pk=pk)
+        .exclude(image_variants={})
+        .values("image_width", "image_height", "image_lqip", "image_variants")
+        .first()
+    )
+    if processed:
+        return bool(
+            model.objects.filter(pk=pk, image=name).update(image_source=name, **processed)
+        )
+
+    try:
+        with storage.open(name) as source:
+            original = ContentFile(source.read(), name=name)
+        image = Image.open(original)
+        image.load()
+    except Exception as e:
+        logger.warning(f"Could not read image {name} of {model_label} {pk}: {e}")
+        model.objects.filter(pk=pk, image=name).update(image_source=name)
+        return False
+
+    # Files saved through DedupStorage are stripped already, those uploaded
+    # straight to the storage are rewritten under the same name
+    stripped = strip_metadata(original)
+    if stripped is not None:
+        storage.delete(name)
+        stored = storage.save(name, stripped)
+        if stored != name:
+            # The original could not be replaced and is still there
+            storage.delete(stored)
+            logger.warning(f"Could not strip the metadata of {name} in place")
+
+    # Apply the EXIF orientation, the variants are written without metadata
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    previous_source, previous = (
+        model.objects.filter(pk=pk).values_list("image_source", "image_variants").first()
+        or ("", {})
+    )
+
+    # Storages that do not overwrite pick a free name, the replaced
+    # variants are removed once the row points at the new ones
+    variants = {}
+    for size, longest_side in VARIANT_SIZES.items():
+        variant = image.copy()
+        variant.thumbnail((longest_side, longest_side))
+        variants[size] = storage.save(
+            variant_name(name, size),
+            ContentFile(encode(variant, "WEBP", quality=VARIANT_QUALITY)),
+        )
+
+    placeholder = image.copy()
+    placeholder.thumbnail((LQIP_SIZE, LQIP_SIZE))
+    lqip = "data:image/webp;base64," + base64.b64encode(
+        encode(placeholder, "WEBP", quality=30)
+    ).decode()
+
+    updated = model.objects.filter(pk=pk, image=name).update(
+        image_width=image.width,
+        image_height=image.height,
+        image_lqip=lqip,
+        image_variants=variants,
+        image_source=name,
+    )
+    # When the image changed while processing its own run replaces these
+    if updated:
+        stale = set((previous or {}).values()) - set(variants.values())
+        if model.objects.filter(image_source=previous_source).exclude(pk=pk).exists():
+            stale = set()
+    else:
+        stale = set(variants.values())
+    for key in stale:
+        storage.delete(key)
+    return bool(updated)
+
+
+def run(model_label, pk, name):
+    try:
+        process_image(model_label, pk, name)
+    except Exception:
+        logger.exception(f"Image processing failed for {model_label} {pk}")
+    finally:
+        connection.close()
+
+
+def schedule(model_label, pk, name):
+    global _executor
+
+    if settings.IMAGE_PROCESSING == "sync":
+        process_image(model_label, pk, name)
+        return
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix="image-processing",
+        )
+    _executor.submit(run, model_label, pk, name)
+
+
+def image_saved(sender, instance, **kwargs):
+    """
+    post_save receiver queuing a changed image once the transaction commits
+    """
+    if Image is None or settings.IMAGE_PROCESSING == "off":
+        return
+
+    name = instance.image.name if instance.image else ""
+    if not name or name == instance.image_source:
+        return
+    # The shared default images are not processed per row
+    if name == sender._meta.get_field("image").default:
+        return
+
+    transaction.on_commit(
+        lambda: schedule(sender._meta.label, instance.pk, name)
+    )
+
+
+def images_created(model, instances):
+    """
+    Queue the images of rows created with bulk_create, which sends no signals
+    """
+    for instance in instances:
+        image_saved(model, instance)
@@ -0,0 +1,211 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from api.models import MediaInventoryScan, MediaLocation, MediaManifest
+from api.tiered_storage import CloudinaryStorage, get_media_storage
+
+
+class InventoryError(Exception):
+    """
+    Raised when a tier cannot be listed
+    """
+
+
+def key_parts(key):
+    return tuple(key.split("/"))
+
+
+def iter_local(root, after=None, prefix=()):
+    """
+    Files under root in path order, starting after the key `after`
+
+    Directories sorting entirely before `after` are skipped without being
+    read, so resuming deep into a large tree stays cheap.
+    """
+    after_parts = key_parts(after) if after else ()
+    try:
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        parts = prefix + (entry.name,)
+        if entry.is_dir(follow_symlinks=False):
+            if after_parts and after_parts[: len(parts)] > parts:
+                continue
+            yield from iter_local(entry.path, after, parts)
+        elif entry.is_file(follow_symlinks=False):
+            if after_parts and parts <= after_parts:
+                continue
+            stat = entry.stat()
+            yield {
+                "key": "/".join(parts),
+                "size": stat.st_size,
+                "modified": datetime.datetime.fromtimestamp(
+                    stat.st_mtime, tz=datetime.timezone.utc
+                ),
+            }
+
+
+def walk_local(storage, token, page_size):
+    entries = []
+    for entry in iter_local(storage.location, token):
+        entries.append(entry)
+        if len(entries) == page_size:
+            return entries, entry["key"]
+    return entries, None
+
+
+def walk_s3(storage, token, page_size):
+    client = storage.connection.meta.client
+    prefix = f"{storage.location.strip('/')}/" if storage.location else ""
+    options = {"Bucket": storage.bucket_name, "MaxKeys": page_size, "Prefix": prefix}
+    if token:
+        options["ContinuationToken"] = token
+
+    page = client.list_objects_v2(**options)
+    entries = [
+        {
+            "key": item["Key"][len(prefix):],
+            "size": item["Size"],
+            "modified": item["LastModified"],
+        }
+        for item in page.get("Contents", [])
+    ]
+    return entries, page.get("NextContinuationToken")
+
+
+def walk_cloudinary(storage, token, page_size):
+    try:
+        import cloudinary
+        import cloudinary.api
+    except ImportError:
+        raise InventoryError("The cloudinary package is not installed")
+    if not settings.CLOUDINARY_API_KEY or not settings.CLOUDINARY_API_SECRET:
+        raise InventoryError("CLOUDINARY_API_KEY and CLOUDINARY_API_SECRET are not set")
+
+    cloudinary.config(
+        cloud_name=storage.cloud_name,
+        api_key=settings.CLOUDINARY_API_KEY,
+        api_secret=settings.CLOUDINARY_API_SECRET,
+    )
+    options = {"max_results": min(page_size, 500)}
+    if token:
+        options["next_cursor"] = token
+
+    page = cloudinary.api.resources(**options)
+    entries = [
+        {
+            "key": f"{resource['public_id']}.{resource['format']}",
+            "size": resource.get("bytes"),
+            "modified": datetime.datetime.fromisoformat(
+                resource["created_at"].replace("Z", "+00:00")
+            ),
+        }
+        for resource in page.get("resources", [])
+    ]
+    return entries, page.get("next_cursor")
+
+
+def walk(tier, token=None, page_size=1000):
+    """
+    One page of a tier's listing, returns (entries, next token) where the
+    token is None once the listing is complete
+    """
+    storage = get_media_storage().tiers.get(tier)
+    if storage is None:
+        raise InventoryError(f"{tier} is not one of the media tiers {settings.MEDIA_TIERS}")
+
+    if isinstance(storage, CloudinaryStorage):
+        return walk_cloudinary(storage, token, page_size)
+    if getattr(storage, "bucket_name", None) is not None:
+        return walk_s3(storage, token, page_size)
+    if hasattr(storage, "location"):
+        return walk_local(storage, token, page_size)
+    raise InventoryError(f"Listing {type(storage).__name__} is not supported")
+
+
+def record_page(scan, entries, token):
+    """
+    Add a page to the manifest and remember where the scan stands
+    """
+    now = timezone.now()
+    MediaManifest.objects.bulk_create(
+        [
+            MediaManifest(
+                tier=scan.tier,
+                key=entry["key"],
+                size=entry["size"],
+                modified=entry["modified"],
+                seen=now,
+            )
+            for entry in entries
+        ],
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=["tier", "key"],
+        update_fields=["size", "modified", "seen"],
+    )
+    scan.token = token or ""
+    scan.entries += len(entries)
+    if token is None:
+        finish_scan(scan)
+    scan.save()
+
+
+def finish_scan(scan):
+    # Objects not seen since the scan started are gone from the tier
+    MediaManifest.objects.filter(tier=scan.tier, seen__lt=scan.started).delete()
+    scan.finished = timezone.now()
+    index_locations(scan.tier)
+
+
+def index_locations(tier):
+    """
+    Record keys of `tier` that are missing from the first tier in
+    MediaLocation, so reads go straight to the tier holding them
+    """
+    storage = get_media_storage()
+    first = next(name for name in storage.tiers if name != storage.cache_name)
+    if tier == first:
+        return 0
+
+    on_first = MediaManifest.objects.filter(tier=first, key=OuterRef("key"))
+    keys = (
+        MediaManifest.objects.filter(tier=tier)
+        .annotate(on_first=Subquery(on_first.values("id")[:1]))
+        .filter(on_first__isnull=True)
+        .values_list("key", flat=True)
+    )
+    locations = [MediaLocation(key=key, tier=tier) for key in keys.iterator(chunk_size=2000)]
+    MediaLocation.objects.bulk_create(locations, batch_size=1000, ignore_conflicts=True)
+    return len(locations)
+
+
+def start_scan(tier, restart=False):
+    """
+    The tier's unfinished scan to resume, or a new one
+    """
+    scan, created = MediaInventoryScan.objects.get_or_create(
+        tier=tier, defaults={"started": timezone.now()}
+    )
+    if restart or scan.finished:
+        scan.started = timezone.now()
+        scan.finished = None
+        scan.token = ""
+        scan.entries = 0
+        scan.save()
+    return scan
+
+
+def manifest_entry(entry, tier):
+    return {
+        "tier": tier,
+        "key": entry["key"],
+        "size": entry["size"],
+        "modified": entry["modified"].isoformat() if entry["modified"] else None,
+    }
@@ -0,0 +1,115 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Run shopper and vendor journeys against the API and report latency "
+        "percentiles, throughput and queries per request"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--journey",
+            action="append",
+            choices=sorted(benchmark.JOURNEYS),
+            help="Journeys to run, all of them by default",
+        )
+        parser.add_argument("--iterations", type=int, default=20, help="Runs of each journey")
+        parser.add_argument("--concurrency", type=int, default=1)
+        parser.add_argument("--warmup", type=int, default=2, help="Unrecorded runs first")
+        parser.add_argument("--seed", type=int)
+        parser.add_argument(
+            "--url",
+            help="Benchmark the server at this URL instead of the in-process test client",
+        )
+        parser.add_argument("--output", help="Write the report as JSON to this file")
+        parser.add_argument("--baseline", help="Compare against a report written earlier")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=10,
+            help="Percent a p95 may grow over the baseline before it counts as a regression",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error when the baseline comparison finds a regression",
+        )
+
+    def handle(self, *args, **options):
+        if options["url"]:
+            driver = benchmark.HttpDriver(options["url"])
+        else:
+            driver = benchmark.ClientDriver()
+
+        try:
+            report = benchmark.run(
+                driver,
+                options["journey"] or sorted(benchmark.JOURNEYS),
+                options["iterations"],
+                concurrency=options["concurrency"],
+                warmup=options["warmup"],
+                seed=options["seed"],
+            )
+        except benchmark.JourneyError as e:
+            raise CommandError(str(e))
+
+        self.print_report(report)
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(report, file, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+            regressions = self.print_comparison(
+                benchmark.compare(report, baseline, options["threshold"])
+            )
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{regressions} regressions against {options['baseline']}")
+
+    def print_report(self, report):
+        self.stdout.write(
+            f"{report['requests']} requests in {report['seconds']}s, "
+            f"{report['throughput_rps']} requests/s with {report['concurrency']} concurrent"
+        )
+        for name, journey in report["journeys"].items():
+            line = (
+                f"{name}: {journey['runs']} runs, p50 {journey['p50_ms']}ms, "
+                f"p95 {journey['p95_ms']}ms, {journey['failed']} failed"
+            )
+            self.stdout.write(self.style.ERROR(line) if journey["failed"] else line)
+            for error in journey["errors"]:
+                self.stdout.write(f"  {error}")
+
+        self.stdout.write(
+            f"\n{'endpoint':<55} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}"
+        )
+        for label, row in report["endpoints"].items():
+            queries = "-" if row["queries"] is None else row["queries"]
+            self.stdout.write(
+                f"{label:<55} {row['requests']:>5} {row['p50_ms']:>8} "
+                f"{row['p95_ms']:>8} {row['p99_ms']:>8} {queries:>8}"
+            )
+
+    def print_comparison(self, rows):
+        self.stdout.write(f"\n{'endpoint':<55} {'metric':<8} {'before':>9} {'after':>9} {'change':>8}")
+        regressions = 0
+        for label, metric, before, after, change, regressed in rows:
+            line = f"{label:<55} {metric:<8} {before:>9} {after:>9} {change:>+7.1f}%"
+            if regressed:
+                regressions += 1
+                line = self.style.ERROR(line)
+            self.stdout.write(line)
+
+        if regressions:
+            self.stdout.write(self.style.ERROR(f"{regressions} regressions"))
+        else:
+            self.stdout.write(self.style.SUCCESS("No regressions"))
+        return regressions
@@ -0,0 +1,153 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.utils import timezone
+
+from api.models import MediaBlob
+from api.storage import BLOB_NAME, blob_name, content_hash
+from store.models import Gallery, Product
+
+MODELS = [Product, Gallery]
+
+
+class Command(BaseCommand):
+    help = (
+        "Move existing product and gallery images to content-hash names, "
+        "recount blob references and remove unreferenced blobs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--delete-originals",
+            action="store_true",
+            help="Delete the original files once no row points at them",
+        )
+        parser.add_argument(
+            "--gc-hours",
+            type=int,
+            default=24,
+            help="Delete blobs unreferenced for longer than this many hours (default 24)",
+        )
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        moved = reused = 0
+        # Blob names, including those written by this run: a row of the next
+        # model may already point at one
+        blobs = set(MediaBlob.objects.values_list("name", flat=True))
+        for model in MODELS:
+            field = model._meta.get_field("image")
+            storage = field.storage.backing
+
+            names = (
+                model.objects.exclude(image__in=["", field.default])
+                .exclude(image__isnull=True)
+                .values_list("image", flat=True)
+                .distinct()
+            )
+            for name in list(names):
+                if name in blobs:
+                    continue
+                if not storage.exists(name):
+                    self.stderr.write(f"Missing file {name}, skipped")
+                    continue
+
+                with storage.open(name) as source:
+                    target = blob_name(name, content_hash(source))
+                    if target == name:
+                        # Already named after its content
+                        blobs.add(name)
+                        continue
+
+                    if self.dedupe(options, storage, source, name, target):
+                        reused += 1
+                    else:
+                        moved += 1
+                    blobs.add(target)
+
+        counted = self.recount(options)
+        collected = self.collect(options)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Moved {moved} files, reused {reused} existing blobs, "
+                f"recounted {counted} blobs, removed {collected} unreferenced blobs"
+            )
+        )
+
+    def dedupe(self, options, storage, source, name, target):
+        """
+        Point every row using `name` at its blob, returns True when the
+        blob already existed
+        """
+        existed = storage.exists(target)
+        if options["dry_run"]:
+            self.stdout.write(f"{name} -> {target}{' (duplicate)' if existed else ''}")
+            return existed
+
+        if not existed:
+            storage.save(target, source)
+
+        with transaction.atomic():
+            for model in MODELS:
+                # Variants stay valid, they were generated from the same bytes
+                model.objects.filter(image=name, image_source=name).update(
+                    image=target, image_source=target
+                )
+                model.objects.filter(image=name).update(image=target)
+
+        if options["delete_originals"] and not self.referenced(name):
+            storage.delete(name)
+        return existed
+
+    def referenced(self, name):
+        return any(
+            model.objects.filter(models.Q(image=name) | models.Q(image_source=name)).exists()
+            for model in MODELS
+        )
+
+    def recount(self, options):
+        refs = {}
+        for model in MODELS:
+            for row in model.objects.values("image").annotate(count=models.Count("id")).order_by():
+                refs[row["image"]] = refs.get(row["image"], 0) + row["count"]
+
+        now = timezone.now()
+        changed = []
+        blobs = MediaBlob.objects.only("name", "refs", "unreferenced_since")
+        for blob in blobs.iterator(chunk_size=2000):
+            count = refs.pop(blob.name, 0)
+            # Blobs found unreferenced now are kept for --gc-hours from here
+            since = (blob.unreferenced_since or now) if count == 0 else None
+            if blob.refs != count or blob.unreferenced_since != since:
+                blob.refs = count
+                blob.unreferenced_since = since
+                changed.append(blob)
+
+        # Content-hash names still referenced but missing their row
+        missing = []
+        for name, count in refs.items():
+            match = BLOB_NAME.search(name or "")
+            if match:
+                missing.append(MediaBlob(name=name, sha256=match["digest"], refs=count))
+
+        if not options["dry_run"]:
+            MediaBlob.objects.bulk_update(
+                changed, ["refs", "unreferenced_since"], batch_size=1000
+            )
+            MediaBlob.objects.bulk_create(missing, batch_size=1000, ignore_conflicts=True)
+        return len(changed) + len(missing)
+
+    def collect(self, options):
+        cutoff = timezone.now() - timedelta(hours=options["gc_hours"])
+        unreferenced = MediaBlob.objects.filter(refs=0, unreferenced_since__lt=cutoff)
+        if options["dry_run"]:
+            return unreferenced.count()
+
+        storage = Product._meta.get_field("image").storage
+        count = 0
+        for blob in unreferenced.iterator():
+            storage.delete(blob.name)
+            count += 1
+        return count
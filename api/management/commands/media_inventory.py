@@ -0,0 +1,75 @@
+import json
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.inventory import InventoryError, manifest_entry, record_page, start_scan, walk
+
+
+class Command(BaseCommand):
+    help = (
+        "List the objects of each media tier page by page into the media "
+        "manifest, resuming unfinished scans"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tier", help="Only list this tier")
+        parser.add_argument("--page-size", type=int, default=1000)
+        parser.add_argument(
+            "--max-pages",
+            type=int,
+            help="Stop after this many pages per tier, the next run resumes there",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Start over instead of resuming an unfinished scan",
+        )
+        parser.add_argument(
+            "--output",
+            help="Also write every object as a line of JSON to this file, - for stdout",
+        )
+
+    def handle(self, *args, **options):
+        tiers = [options["tier"]] if options["tier"] else settings.MEDIA_TIERS
+        output = None
+        if options["output"] == "-":
+            output = sys.stdout
+        elif options["output"]:
+            output = open(options["output"], "a")
+
+        try:
+            for tier in tiers:
+                self.scan(tier, options, output)
+        finally:
+            if output not in (None, sys.stdout):
+                output.close()
+
+    def scan(self, tier, options, output):
+        scan = start_scan(tier, restart=options["restart"])
+        pages = 0
+        while True:
+            try:
+                entries, token = walk(tier, scan.token or None, options["page_size"])
+            except InventoryError as e:
+                raise CommandError(str(e))
+
+            record_page(scan, entries, token)
+            if output is not None:
+                for entry in entries:
+                    output.write(json.dumps(manifest_entry(entry, tier)) + "\n")
+            pages += 1
+
+            if token is None:
+                self.stderr.write(
+                    self.style.SUCCESS(f"{tier}: finished, {scan.entries} objects")
+                )
+                return
+            if options["max_pages"] and pages >= options["max_pages"]:
+                self.stderr.write(
+                    self.style.SUCCESS(
+                        f"{tier}: {scan.entries} objects so far, run again to continue"
+                    )
+                )
+                return
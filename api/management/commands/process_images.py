@@ -0,0 +1,47 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from api import imaging
+
+MODELS = ["store.Product", "store.Gallery", "vendor.Vendor", "userauths.Profile"]
+
+
+class Command(BaseCommand):
+    help = "Generate thumbnails and placeholders for images that were not processed yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--model",
+            choices=MODELS,
+            help="Only process the images of this model",
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Process every image again, not only new or changed ones",
+        )
+
+    def handle(self, *args, **options):
+        if imaging.Image is None:
+            raise CommandError("Pillow is not installed")
+
+        for label in [options["model"]] if options["model"] else MODELS:
+            model = apps.get_model(label)
+            default = model._meta.get_field("image").default
+
+            rows = model.objects.exclude(image="").exclude(image__isnull=True)
+            rows = rows.exclude(image=default)
+            if not options["all"]:
+                rows = rows.exclude(image_source=F("image"))
+
+            processed = failed = 0
+            for pk, name in rows.values_list("pk", "image").iterator(chunk_size=500):
+                if imaging.process_image(label, pk, name):
+                    processed += 1
+                else:
+                    failed += 1
+
+            self.stdout.write(
+                self.style.SUCCESS(f"{label}: processed {processed} images, {failed} unreadable")
+            )
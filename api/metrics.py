@@ -0,0 +1,421 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Upper bounds of the histogram buckets, +Inf is added when rendering
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+HELP = {
+    "http_request_duration_seconds": "Time spent handling a request",
+    "http_request_db_queries": "Database queries run by a request",
+    "http_request_db_seconds": "Time spent in database queries by a request",
+    "http_response_size_bytes": "Size of the response body",
+    "http_request_upstream_seconds": "Time spent in outgoing HTTP requests by a request",
+    "media_tier_reads_total": "Media reads per storage tier and result",
+    "media_tier_read_seconds_total": "Time spent reading media per storage tier",
+    "db_connections_opened_total": "Database connections opened, or taken from the pool",
+    "db_connection_reuses_total": "Requests that queried a database on an already open connection",
+    "db_pool_connections": "Connections in the pool by state",
+    "db_pool_requests_waiting": "Threads waiting for a pool connection",
+    "external_service_calls_total": "Calls to external services by result",
+    "external_service_circuit_open": "Whether the circuit of an external service is open",
+    "external_service_in_flight": "Calls in flight to an external service",
+}
+
+# Follows the request across threads and coroutines, async views run it
+# on the event loop and their database calls on a worker thread
+_local = Local()
+
+
+class Registry:
+    """
+    Histograms of one process, keyed by metric name and label values
+
+    Each histogram is stored as [bucket counts..., +Inf count, sum] with
+    non-cumulative counts so snapshots of several processes can be added up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.written = 0.0
+
+    def observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            values = self.histograms.get(key)
+            if values is None:
+                values = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            values[bisect_left(buckets, value)] += 1
+            values[-1] += value
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def snapshot(self):
+        with self.lock:
+            histograms = [
+                {"name": name, "labels": dict(labels), "values": list(values)}
+                for (name, labels), values in self.histograms.items()
+            ]
+            counters = [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.counters.items()
+            ]
+        return {
+            "histograms": histograms,
+            "counters": counters + media_counters(),
+            "gauges": pool_gauges() + service_gauges(),
+        }
+
+
+registry = Registry()
+
+
+def media_counters():
+    from api.tiered_storage import tier_stats
+
+    counters = []
+    for tier, stats in tier_stats.snapshot().items():
+        for result, field in (("hit", "hits"), ("miss", "misses")):
+            counters.append(
+                {
+                    "name": "media_tier_reads_total",
+                    "labels": {"tier": tier, "result": result},
+                    "value": stats[field],
+                }
+            )
+        counters.append(
+            {
+                "name": "media_tier_read_seconds_total",
+                "labels": {"tier": tier},
+                "value": stats["seconds"],
+            }
+        )
+    return counters
+
+
+def pool_gauges():
+    """
+    State of the PostgreSQL connection pools this process opened, see
+    DB_POOL
+    """
+    gauges = []
+    for alias in connections:
+        pools = getattr(type(connections[alias]), "_connection_pools", {})
+        pool = pools.get(alias)
+        if pool is None:
+            continue
+        stats = pool.get_stats()
+        available = stats.get("pool_available", 0)
+        for state, value in (
+            ("idle", available),
+            ("busy", stats.get("pool_size", 0) - available),
+        ):
+            gauges.append(
+                {
+                    "name": "db_pool_connections",
+                    "labels": {"alias": alias, "state": state},
+                    "value": value,
+                }
+            )
+        gauges.append(
+            {
+                "name": "db_pool_requests_waiting",
+                "labels": {"alias": alias},
+                "value": stats.get("requests_waiting", 0),
+            }
+        )
+    return gauges
+
+
+def service_gauges():
+    """
+    Circuit state and calls in flight of the external services, see
+    EXTERNAL_SERVICES
+    """
+    from api.resilience import CircuitBreaker, snapshot
+
+    gauges = []
+    for service, state in snapshot().items():
+        labels = {"service": service}
+        gauges.append(
+            {
+                "name": "external_service_circuit_open",
+                "labels": labels,
+                "value": int(state["state"] != CircuitBreaker.CLOSED),
+            }
+        )
+        gauges.append(
+            {
+                "name": "external_service_in_flight",
+                "labels": labels,
+                "value": state["in_flight"],
+            }
+        )
+    return gauges
+
+
+BUCKETS = {
+    "http_request_duration_seconds": DURATION_BUCKETS,
+    "http_request_db_queries": QUERY_BUCKETS,
+    "http_request_db_seconds": DURATION_BUCKETS,
+    "http_response_size_bytes": SIZE_BUCKETS,
+    "http_request_upstream_seconds": DURATION_BUCKETS,
+}
+
+
+def snapshot_path(pid=None):
+    return os.path.join(settings.METRICS_DIR, f"{pid or os.getpid()}.json")
+
+
+def write_snapshot(force=False):
+    """
+    Save this process's metrics to METRICS_DIR for the other workers to
+    merge, at most every METRICS_FLUSH_INTERVAL seconds
+    """
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - registry.written < settings.METRICS_FLUSH_INTERVAL:
+        return
+    registry.written = now
+
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    path = snapshot_path()
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump(registry.snapshot(), file)
+    os.replace(temporary, path)
+
+
+atexit.register(lambda: write_snapshot(force=True))
+
+
+def alive(pid):
+    """
+    Whether process `pid` is still running, its snapshot is stale otherwise
+    """
+    if os.name == "nt":
+        # os.kill would terminate it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running as another user
+        pass
+    return True
+
+
+def collect():
+    """
+    Metrics of every worker: the snapshots in METRICS_DIR and this process.
+    Histograms and counters are added up, gauges describe one process so
+    they are labelled with its pid. Snapshots of workers that exited are
+    removed
+    """
+    snapshots = [(os.getpid(), registry.snapshot())]
+    if settings.METRICS_DIR:
+        own = snapshot_path()
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, "*.json")):
+            if path == own:
+                continue
+            try:
+                pid = int(os.path.splitext(os.path.basename(path))[0])
+            except ValueError:
+                continue
+            if not alive(pid):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path) as file:
+                    snapshots.append((pid, json.load(file)))
+            except (OSError, ValueError):
+                # Being replaced by its worker right now
+                continue
+
+    histograms = {}
+    counters = {}
+    gauges = {}
+    for pid, snapshot in snapshots:
+        for item in snapshot["histograms"]:
+            key = (item["name"], tuple(sorted(item["labels"].items())))
+            values = histograms.get(key)
+            if values is None:
+                histograms[key] = list(item["values"])
+            else:
+                for index, value in enumerate(item["values"]):
+                    values[index] += value
+        for item in snapshot["counters"]:
+            key = (item["name"], tuple(sorted(item["labels"].items())))
+            counters[key] = counters.get(key, 0) + item["value"]
+        for item in snapshot.get("gauges", []):
+            labels = dict(item["labels"], pid=pid)
+            gauges[(item["name"], tuple(sorted(labels.items())))] = item["value"]
+    return histograms, counters, gauges
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def render():
+    """
+    All metrics in the Prometheus text exposition format
+    """
+    histograms, counters, gauges = collect()
+    lines = []
+
+    for name in sorted({name for name, labels in histograms}):
+        lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} histogram")
+        buckets = BUCKETS[name]
+        for (metric, labels), values in sorted(histograms.items()):
+            if metric != name:
+                continue
+            total = 0
+            for bound, count in zip(buckets + ("+Inf",), values[:-1]):
+                total += count
+                lines.append(f"{name}_bucket{format_labels(labels, le=bound)} {total}")
+            lines.append(f"{name}_sum{format_labels(labels)} {values[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {total}")
+
+    for kind, values in (("counter", counters), ("gauge", gauges)):
+        for name in sorted({name for name, labels in values}):
+            lines.append(f"# HELP {name} {HELP[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetrics:
+    """
+    Queries, database time and outgoing HTTP time of the request being
+    handled
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.upstream_seconds = 0.0
+        # Aliases queried, and those whose connection the request opened
+        self.aliases = set()
+        self.opened = set()
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        self.aliases.add(context["connection"].alias)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+def current():
+    return getattr(_local, "metrics", None)
+
+
+def start_request():
+    _local.metrics = RequestMetrics()
+    return _local.metrics
+
+
+def end_request():
+    _local.metrics = None
+
+
+_requests_instrumented = False
+
+
+def instrument_requests():
+    """
+    Time every call made with the requests library toward the current request
+    """
+    global _requests_instrumented
+    if _requests_instrumented:
+        return
+    import requests
+
+    send = requests.Session.send
+
+    def timed_send(self, *args, **kwargs):
+        metrics = current()
+        if metrics is None:
+            return send(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return send(self, *args, **kwargs)
+        finally:
+            metrics.upstream_seconds += time.perf_counter() - started
+
+    requests.Session.send = timed_send
+    _requests_instrumented = True
+
+
+def connection_opened(sender, connection, **kwargs):
+    registry.inc("db_connections_opened_total", {"alias": connection.alias})
+    metrics = current()
+    if metrics is not None:
+        metrics.opened.add(connection.alias)
+
+
+def instrument_connections():
+    connection_created.connect(connection_opened, dispatch_uid="api.metrics")
+
+
+def server_timing(metrics, seconds):
+    """
+    Server-Timing header value of a request, durations in milliseconds
+    """
+    return (
+        f'db;dur={metrics.db_seconds * 1000:.1f};desc="{metrics.queries} queries", '
+        f"upstream;dur={metrics.upstream_seconds * 1000:.1f}, "
+        f"total;dur={seconds * 1000:.1f}"
+    )
+
+
+def record(view, method, status, seconds, metrics, size):
+    labels = {"view": view, "method": method, "status": status}
+    registry.observe("http_request_duration_seconds", labels, seconds, DURATION_BUCKETS)
+    labels = {"view": view}
+    registry.observe("http_request_db_queries", labels, metrics.queries, QUERY_BUCKETS)
+    registry.observe("http_request_db_seconds", labels, metrics.db_seconds, DURATION_BUCKETS)
+    registry.observe(
+        "http_request_upstream_seconds", labels, metrics.upstream_seconds, DURATION_BUCKETS
+    )
+    if size is not None:
+        registry.observe("http_response_size_bytes", labels, size, SIZE_BUCKETS)
+    for alias in metrics.aliases - metrics.opened:
+        registry.inc("db_connection_reuses_total", {"alias": alias})
+    write_snapshot()
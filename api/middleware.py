@@ -1,31 +1,67 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
 from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
 from django.http import HttpResponseRedirect, HttpResponse
+from contextlib import ExitStack
 import re
 import logging
 import os
+import time
 import requests
 
+from api import metrics, profiling, querycheck, replicas
+
 logger = logging.getLogger(__name__)
 
-class CloudinaryMediaRedirectMiddleware:
+
+class AsyncCapableMiddleware:
+    """
+    Middleware running __acall__ when the rest of the chain is async, under
+    ASGI, so async views are not pushed back onto a thread. Subclasses
+    handle sync requests in call()
+
+    Database connections belong to a thread, so work on them is done with
+    sync_to_async: within a request it always runs on the same thread,
+    the one its ORM calls run on.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return self.call(request)
+
+
+class CloudinaryMediaRedirectMiddleware(AsyncCapableMiddleware):
     """
     DISABLED middleware - now simply passes requests through to avoid redirect loops
     Media files are now handled directly by the media_proxy view
     """
     def __init__(self, get_response):
-        self.get_response = get_response
+        super().__init__(get_response)
         # Get Cloudinary cloud name from settings
         self.cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME') or getattr(settings, 'CLOUDINARY_STORAGE', {}).get('CLOUD_NAME', 'deepsimage')
         logger.info(f"CloudinaryMediaRedirectMiddleware initialized with cloud_name: {self.cloud_name}")
         logger.info("NOTE: This middleware is now disabled and passes all requests through")
 
-    def __call__(self, request):
+    def call(self, request):
         # DISABLED - now we simply pass the request through without redirecting
         # The media_proxy view handles serving media files directly
         
         # Continue with normal request processing
         response = self.get_response(request)
         return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
         
     def serve_image_directly(self, file_path):
         """
@@ -40,3 +76,185 @@ class CloudinaryMediaRedirectMiddleware:
             b'</svg>'
         )
         return HttpResponse(placeholder_svg, content_type='image/svg+xml')
+
+
+class RequestMetricsMiddleware(AsyncCapableMiddleware):
+    """
+    Records the duration, database queries and time, outgoing HTTP time and
+    response size of each request by URL name, served on /metrics
+    """
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        metrics.instrument_requests()
+        metrics.instrument_connections()
+
+    def instrument(self, stack, request_metrics):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(request_metrics))
+
+    def call(self, request):
+        request_metrics = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                self.instrument(stack, request_metrics)
+                response = self.get_response(request)
+        finally:
+            metrics.end_request()
+        return self.finish(request, response, request_metrics, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        request_metrics = metrics.start_request()
+        started = time.perf_counter()
+        stack = ExitStack()
+        try:
+            await sync_to_async(self.instrument)(stack, request_metrics)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            metrics.end_request()
+        return self.finish(request, response, request_metrics, time.perf_counter() - started)
+
+    def finish(self, request, response, request_metrics, seconds):
+        # URL names keep the label values bounded, unlike raw paths
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        size = None if response.streaming else len(response.content)
+        metrics.record(view, request.method, response.status_code, seconds, request_metrics, size)
+
+        if settings.METRICS_SERVER_TIMING:
+            timing = metrics.server_timing(request_metrics, seconds)
+            existing = response.get('Server-Timing')
+            response['Server-Timing'] = f'{existing}, {timing}' if existing else timing
+        return response
+
+
+class NPlusOneMiddleware(AsyncCapableMiddleware):
+    """
+    Flags query shapes a request repeats more than NPLUSONE_THRESHOLD times,
+    enabled with NPLUSONE_ENABLED (DEBUG by default), see api.querycheck
+    """
+    def __init__(self, get_response):
+        if not settings.NPLUSONE_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        with querycheck.detect_n_plus_one(f"{request.method} {request.path}"):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        stack = ExitStack()
+        detector = querycheck.detect_n_plus_one(f"{request.method} {request.path}")
+        await sync_to_async(stack.enter_context)(detector)
+        try:
+            return await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+
+class ProfilingMiddleware(AsyncCapableMiddleware):
+    """
+    Profiles requests staff ask for with an X-Profile header or ?profile=,
+    and a PROFILING_SAMPLE_RATE share of the rest, stored as RequestProfile
+    rows downloadable from the admin, see api.profiling
+
+    Async requests are spread over the event loop and worker threads, which
+    neither profiler follows, and pass through unprofiled.
+    """
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def call(self, request):
+        mode = profiling.requested_mode(request)
+        if mode and profiling.is_staff(request):
+            trigger = 'requested'
+        elif profiling.sampled(request):
+            mode, trigger = settings.PROFILING_MODE, 'sampled'
+        else:
+            return self.get_response(request)
+
+        with profiling.Profile(mode) as profile:
+            response = self.get_response(request)
+
+        try:
+            self.save(request, response, profile, trigger)
+        except Exception:
+            # A profile is never worth failing the request over
+            logger.exception('Could not store the profile of %s', request.path)
+        return response
+
+    def save(self, request, response, profile, trigger):
+        from api.models import RequestProfile
+
+        stacks, stats, report = profile.results()
+        user = getattr(request, 'profiled_by', None) or getattr(request, 'user', None)
+        match = request.resolver_match
+        row = RequestProfile.objects.create(
+            method=request.method,
+            path=request.get_full_path()[:500],
+            view=match.view_name if match else '',
+            status=response.status_code,
+            duration=profile.seconds * 1000,
+            mode=profile.mode,
+            trigger=trigger,
+            user=user if user is not None and user.is_authenticated else None,
+            queries=profile.sql.count,
+            db_time=sum(query['ms'] for query in profile.sql.queries),
+            sql=profile.sql.queries,
+            stacks=stacks,
+            stats=stats,
+            report=report,
+        )
+        RequestProfile.objects.filter(pk__lte=row.pk - settings.PROFILING_KEEP).delete()
+        if trigger == 'requested':
+            response['X-Profile-Id'] = str(row.pk)
+
+
+class ReplicaMiddleware(AsyncCapableMiddleware):
+    """
+    Sends the reads of safe requests to a read replica, see api.replicas.
+    Requests that write, views with use_primary = True and clients that
+    wrote in the last REPLICA_STICKY_SECONDS read from the primary
+    """
+    def __init__(self, get_response):
+        if not settings.REPLICA_DATABASES:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def call(self, request):
+        token = replicas.routing.set(replicas.Routing(replicas.route(request)))
+        try:
+            response = self.get_response(request)
+            state = replicas.routing.get()
+        finally:
+            replicas.routing.reset(token)
+
+        if state.wrote or request.method not in replicas.SAFE_METHODS:
+            replicas.make_sticky(request, response)
+        return response
+
+    async def __acall__(self, request):
+        alias = await sync_to_async(replicas.route)(request)
+        token = replicas.routing.set(replicas.Routing(alias))
+        try:
+            response = await self.get_response(request)
+            state = replicas.routing.get()
+        finally:
+            replicas.routing.reset(token)
+
+        if state.wrote or request.method not in replicas.SAFE_METHODS:
+            await sync_to_async(replicas.make_sticky)(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        if getattr(view_func, 'use_primary', False) or getattr(view_class, 'use_primary', False):
+            replicas.use_primary()
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:56
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('target', models.CharField(choices=[('product', 'Product Image'), ('gallery', 'Product Gallery Image'), ('vendor', 'Vendor Image'), ('profile', 'Profile Image')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('key', models.CharField(max_length=500)),
+                ('content_type', models.CharField(max_length=100)),
+                ('size', models.PositiveBigIntegerField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('expired', 'Expired')], default='pending', max_length=20)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('expires', models.DateTimeField()),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+    ]
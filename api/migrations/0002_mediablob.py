@@ -0,0 +1,23 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=500, unique=True)),
+                ('sha256', models.CharField(db_index=True, max_length=64)),
+                ('refs', models.PositiveIntegerField(default=0)),
+                ('date', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_mediablob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=500, unique=True)),
+                ('tier', models.CharField(max_length=20)),
+                ('date', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_medialocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaInventoryScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.CharField(max_length=20, unique=True)),
+                ('token', models.TextField(blank=True, default='')),
+                ('entries', models.PositiveBigIntegerField(default=0)),
+                ('started', models.DateTimeField()),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MediaManifest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tier', models.CharField(max_length=20)),
+                ('key', models.CharField(db_index=True, max_length=500)),
+                ('size', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('modified', models.DateTimeField(blank=True, null=True)),
+                ('seen', models.DateTimeField()),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tier', 'key'), name='unique_media_manifest')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_media_inventory'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateTimeField(auto_now_add=True)),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.CharField(max_length=500)),
+                ('view', models.CharField(blank=True, max_length=200)),
+                ('status', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField(help_text='Milliseconds')),
+                ('mode', models.CharField(choices=[('sample', 'Stack sampler'), ('cprofile', 'cProfile')], max_length=20)),
+                ('trigger', models.CharField(choices=[('requested', 'Requested by staff'), ('sampled', 'Sampled')], max_length=20)),
+                ('queries', models.PositiveIntegerField(default=0)),
+                ('db_time', models.FloatField(default=0, help_text='Milliseconds')),
+                ('sql', models.JSONField(blank=True, default=list)),
+                ('stacks', models.TextField(blank=True)),
+                ('stats', models.BinaryField(blank=True, null=True)),
+                ('report', models.TextField(blank=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-date'],
+            },
+        ),
+    ]
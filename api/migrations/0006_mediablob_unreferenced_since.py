@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-19 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mediablob',
+            name='unreferenced_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
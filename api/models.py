@@ -1,3 +1,144 @@
+import uuid
+
 from django.db import models
 
+from userauths.models import User
+
 # Create your models here.
+
+
+class UploadSession(models.Model):
+    """
+    A direct-to-storage image upload, see api.uploads
+    """
+    TARGET = (
+        ("product", "Product Image"),
+        ("gallery", "Product Gallery Image"),
+        ("vendor", "Vendor Image"),
+        ("profile", "Profile Image"),
+    )
+    STATUS = (
+        ("pending", "Pending"),
+        ("completed", "Completed"),
+        ("expired", "Expired"),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    target = models.CharField(max_length=20, choices=TARGET)
+    object_id = models.PositiveBigIntegerField()
+    key = models.CharField(max_length=500)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS, default="pending")
+    date = models.DateTimeField(auto_now_add=True)
+    expires = models.DateTimeField()
+    completed = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"{self.target} {self.object_id} - {self.status}"
+
+
+class MediaBlob(models.Model):
+    """
+    A stored file named after the hash of its content, see api.storage
+    """
+    name = models.CharField(max_length=500, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    # Number of image fields pointing at the blob
+    refs = models.PositiveIntegerField(default=0)
+    # When refs last dropped to 0, None while referenced
+    unreferenced_since = models.DateTimeField(null=True, blank=True)
+    date = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class MediaLocation(models.Model):
+    """
+    The storage tier a media key was last found on, see api.tiered_storage
+    """
+    key = models.CharField(max_length=500, unique=True)
+    tier = models.CharField(max_length=20)
+    date = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.key} - {self.tier}"
+
+
+class MediaManifest(models.Model):
+    """
+    An object found on a storage tier by the media inventory, see api.inventory
+    """
+    tier = models.CharField(max_length=20)
+    key = models.CharField(max_length=500, db_index=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    modified = models.DateTimeField(null=True, blank=True)
+    # When the inventory last listed the object
+    seen = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["tier", "key"], name="unique_media_manifest")
+        ]
+
+    def __str__(self):
+        return f"{self.tier}:{self.key}"
+
+
+class MediaInventoryScan(models.Model):
+    """
+    Progress of the inventory of one tier, so listing resumes where it stopped
+    """
+    tier = models.CharField(max_length=20, unique=True)
+    # Continuation token of the next page, empty before the first page
+    token = models.TextField(blank=True, default="")
+    entries = models.PositiveBigIntegerField(default=0)
+    started = models.DateTimeField()
+    finished = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.tier} - {'finished' if self.finished else 'in progress'}"
+
+
+class RequestProfile(models.Model):
+    """
+    A profiled request with its collapsed stacks and queries, see api.profiling
+    """
+    MODE = (
+        ("sample", "Stack sampler"),
+        ("cprofile", "cProfile"),
+    )
+    TRIGGER = (
+        ("requested", "Requested by staff"),
+        ("sampled", "Sampled"),
+    )
+
+    date = models.DateTimeField(auto_now_add=True)
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    view = models.CharField(max_length=200, blank=True)
+    status = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text="Milliseconds")
+    mode = models.CharField(max_length=20, choices=MODE)
+    trigger = models.CharField(max_length=20, choices=TRIGGER)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    queries = models.PositiveIntegerField(default=0)
+    db_time = models.FloatField(default=0, help_text="Milliseconds")
+    sql = models.JSONField(default=list, blank=True)
+    # Collapsed stacks, one "frame;frame;frame count" line each, the input
+    # of flamegraph.pl, speedscope and similar
+    stacks = models.TextField(blank=True)
+    # pstats dump and report of cProfile runs
+    stats = models.BinaryField(null=True, blank=True)
+    report = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ["-date"]
+
+    def __str__(self):
+        return f"{self.method} {self.path} - {self.duration:.0f}ms"
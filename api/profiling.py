@@ -0,0 +1,216 @@
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from api import querycheck
+
+MODES = ("sample", "cprofile")
+
+# What frame_label reads of a code object, for functions cProfile names
+Code = namedtuple("Code", ["co_filename", "co_name"])
+
+
+def requested_mode(request):
+    """
+    The mode asked for with the X-Profile header or ?profile=, None when
+    profiling was not asked for. "1" and unknown values mean the default mode
+    """
+    value = request.headers.get("X-Profile") or request.GET.get("profile")
+    if not value or value in ("0", "false"):
+        return None
+    return value if value in MODES else settings.PROFILING_MODE
+
+
+def is_staff(request):
+    """
+    Staff signed in to the admin, or holding a staff access token
+    """
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return user.is_staff
+
+    # The API itself does not authenticate, so the token is only checked
+    # for requests asking to be profiled
+    from rest_framework.exceptions import AuthenticationFailed
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return False
+    if result is None:
+        return False
+    request.profiled_by = result[0]
+    return result[0].is_staff
+
+
+def sampled(request):
+    rate = settings.PROFILING_SAMPLE_RATE
+    if not rate or random.random() >= rate:
+        return False
+    paths = settings.PROFILING_SAMPLE_PATHS
+    return not paths or any(re.search(pattern, request.path) for pattern in paths)
+
+
+def frame_label(code):
+    """
+    function (file) of a frame, with project files relative to the project
+    and library files relative to site-packages
+    """
+    filename = os.path.abspath(code.co_filename)
+    root = str(settings.BASE_DIR) + os.sep
+    if "site-packages" + os.sep in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(root):
+        filename = filename[len(root):]
+    else:
+        filename = os.path.basename(filename)
+    name = getattr(code, "co_qualname", code.co_name)
+    # Collapsed stacks separate frames with ";"
+    return f"{name} ({filename})".replace(";", ":")
+
+
+class StackSampler:
+    """
+    Samples the stack of one thread every `interval` seconds from a
+    background thread, counting identical stacks below the root frame
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+
+    def start(self, root):
+        self.ident = threading.get_ident()
+        self.root = root
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            stack = []
+            while frame is not None and frame is not self.root:
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def collapsed_from_stats(stats):
+    """
+    Collapsed caller;callee stacks from cProfile stats, weighted by the
+    callee's own time in microseconds. cProfile keeps only one level of
+    callers, so these are the edges of the call graph rather than whole
+    stacks
+    """
+    lines = []
+    for (filename, lineno, name), (_, _, tottime, _, callers) in stats.stats.items():
+        callee = frame_label(Code(filename, name))
+        for (caller_file, _, caller_name), caller_stats in callers.items():
+            # The callee's own time in calls from this caller
+            micros = round(caller_stats[2] * 1_000_000)
+            if micros:
+                caller = frame_label(Code(caller_file, caller_name))
+                lines.append(f"{caller};{callee} {micros}\n")
+        if not callers and round(tottime * 1_000_000):
+            lines.append(f"{callee} {round(tottime * 1_000_000)}\n")
+    return "".join(lines)
+
+
+class SQLRecorder:
+    """
+    connection.execute_wrapper hook listing the queries of a request with
+    their duration and origin
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.queries = []
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            if len(self.queries) < self.limit:
+                self.queries.append(
+                    {
+                        "sql": sql,
+                        "ms": round((time.perf_counter() - started) * 1000, 3),
+                        "origin": querycheck.origin(),
+                    }
+                )
+
+
+class Profile:
+    """
+    Profiles the code run inside it, with the stack sampler or cProfile,
+    and records its queries
+    """
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.sql = SQLRecorder(settings.PROFILING_SQL_LIMIT)
+        self.stack = ExitStack()
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.stack.enter_context(connection.execute_wrapper(self.sql))
+        self.started = time.perf_counter()
+        if self.mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Python 3.12 allows one cProfile at a time per process
+                self.mode = "sample"
+        if self.mode != "cprofile":
+            self.profiler = StackSampler(settings.PROFILING_INTERVAL / 1000)
+            # Stacks start below the frame profiling the request
+            self.profiler.start(sys._getframe(1))
+        return self
+
+    def __exit__(self, *exc):
+        if self.mode == "cprofile":
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        self.seconds = time.perf_counter() - self.started
+        self.stack.close()
+
+    def results(self):
+        """
+        (collapsed stacks, pstats dump or None, text report)
+        """
+        if self.mode != "cprofile":
+            return self.profiler.collapsed(), None, ""
+        stats = pstats.Stats(self.profiler)
+        report = io.StringIO()
+        stats.stream = report
+        stats.sort_stats("cumulative").print_stats(50)
+        return collapsed_from_stats(stats), marshal.dumps(stats.stats), report.getvalue()
@@ -0,0 +1,131 @@
+import logging
+import os
+import re
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+IN_LIST = re.compile(r"\bIN \((?:[^()]*)\)", re.IGNORECASE)
+SPACE = re.compile(r"\s+")
+
+# Project files wrapping every query, never the origin of one
+INSTRUMENTATION = ("api/querycheck.py", "api/metrics.py", "api/middleware.py")
+
+
+class NPlusOneError(AssertionError):
+    """
+    Raised in strict mode when the same query shape repeats too often
+    """
+
+
+def fingerprint(sql):
+    """
+    The shape of a query: literals and IN lists replaced, so queries that
+    differ only in their values compare equal
+    """
+    sql = STRING.sub("?", sql)
+    sql = NUMBER.sub("?", sql)
+    sql = IN_LIST.sub("IN (...)", sql)
+    return SPACE.sub(" ", sql).strip()
+
+
+def origin():
+    """
+    The innermost frame of project code that ran the query, with the
+    library frame that evaluated it when that is not Django itself, e.g. a
+    serializer reading a relation
+    """
+    root = str(settings.BASE_DIR)
+    via = None
+    for frame in reversed(traceback.extract_stack()[:-2]):
+        if frame.filename.startswith("<"):
+            continue
+        filename = os.path.abspath(frame.filename)
+        if "site-packages" in filename:
+            library = filename.split("site-packages" + os.sep, 1)[1].replace(os.sep, "/")
+            if via is None and not library.startswith("django/"):
+                via = f"{library}:{frame.lineno} in {frame.name}"
+            continue
+        if not filename.startswith(root):
+            continue
+        path = os.path.relpath(filename, root).replace(os.sep, "/")
+        if path in INSTRUMENTATION:
+            continue
+        where = f"{path}:{frame.lineno} in {frame.name}"
+        return f"{where} (via {via})" if via else where
+    return f"unknown (via {via})" if via else "unknown"
+
+
+class QueryTracker:
+    """
+    Counts queries by shape, remembering where a shape first went over
+    the threshold
+    """
+
+    def __init__(self, threshold=None, ignore=None):
+        self.threshold = settings.NPLUSONE_THRESHOLD if threshold is None else threshold
+        ignore = settings.NPLUSONE_IGNORE if ignore is None else ignore
+        self.ignore = [re.compile(pattern) for pattern in ignore]
+        self.counts = Counter()
+        self.origins = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        shape = fingerprint(sql)
+        self.counts[shape] += 1
+        if self.counts[shape] == self.threshold + 1:
+            self.origins[shape] = origin()
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        """
+        (shape, count, origin) of each shape run more than threshold times
+        """
+        return [
+            (shape, count, self.origins.get(shape, "unknown"))
+            for shape, count in self.counts.most_common()
+            if count > self.threshold
+            and not any(pattern.search(shape) for pattern in self.ignore)
+        ]
+
+    def report(self, label):
+        lines = [f"Repeated queries in {label}:"]
+        for shape, count, where in self.repeated():
+            lines.append(f"  {count}x from {where}: {shape[:300]}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def track_queries(threshold=None, ignore=None):
+    tracker = QueryTracker(threshold, ignore)
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(tracker))
+        yield tracker
+
+
+@contextmanager
+def detect_n_plus_one(label="block", threshold=None, strict=None, ignore=None):
+    """
+    Flag query shapes repeated more than threshold times inside the block,
+    raising NPlusOneError in strict mode and logging a warning otherwise
+
+        with detect_n_plus_one("product list"):
+            client.get("/api/v1/products/")
+    """
+    strict = settings.NPLUSONE_STRICT if strict is None else strict
+    with track_queries(threshold, ignore) as tracker:
+        yield tracker
+
+    if tracker.repeated():
+        message = tracker.report(label)
+        if strict:
+            raise NPlusOneError(message)
+        logger.warning(message)
@@ -0,0 +1,136 @@
+import logging
+import random
+import time
+from contextvars import ContextVar
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+STICKY_COOKIE = "read_primary"
+
+# Replica aliases found unreachable and the monotonic time to try them again
+unavailable = {}
+
+
+class Routing:
+    """
+    Where the reads of the current request go: a replica alias, or None
+    once the request wrote or must read from the primary
+    """
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.wrote = False
+
+
+routing = ContextVar("routing", default=None)
+
+
+def replicas():
+    return list(settings.REPLICA_DATABASES)
+
+
+def available(alias):
+    retry = unavailable.get(alias)
+    if retry is None:
+        return True
+    if time.monotonic() < retry:
+        return False
+    unavailable.pop(alias, None)
+    return True
+
+
+def pick_replica():
+    """
+    A replica that accepts connections, None when none does
+    """
+    aliases = [alias for alias in replicas() if available(alias)]
+    random.shuffle(aliases)
+    for alias in aliases:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as e:
+            logger.warning("Replica %s unavailable, reading from the primary: %s", alias, e)
+            unavailable[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+            continue
+        return alias
+    return None
+
+
+def client_key(request):
+    address = request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")[0].strip()
+    address = address or request.META.get("REMOTE_ADDR", "")
+    return "replica-sticky:" + sha256(address.encode()).hexdigest()[:32]
+
+
+def is_sticky(request):
+    """
+    Whether the client wrote recently enough that a replica may not have its
+    write yet. The cookie covers browsers sending cookies, the cache flag on
+    the client address those that don't, e.g. cross-origin fetches
+    """
+    if request.COOKIES.get(STICKY_COOKIE):
+        return True
+    return bool(cache.get(client_key(request)))
+
+
+def make_sticky(request, response):
+    seconds = settings.REPLICA_STICKY_SECONDS
+    response.set_cookie(STICKY_COOKIE, "1", max_age=seconds, httponly=True, samesite="Lax")
+    cache.set(client_key(request), True, seconds)
+
+
+def route(request):
+    """
+    Where the reads of a request go: safe requests of clients that did not
+    write lately to a replica, None for everything else
+    """
+    if request.method in SAFE_METHODS and not is_sticky(request):
+        return pick_replica()
+    return None
+
+
+def use_primary():
+    """
+    Send the remaining reads of the current request to the primary
+    """
+    state = routing.get()
+    if state is not None:
+        state.alias = None
+
+
+class ReplicaRouter:
+    """
+    Reads of requests routed by ReplicaMiddleware go to the replica picked
+    for them, all other queries and every write to the primary. A write
+    sends the rest of the request's reads to the primary too
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if state is None or state.alias is None:
+            return "default"
+        # Reads inside a transaction must see its writes
+        if connections["default"].in_atomic_block:
+            return "default"
+        return state.alias
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            state.alias = None
+            state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema through replication
+        return db not in settings.REPLICA_DATABASES
@@ -0,0 +1,254 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+
+from api import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceUnavailable(requests.ConnectionError):
+    """
+    Raised instead of calling a service whose circuit is open or whose
+    concurrent calls are all taken. A requests.ConnectionError, so callers
+    already handling network failures fail fast the same way
+    """
+
+
+class CircuitOpen(ServiceUnavailable):
+    pass
+
+
+class BulkheadFull(ServiceUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failures, rejecting calls for `reset`
+    seconds, then lets a single trial call through: its success closes the
+    circuit again, its failure opens it for another `reset` seconds
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures, reset, clock=time.monotonic):
+        self.failures = failures
+        self.reset = reset
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.state = self.CLOSED
+        self.failed = 0
+        self.opened = 0.0
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and self.clock() - self.opened >= self.reset:
+                self.state = self.HALF_OPEN
+                return True
+            # Open, or half open with the trial call in flight
+            return False
+
+    def succeeded(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failed = 0
+
+    def failed_call(self):
+        with self.lock:
+            self.failed += 1
+            if self.state == self.HALF_OPEN or self.failed >= self.failures:
+                self.state = self.OPEN
+                self.opened = self.clock()
+
+
+class Bulkhead:
+    """
+    At most `limit` concurrent calls, the next one waits up to `wait`
+    seconds for a slot
+    """
+
+    def __init__(self, limit, wait=0):
+        self.limit = limit
+        self.wait = wait
+        self.slots = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+
+    def acquire(self, wait=None):
+        wait = self.wait if wait is None else wait
+        acquired = self.slots.acquire(timeout=wait) if wait else self.slots.acquire(blocking=False)
+        if not acquired:
+            return False
+        with self.lock:
+            self.in_flight += 1
+        return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+        self.slots.release()
+
+
+class Service:
+    """
+    An external service with its own breaker, bulkhead and timeout
+    """
+
+    def __init__(self, name, timeout, concurrency, failures, reset, wait=0):
+        self.name = name
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failures, reset)
+        self.bulkhead = Bulkhead(concurrency, wait)
+
+    def count(self, result):
+        metrics.registry.inc(
+            "external_service_calls_total", {"service": self.name, "result": result}
+        )
+
+    @contextmanager
+    def guard(self, wait=None):
+        """
+        Run the block as one call: rejected with CircuitOpen or BulkheadFull
+        without running it, a failure when it raises anything but
+        FileNotFoundError (a miss is a healthy answer) or calls fail() on
+        the yielded Call. Async callers pass wait=0 so a full bulkhead never
+        blocks the event loop
+        """
+        if not self.breaker.allow():
+            self.count("circuit_open")
+            raise CircuitOpen(f"{self.name} circuit is open")
+        if not self.bulkhead.acquire(wait):
+            self.count("bulkhead_full")
+            if self.breaker.state == CircuitBreaker.HALF_OPEN:
+                # The trial call never ran, open again rather than stay stuck
+                self.breaker.failed_call()
+            raise BulkheadFull(f"{self.name} has {self.bulkhead.limit} calls in flight")
+        call = Call()
+        try:
+            yield call
+        except FileNotFoundError:
+            self.finished(call.ok)
+            raise
+        except BaseException:
+            self.finished(False)
+            raise
+        else:
+            self.finished(call.ok)
+        finally:
+            self.bulkhead.release()
+
+    def finished(self, ok):
+        if ok:
+            self.breaker.succeeded()
+            self.count("success")
+        else:
+            was = self.breaker.state
+            self.breaker.failed_call()
+            self.count("failure")
+            if was != CircuitBreaker.OPEN and self.breaker.state == CircuitBreaker.OPEN:
+                logger.warning(
+                    "%s circuit opened, failing fast for %ss", self.name, self.breaker.reset
+                )
+
+
+class Call:
+    """
+    One guarded call, failed by its caller when it got an error back
+    instead of an exception
+    """
+
+    def __init__(self):
+        self.ok = True
+
+    def fail(self):
+        self.ok = False
+
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+def service(name):
+    """
+    The Service configured as EXTERNAL_SERVICES[name], shared by the
+    threads of this process
+    """
+    with _services_lock:
+        if name not in _services:
+            _services[name] = Service(name, **settings.EXTERNAL_SERVICES[name])
+        return _services[name]
+
+
+def service_for_url(url):
+    """
+    Name of the service behind url, None for hosts that are not an external
+    service, see EXTERNAL_SERVICE_HOSTS
+    """
+    host = (urlsplit(url).hostname or "").lower()
+    for suffix, name in settings.EXTERNAL_SERVICE_HOSTS.items():
+        if host == suffix or host.endswith("." + suffix):
+            return name
+    return None
+
+
+def reset():
+    """
+    Forget every breaker and bulkhead, e.g. after changing EXTERNAL_SERVICES
+    """
+    with _services_lock:
+        _services.clear()
+
+
+def snapshot():
+    """
+    Breaker state and calls in flight of each service called so far
+    """
+    with _services_lock:
+        services = list(_services.values())
+    return {
+        item.name: {"state": item.breaker.state, "in_flight": item.bulkhead.in_flight}
+        for item in services
+    }
+
+
+_requests_guarded = False
+
+
+def guard_requests():
+    """
+    Put every call made with requests to an external service, Cloudinary,
+    Stripe, PayPal and MailerSend (directly or through Anymail), behind the
+    service's breaker and bulkhead, waiting no longer than its timeout.
+    Server errors count as failures
+    """
+    global _requests_guarded
+    if _requests_guarded:
+        return
+
+    send = requests.Session.send
+
+    def guarded_send(self, request, **kwargs):
+        name = service_for_url(request.url)
+        if name is None:
+            return send(self, request, **kwargs)
+
+        target = service(name)
+        timeout = kwargs.get("timeout")
+        if timeout is None or (isinstance(timeout, (int, float)) and timeout > target.timeout):
+            kwargs["timeout"] = target.timeout
+        with target.guard() as call:
+            response = send(self, request, **kwargs)
+            if response.status_code >= 500:
+                call.fail()
+        return response
+
+    requests.Session.send = guarded_send
+    _requests_guarded = True
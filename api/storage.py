@@ -0,0 +1,171 @@
+import hashlib
+import posixpath
+import re
+
+from django.core.files.storage import Storage, default_storage
+from django.db import models
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from api.imaging import strip_metadata
+from api.models import MediaBlob
+
+
+def content_hash(content):
+    """
+    sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    if hasattr(content, "seek"):
+        content.seek(0)
+    for chunk in content.chunks():
+        digest.update(chunk)
+    if hasattr(content, "seek"):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+BLOB_NAME = re.compile(r"(^|/)(?P<digest>[0-9a-f]{64})(\.[^/]*)?$")
+
+
+def blob_name(name, digest):
+    directory = posixpath.dirname(name)
+    extension = posixpath.splitext(name)[1].lower()
+    return posixpath.join(directory, f"{digest}{extension}")
+
+
+@deconstructible
+class DedupStorage(Storage):
+    """
+    Stores each distinct file once, named after its content hash
+
+    Images are stored without their EXIF metadata. Saving a file whose
+    content is already stored skips the upload and returns the existing
+    name. A MediaBlob row per file counts the image fields pointing at it
+    (see add_ref and the receivers below), and delete() leaves files that
+    are still referenced alone.
+    """
+
+    def __init__(self, backing=None):
+        self._backing = backing
+
+    @property
+    def backing(self):
+        return self._backing or default_storage
+
+    def _save(self, name, content):
+        # No database access here, uploads may run on worker threads
+        content = strip_metadata(content) or content
+        name = blob_name(name, content_hash(content))
+
+        if self.backing.exists(name):
+            return name
+
+        stored = self.backing.save(name, content)
+        if stored != name:
+            # Another upload of the same content won the race
+            self.backing.delete(stored)
+        return name
+
+    def _open(self, name, mode="rb"):
+        return self.backing.open(name, mode)
+
+    def get_available_name(self, name, max_length=None):
+        # Names come from the content hash, an existing name is the same file
+        return name
+
+    def generate_filename(self, filename):
+        return self.backing.generate_filename(filename)
+
+    def delete(self, name):
+        if MediaBlob.objects.filter(name=name, refs__gt=0).exists():
+            return
+        self.backing.delete(name)
+        MediaBlob.objects.filter(name=name).delete()
+
+    def exists(self, name):
+        return self.backing.exists(name)
+
+    def listdir(self, path):
+        return self.backing.listdir(path)
+
+    def size(self, name):
+        return self.backing.size(name)
+
+    def url(self, name):
+        return self.backing.url(name)
+
+    def path(self, name):
+        return self.backing.path(name)
+
+    def get_accessed_time(self, name):
+        return self.backing.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.backing.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.backing.get_modified_time(name)
+
+
+dedup_storage = DedupStorage()
+
+
+def get_dedup_storage():
+    # Used as a callable `storage=` so migrations do not depend on settings
+    return dedup_storage
+
+
+def add_ref(name, count=1):
+    match = BLOB_NAME.search(name or "")
+    if not match:
+        return
+    blob, created = MediaBlob.objects.get_or_create(
+        name=name, defaults={"sha256": match["digest"], "refs": count}
+    )
+    if not created:
+        MediaBlob.objects.filter(pk=blob.pk).update(
+            refs=models.F("refs") + count, unreferenced_since=None
+        )
+
+
+def remove_ref(name):
+    if name:
+        # The last reference going starts the dedupe_media --gc-hours clock
+        MediaBlob.objects.filter(name=name, refs__gt=0).update(
+            refs=models.F("refs") - 1,
+            unreferenced_since=models.Case(
+                models.When(refs=1, then=models.Value(timezone.now())),
+                default=models.F("unreferenced_since"),
+            ),
+        )
+
+
+def remember_media(sender, instance, **kwargs):
+    instance._previous_image = None
+    if instance.pk:
+        instance._previous_image = (
+            sender.objects.filter(pk=instance.pk).values_list("image", flat=True).first()
+        )
+
+
+def count_media(sender, instance, created, **kwargs):
+    previous = getattr(instance, "_previous_image", None)
+    current = instance.image.name if instance.image else ""
+    if previous == current and not created:
+        return
+    remove_ref(previous)
+    add_ref(current)
+
+
+def release_media(sender, instance, **kwargs):
+    remove_ref(instance.image.name if instance.image else "")
+
+
+def media_created(instances):
+    """
+    Count the images of rows created with bulk_create, which sends no signals
+    """
+    for instance in instances:
+        if instance.image:
+            add_ref(instance.image.name)
@@ -1,3 +1,1812 @@
-from django.test import TestCase
+import asyncio
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib.util import find_spec
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import requests
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import DatabaseError, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, clear_url_caches, resolve
+from django.utils import timezone
+from django.utils.timezone import localdate
+from mailersend import emails
+from PIL import ExifTags, Image
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from backend import settings as project_settings
+from backend import urls as backend_urls
+
+from api import async_http, metrics, replicas, resilience
+from api import urls as api_urls
+from api.benchmark import ClientDriver, accept_email
+from api.imaging import VARIANT_SIZES, strip_metadata
+from api.models import MediaBlob, MediaLocation, RequestProfile, UploadSession
+from api.profiling import StackSampler
+from api.querycheck import NPlusOneError, detect_n_plus_one, fingerprint
+from api.resilience import Bulkhead, BulkheadFull, CircuitBreaker, CircuitOpen, Service
+from api.tiered_storage import (
+    MISS_CACHE_KEY,
+    CloudinaryStorage,
+    TieredStorage,
+    get_media_storage,
+)
+from store.models import (
+    Cart,
+    CartOrder,
+    CartOrderItem,
+    Category,
+    Color,
+    Coupon,
+    Gallery,
+    Notification,
+    Product,
+    ProductDailyViews,
+    Review,
+    Size,
+    Specification,
+    Tax,
+    VendorDailySales,
+    Wishlist,
+)
+from store.async_views import (
+    PAYPAL_ORDER_URL,
+    PAYPAL_TOKEN_CACHE_KEY,
+    PAYPAL_TOKEN_URL,
+    STRIPE_SESSION_URL,
+)
+from store.product_views import product_view_buffer
+from userauths.models import User
+from vendor.models import Vendor
+
+# queries and payload (response bytes) are upper bounds for one request
+# against the dataset of EndpointBudgetTests, path and data are formatted with
+# its ids, staff requests are made logged in as a staff user
+Budget = namedtuple(
+    "Budget",
+    ["method", "path", "queries", "payload", "data", "staff"],
+    defaults=[None, False],
+)
+
+BUDGETS = {
+    "": Budget("get", "/api/", 0, 512),
+    "v1/user/token/": Budget(
+        "post", "/api/v1/user/token/", 3, 1024,
+        {"email": "buyer0@example.com", "password": "secret-pass-1"},
+    ),
+    "v1/user/token/refresh/": Budget(
+        "post", "/api/v1/user/token/refresh/", 7, 768,
+        {"refresh": "{refresh}"},
+    ),
+    "v1/user/register/": Budget(
+        "post", "/api/v1/user/register/", 8, 256,
+        {
+            "full_name": "New Buyer",
+            "email": "new@example.com",
+            "phone": "123",
+            "password": "Secret-pass-2",
+            "password2": "Secret-pass-2",
+        },
+    ),
+    "v1/user/password-reset/<email>/": Budget(
+        "get", "/api/v1/user/password-reset/buyer0@example.com/", 6, 512,
+    ),
+    "v1/user/password-change/": Budget(
+        "post", "/api/v1/user/password-change/", 1, 256,
+        {"otp": "wrong", "uidb64": "{buyer}", "password": "long-enough-1"},
+    ),
+    "v1/user/profile/<user_id>/": Budget("get", "/api/v1/user/profile/{buyer}/", 5, 1024),
+    "v1/site-settings/": Budget("get", "/api/v1/site-settings/", 4, 256),
+    "v1/category/": Budget("get", "/api/v1/category/", 1, 512),
+    "v1/products/": Budget("get", "/api/v1/products/", 7, 37_888),
+    "v1/products/<slug>/": Budget("get", "/api/v1/products/{slug}/", 10, 3072),
+    "v1/trending-products/": Budget("get", "/api/v1/trending-products/", 8, 36_352),
+    "v1/uploads/": Budget(
+        "post", "/api/v1/uploads/", 4, 768,
+        {
+            "target": "product",
+            "object_id": "{product}",
+            "filename": "a.jpg",
+            "content_type": "image/jpeg",
+            "size": 1000,
+        },
+        True,
+    ),
+    "v1/cart-view/": Budget(
+        "post", "/api/v1/cart-view/", 7, 256,
+        {
+            "product_id": "{product}",
+            "user_id": "{buyer}",
+            "qty": 1,
+            "price": "10.00",
+            "shipping_amount": "2.00",
+            "country": "Nepal",
+            "size": "M",
+            "color": "Red",
+            "cart_id": "cart-new",
+        },
+    ),
+    "v1/cart-list/<str:cart_id>/<int:user_id>/": Budget(
+        "get", "/api/v1/cart-list/cart-0/{buyer}/", 6, 7680,
+    ),
+    "v1/cart-list/<str:cart_id>/null/": Budget("get", "/api/v1/cart-list/cart-0/null/", 5, 7680),
+    "v1/cart-list/<str:cart_id>/": Budget("get", "/api/v1/cart-list/cart-0/", 5, 7680),
+    "v1/cart-detail/<str:cart_id>/<int:user_id>/": Budget(
+        "get", "/api/v1/cart-detail/cart-0/{buyer}/", 2, 256,
+    ),
+    "v1/cart-detail/<str:cart_id>/": Budget("get", "/api/v1/cart-detail/cart-0/", 1, 256),
+    "v1/cart-delete/<str:cart_id>/<str:item_id>/<int:user_id>/": Budget(
+        "delete", "/api/v1/cart-delete/cart-0/{cart_item}/{buyer}/", 3, 256,
+    ),
+    "v1/cart-delete/<str:cart_id>/<str:item_id>/": Budget(
+        "delete", "/api/v1/cart-delete/cart-1/{cart_item_guest}/", 2, 256,
+    ),
+    "v1/checkout/<order_oid>/": Budget("get", "/api/v1/checkout/{order}/", 19, 23_296),
+    "v1/coupon/": Budget(
+        "post", "/api/v1/coupon/", 9, 256,
+        {"order_oid": "{order}", "coupon_code": "SAVE0"},
+    ),
+    "v1/reviews/<product_id>/": Budget("get", "/api/v1/reviews/{product}/", 6, 6656),
+    "v1/search/": Budget("get", "/api/v1/search/?query=Product", 7, 36_352),
+    "v1/customer/orders/<user_id>/": Budget("get", "/api/v1/customer/orders/{buyer}/", 25, 70_400),
+    "v1/customer/order/<user_id>/<order_oid>/": Budget(
+        "get", "/api/v1/customer/order/{buyer}/{order}/", 25, 24_320,
+    ),
+    "v1/customer/wishlist/<user_id>/": Budget("get", "/api/v1/customer/wishlist/{buyer}/", 6, 6912),
+    "v1/customer/notification/<user_id>/": Budget(
+        "get", "/api/v1/customer/notification/{buyer}/", 10, 12_800,
+    ),
+    "v1/customer/notification/<user_id>/<noti_id>/": Budget(
+        "get", "/api/v1/customer/notification/{buyer}/{buyer_notification}/", 11, 4352,
+    ),
+    "v1/vendor/stats/<vendor_id>/": Budget("get", "/api/v1/vendor/stats/{vendor}/", 3, 256),
+    "v1/vendor/overview/<vendor_id>/": Budget("get", "/api/v1/vendor/overview/{vendor}/", 5, 256),
+    "v1/vendor-orders-chart/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-orders-chart/{vendor}/", 3, 512,
+    ),
+    "v1/vendor-products-chart/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-products-chart/{vendor}/", 3, 512,
+    ),
+    "v1/vendor/analytics/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor/analytics/{vendor}/", 3, 3840,
+    ),
+    "v1/vendor/products/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor/products/{vendor}/", 8, 13_824,
+    ),
+    "v1/vendor/orders/<vendor_id>/": Budget("get", "/api/v1/vendor/orders/{vendor}/", 25, 93_440),
+    "v1/vendor/export/<vendor_id>/<kind>/": Budget(
+        "get", "/api/v1/vendor/export/{vendor}/orders/", 2, 1024,
+    ),
+    "v1/vendor/orders/<vendor_id>/<order_oid>/": Budget(
+        "get", "/api/v1/vendor/orders/{vendor}/{order}/", 25, 24_320,
+    ),
+    "v1/vendor/revenue/<vendor_id>/": Budget("get", "/api/v1/vendor/revenue/{vendor}/", 2, 256),
+    "v1/vendor-product-filter/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-product-filter/{vendor}/?filter=published", 8, 12_032,
+    ),
+    "v1/vendor-earning/<vendor_id>/": Budget("get", "/api/v1/vendor-earning/{vendor}/", 2, 256),
+    "v1/vendor-monthly-earning/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-monthly-earning/{vendor}/", 3, 768,
+    ),
+    "v1/vendor-reviews/<vendor_id>/": Budget("get", "/api/v1/vendor-reviews/{vendor}/", 6, 26_112),
+    "v1/vendor-reviews/<vendor_id>/<review_id>/": Budget(
+        "get", "/api/v1/vendor-reviews/{vendor}/{review}/", 14, 3328,
+    ),
+    "v1/vendor-coupon-list/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-coupon-list/{vendor}/", 7, 1024,
+    ),
+    "v1/vendor-coupon-detail/<vendor_id>/<coupon_id>/": Budget(
+        "get", "/api/v1/vendor-coupon-detail/{vendor}/{coupon}/", 7, 1024,
+    ),
+    "v1/vendor-coupon-stats/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-coupon-stats/{vendor}/", 3, 256,
+    ),
+    "v1/vendor-noti-list/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-noti-list/{vendor}/", 18, 55_552,
+    ),
+    "v1/vendor-seen-noti/<vendor_id>/": Budget("get", "/api/v1/vendor-seen-noti/{vendor}/", 2, 256),
+    "v1/vendor-noti-summary/<vendor_id>/": Budget(
+        "get", "/api/v1/vendor-noti-summary/{vendor}/", 4, 256,
+    ),
+    "v1/vendor-noti-mark-as-seen/<vendor_id>/<noti_id>/": Budget(
+        "get", "/api/v1/vendor-noti-mark-as-seen/{vendor}/{vendor_notification}/", 17, 9216,
+    ),
+    "v1/vendor-settings/<int:pk>/": Budget(
+        "get", "/api/v1/vendor-settings/{vendor_profile}/", 4, 1024,
+    ),
+    "v1/vendor-shop-settings/<int:pk>/": Budget(
+        "get", "/api/v1/vendor-shop-settings/{vendor}/", 4, 1024,
+    ),
+    "v1/shop/<vendor_slug>/": Budget("get", "/api/v1/shop/{vendor_slug}/", 4, 1024),
+    "v1/vendor-products/<vendor_slug>/": Budget(
+        "get", "/api/v1/vendor-products/{vendor_slug}/", 8, 13_824,
+    ),
+    "v1/vendor-delete-product/<vendor_id>/<product_pid>/": Budget(
+        "delete", "/api/v1/vendor-delete-product/{vendor}/{spare_pid}/", 14, 256,
+    ),
+    "media-proxy/<path:path>": Budget("get", "/api/media-proxy/products/missing.jpg", 4, 512),
+    "media/<path:path>": Budget("get", "/api/media/products/missing.jpg", 0, 512),
+    "debug-images/": Budget("get", "/api/debug-images/", 4, 3328),
+    "debug-images/inventory/": Budget(
+        "get", "/api/debug-images/inventory/?source=manifest", 3, 256,
+        staff=True,
+    ),
+    "test-image/<str:format>/": Budget("get", "/api/test-image/svg/", 0, 256),
+}
+
+# Prefetches run once per relation path however many rows there are, so
+# their repeating is not an N+1
+PREFETCHES = [r"_prefetch_related_val_"]
+
+# Routes not requested here and why
+UNBUDGETED = {
+    "v1/create-order/": "sends the order emails through MailerSend",
+    "v1/stripe-checkout/<order_oid>/": "creates a Stripe checkout session",
+    "v1/order/cod/<order_oid>/": "sends the order emails through MailerSend",
+    "v1/payment-success/<order_oid>/": "verifies the payment with Stripe",
+    "v1/uploads/<uuid:upload_id>/file/": "needs a signed upload form",
+    "v1/uploads/<uuid:upload_id>/complete/": "needs a file uploaded to the session",
+    "v1/vendor-create-product/": "multipart image upload",
+    "v1/vendor-update-product/<vendor_id>/<product_pid>/": "multipart image upload",
+    "debug-cloudinary/": "calls the Cloudinary API",
+}
+
+
+def route_patterns(patterns, prefix=""):
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from route_patterns(pattern.url_patterns, route)
+        elif isinstance(pattern, URLPattern):
+            yield route
+
+
+@override_settings(
+    IMAGE_PROCESSING="off",
+    NPLUSONE_ENABLED=False,
+    METRICS_DIR=None,
+    REPLICA_DATABASES={},
+    ALLOWED_HOSTS=["testserver"],
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class EndpointBudgetTests(TestCase):
+    """
+    Query count and response size budgets for every route in api/urls.py
+
+    Run with BUDGET_REPORT=1 to print what each endpoint uses when
+    updating a budget on purpose.
+    """
+
+    VENDORS = 3
+    PRODUCTS_PER_VENDOR = 4
+    BUYERS = 2
+    ORDERS_PER_BUYER = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        categories = [
+            Category.objects.create(title=f"Category {index}", slug=f"category-{index}")
+            for index in range(3)
+        ]
+        Tax.objects.create(country="Nepal", rate=13)
+
+        cls.vendors = []
+        products = []
+        for index in range(cls.VENDORS):
+            user = User.objects.create_user(
+                email=f"vendor{index}@example.com",
+                username=f"vendor{index}",
+                password="secret-pass-1",
+            )
+            vendor = Vendor.objects.create(
+                user=user, name=f"Vendor {index}", slug=f"vendor-{index}"
+            )
+            cls.vendors.append(vendor)
+            Coupon.objects.create(vendor=vendor, code=f"SAVE{index}", discount=10, active=True)
+
+            for number in range(cls.PRODUCTS_PER_VENDOR):
+                product = Product.objects.create(
+                    title=f"Product {index}-{number}",
+                    vendor=vendor,
+                    category=categories[number % len(categories)],
+                    price=Decimal("10.00") + number,
+                    old_price=Decimal("15.00"),
+                    shipping_amount=Decimal("2.00"),
+                    stock_qty=20,
+                    status="published",
+                )
+                products.append(product)
+                for detail in range(2):
+                    Gallery.objects.create(product=product, image=f"products/g{detail}.jpg")
+                    Color.objects.create(product=product, name=f"Color {detail}", color_code="#000")
+                    Size.objects.create(product=product, name=f"S{detail}", price=Decimal("12.00"))
+                    Specification.objects.create(
+                        product=product, title=f"Spec {detail}", content="Value"
+                    )
+
+        cls.buyers = [
+            User.objects.create_user(
+                email=f"buyer{index}@example.com",
+                username=f"buyer{index}",
+                password="secret-pass-1",
+            )
+            for index in range(cls.BUYERS)
+        ]
+        buyer = cls.buyers[0]
+
+        for index, product in enumerate(products):
+            for reviewer in cls.buyers:
+                Review.objects.create(
+                    user=reviewer,
+                    product=product,
+                    review="Good",
+                    rating=(index % 5) + 1,
+                    active=True,
+                )
+        for product in products[:3]:
+            Wishlist.objects.create(user=buyer, product=product)
+            Cart.objects.create(
+                cart_id="cart-0",
+                user=buyer,
+                product=product,
+                qty=1,
+                price=product.price,
+                sub_total=product.price,
+                total=product.price,
+            )
+        Cart.objects.create(
+            cart_id="cart-1", product=products[0], qty=1, price=products[0].price
+        )
+
+        number = 0
+        for buyer_index, order_buyer in enumerate(cls.buyers):
+            for index in range(cls.ORDERS_PER_BUYER):
+                order = CartOrder.objects.create(
+                    oid=f"order-{buyer_index}-{index}",
+                    buyer=order_buyer,
+                    full_name="Buyer",
+                    email=order_buyer.email,
+                    country="Nepal",
+                    payment_status="paid" if index else "pending",
+                    total=Decimal("40.00"),
+                    sub_total=Decimal("36.00"),
+                )
+                for vendor in cls.vendors:
+                    product = products[cls.vendors.index(vendor) * cls.PRODUCTS_PER_VENDOR + index]
+                    number += 1
+                    item = CartOrderItem.objects.create(
+                        oid=f"item-{number}",
+                        order=order,
+                        vendor=vendor,
+                        product=product,
+                        qty=1,
+                        price=product.price,
+                        sub_total=product.price,
+                        total=product.price,
+                    )
+                    order.vendor.add(vendor)
+                    Notification.objects.create(vendor=vendor, order=order, order_item=item)
+                Notification.objects.create(user=order_buyer, order=order)
+
+        # Orders were created paid before their items, so build the sales
+        # rollups the way the reconcile commands do
+        Product.reconcile_sales()
+        VendorDailySales.rebuild()
+        today = localdate()
+        ProductDailyViews.objects.bulk_create(
+            ProductDailyViews(product=product, date=today, views=index + 1)
+            for index, product in enumerate(products)
+        )
+
+        cls.staff = User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="secret-pass-1",
+            is_staff=True,
+        )
+        cls.spare = Product.objects.create(
+            title="Spare", vendor=cls.vendors[0], category=categories[0], status="draft"
+        )
+
+    def ids(self):
+        buyer = self.buyers[0]
+        vendor = self.vendors[0]
+        return {
+            "buyer": buyer.id,
+            "vendor": vendor.id,
+            "vendor_profile": vendor.user.profile.id,
+            "vendor_slug": vendor.slug,
+            "product": Product.objects.filter(vendor=vendor).first().id,
+            "slug": Product.objects.filter(vendor=vendor).first().slug,
+            "spare_pid": self.spare.pid,
+            "order": "order-0-1",
+            "review": Review.objects.filter(product__vendor=vendor).first().id,
+            "coupon": Coupon.objects.get(vendor=vendor).id,
+            "cart_item": Cart.objects.filter(cart_id="cart-0").first().id,
+            "cart_item_guest": Cart.objects.get(cart_id="cart-1").id,
+            "buyer_notification": Notification.objects.filter(user=buyer).first().id,
+            "vendor_notification": Notification.objects.filter(vendor=vendor).first().id,
+            "refresh": str(RefreshToken.for_user(buyer)),
+        }
+
+    def request(self, budget, ids):
+        path = budget.path.format(**ids)
+        data = None
+        if budget.data is not None:
+            data = {
+                key: value.format(**ids) if isinstance(value, str) else value
+                for key, value in budget.data.items()
+            }
+        if budget.method == "get":
+            return self.client.get(path)
+        return getattr(self.client, budget.method)(path, data, content_type="application/json")
+
+    def test_every_route_is_budgeted(self):
+        routes = set(route_patterns(api_urls.urlpatterns))
+        listed = set(BUDGETS) | set(UNBUDGETED)
+        self.assertEqual(routes - listed, set(), "Routes without a budget")
+        self.assertEqual(listed - routes, set(), "Budgets of removed routes")
+
+    def test_endpoint_budgets(self):
+        # Views counted by the product detail request go in while the test
+        # database still exists
+        self.addCleanup(product_view_buffer.flush)
+        ids = self.ids()
+        report = os.environ.get("BUDGET_REPORT")
+
+        for route, budget in BUDGETS.items():
+            with self.subTest(route=route):
+                self.client.logout()
+                if budget.staff:
+                    self.client.force_login(self.staff)
+                with CaptureQueriesContext(connection) as queries:
+                    with detect_n_plus_one(route, strict=not report, ignore=PREFETCHES):
+                        response = self.request(budget, ids)
+                        if response.streaming:
+                            payload = len(b"".join(response.streaming_content))
+                        else:
+                            payload = len(response.content)
+
+                if report:
+                    print(f"{route}: {len(queries)} queries, {payload} bytes")
+                    continue
+                self.assertLess(response.status_code, 500)
+                self.assertLessEqual(len(queries), budget.queries, f"{route} ran too many queries")
+                self.assertLessEqual(payload, budget.payload, f"{route} response too large")
+
+
+class MediaInventoryViewTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            User.objects.create_user(
+                email="staff@example.com", username="staff", password="x", is_staff=True
+            )
+        )
+
+    def test_invalid_paging_parameters(self):
+        for query in (
+            "source=manifest&limit=abc",
+            "source=manifest&limit=0",
+            "tier=local&pages=two",
+            "tier=local&pages=-1",
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(f"/api/debug-images/inventory/?{query}")
+                self.assertEqual(response.status_code, 400)
+
+        response = self.client.get("/api/debug-images/inventory/?source=manifest&limit=99999")
+        self.assertEqual(response.status_code, 200)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = CircuitBreaker(failures=2, reset=30, clock=lambda: self.now)
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failed_call()
+        self.breaker.succeeded()
+        self.breaker.failed_call()
+        self.assertTrue(self.breaker.allow())
+        self.breaker.failed_call()
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_trial_call_through(self):
+        self.breaker.failed_call()
+        self.breaker.failed_call()
+        self.now = 30
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+
+        # A failed trial opens the circuit for another reset period
+        self.breaker.failed_call()
+        self.now = 59
+        self.assertFalse(self.breaker.allow())
+        self.now = 60
+        self.assertTrue(self.breaker.allow())
+        self.breaker.succeeded()
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class BulkheadTests(SimpleTestCase):
+    def test_rejects_calls_over_the_limit(self):
+        bulkhead = Bulkhead(1)
+        self.assertTrue(bulkhead.acquire())
+        self.assertFalse(bulkhead.acquire())
+        self.assertEqual(bulkhead.in_flight, 1)
+        bulkhead.release()
+        self.assertTrue(bulkhead.acquire())
+
+    def test_guard_fails_fast_when_full(self):
+        service = Service("test", timeout=1, concurrency=1, failures=5, reset=30)
+        with service.guard():
+            with self.assertRaises(BulkheadFull):
+                with service.guard():
+                    pass
+        with service.guard():
+            pass
+
+    def test_misses_are_not_failures(self):
+        service = Service("test", timeout=1, concurrency=1, failures=1, reset=30)
+        with self.assertRaises(FileNotFoundError):
+            with service.guard():
+                raise FileNotFoundError("missing.jpg")
+        self.assertEqual(service.breaker.state, CircuitBreaker.CLOSED)
+
+
+class QueryCheckTests(TestCase):
+    def categories(self, count):
+        for pk in range(count):
+            Category.objects.filter(pk=pk).first()
+
+    def test_fingerprint(self):
+        self.assertEqual(
+            fingerprint("SELECT * FROM t WHERE id = 12 AND price > 1.5 AND name = 'O''Brien'"),
+            "SELECT * FROM t WHERE id = ? AND price > ? AND name = ?",
+        )
+        self.assertEqual(
+            fingerprint('SELECT "rating_5" FROM t\n  WHERE "vendor_id" IN (1, 2, 3)'),
+            'SELECT "rating_5" FROM t WHERE "vendor_id" IN (...)',
+        )
+        self.assertEqual(
+            fingerprint("SELECT 1 FROM t WHERE slug in ('a', 'b')"),
+            fingerprint("SELECT 1 FROM t WHERE slug in ('a')"),
+        )
+        # As the execute wrapper sees them, with the parameters apart
+        self.assertEqual(
+            fingerprint("SELECT 1 FROM t WHERE id IN (%s, %s, %s) LIMIT 21"),
+            "SELECT ? FROM t WHERE id IN (...) LIMIT ?",
+        )
+
+    def test_threshold(self):
+        with detect_n_plus_one(threshold=3, strict=True) as tracker:
+            self.categories(3)
+        self.assertEqual(tracker.repeated(), [])
+
+        with self.assertLogs("api.querycheck", "WARNING"):
+            with detect_n_plus_one(threshold=3) as tracker:
+                self.categories(4)
+        ((shape, count, where),) = tracker.repeated()
+        self.assertIn('FROM "store_category" WHERE "store_category"."id" = %s', shape)
+        self.assertEqual(count, 4)
+        self.assertRegex(where, r"^api/tests\.py:\d+ in categories$")
+
+    @override_settings(NPLUSONE_IGNORE=[r"store_category"])
+    def test_ignore(self):
+        with detect_n_plus_one(threshold=1, strict=True) as tracker:
+            self.categories(3)
+        self.assertEqual(tracker.counts.most_common(1)[0][1], 3)
+
+        # An explicit list replaces the setting
+        with self.assertRaises(NPlusOneError):
+            with detect_n_plus_one(threshold=1, strict=True, ignore=[]):
+                self.categories(3)
+
+    @override_settings(NPLUSONE_STRICT=True, NPLUSONE_THRESHOLD=2)
+    def test_strict_mode_raises(self):
+        with self.assertRaises(NPlusOneError) as raised:
+            with detect_n_plus_one("categories"):
+                self.categories(3)
+
+        report = str(raised.exception).splitlines()
+        self.assertEqual(report[0], "Repeated queries in categories:")
+        self.assertRegex(report[1], r"^  3x from api/tests\.py:\d+ in categories: SELECT ")
+
+    def test_other_modes_log(self):
+        with self.assertLogs("api.querycheck", "WARNING") as logs:
+            with detect_n_plus_one("categories", threshold=2, strict=False):
+                self.categories(3)
+        self.assertIn("Repeated queries in categories:", logs.output[0])
+
+        with self.assertNoLogs("api.querycheck", "WARNING"):
+            with detect_n_plus_one("categories", threshold=2, strict=False):
+                self.categories(2)
+
+
+class MetricsCollectTests(SimpleTestCase):
+    """
+    Snapshots of other workers in METRICS_DIR
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        settings = override_settings(METRICS_DIR=self.directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def write(self, pid, idle):
+        snapshot = {
+            "histograms": [],
+            "counters": [
+                {"name": "db_connections_opened_total", "labels": {"alias": "x"}, "value": 2}
+            ],
+            "gauges": [
+                {
+                    "name": "db_pool_connections",
+                    "labels": {"alias": "x", "state": "idle"},
+                    "value": idle,
+                }
+            ],
+        }
+        with open(metrics.snapshot_path(pid), "w") as file:
+            json.dump(snapshot, file)
+
+    def test_gauges_are_per_worker(self):
+        worker = os.getppid()
+        exited = subprocess.Popen(["true"])
+        exited.wait()
+        self.write(worker, 3)
+        self.write(exited.pid, 5)
+
+        histograms, counters, gauges = metrics.collect()
+        pool = {
+            dict(labels)["pid"]: value
+            for (name, labels), value in gauges.items()
+            if name == "db_pool_connections"
+        }
+        self.assertEqual(pool, {worker: 3})
+        self.assertEqual(counters[("db_connections_opened_total", (("alias", "x"),))], 2)
+        self.assertFalse(os.path.exists(metrics.snapshot_path(exited.pid)))
+        self.assertIn(
+            f'db_pool_connections{{alias="x",pid="{worker}",state="idle"}} 3', metrics.render()
+        )
+
+
+class MetricsViewTests(TestCase):
+    def test_requests_are_rendered(self):
+        self.client.get("/api/v1/category/")
+        self.client.get("/api/v1/category/")
+
+        staff = User.objects.create_user(
+            email="staff@example.com", username="staff", password="secret-pass-1", is_staff=True
+        )
+        self.client.force_login(staff)
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        view = resolve("/api/v1/category/").view_name
+        counts = {
+            line.split(" ")[0]: float(line.split(" ")[1])
+            for line in response.content.decode().splitlines()
+            if not line.startswith("#")
+        }
+        labels = metrics.format_labels([("method", "GET"), ("status", 200), ("view", view)])
+        self.assertGreaterEqual(counts[f"http_request_duration_seconds_count{labels}"], 2)
+        labels = metrics.format_labels([("view", view)])
+        self.assertGreaterEqual(counts[f"http_request_db_queries_count{labels}"], 2)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_staff_only_without_a_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+
+        buyer = User.objects.create_user(
+            email="buyer@example.com", username="buyer", password="secret-pass-1"
+        )
+        self.client.force_login(buyer)
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    @override_settings(METRICS_TOKEN="scrape-me")
+    def test_token(self):
+        for authorization, status in (
+            ("Bearer scrape-me", 200),
+            ("Bearer wrong", 401),
+            ("Bearer scrape-mé", 401),
+        ):
+            response = self.client.get("/metrics", headers={"Authorization": authorization})
+            self.assertEqual(response.status_code, status, authorization)
+
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+
+
+class ConnectionLifecycleTests(SimpleTestCase):
+    SQLITE = {"ENGINE": "django.db.backends.sqlite3", "NAME": "db.sqlite3"}
+    POSTGRESQL = {
+        "ENGINE": "django.db.backends.postgresql",
+        "NAME": "shop",
+        "OPTIONS": {"sslmode": "require"},
+    }
+
+    def lifecycle(self, database, **values):
+        values = {"DB_CONN_MAX_AGE": 60, "DB_CONN_HEALTH_CHECKS": False, **values}
+        with mock.patch.multiple(project_settings, **values):
+            return project_settings.connection_lifecycle(database)
+
+    def test_persistent_connections(self):
+        for database in (self.SQLITE, self.POSTGRESQL):
+            self.assertEqual(
+                self.lifecycle(database, DB_POOL=False),
+                {**database, "CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": False},
+            )
+
+    def test_only_postgresql_is_pooled(self):
+        self.assertEqual(
+            self.lifecycle(self.SQLITE, DB_POOL=True),
+            {**self.SQLITE, "CONN_MAX_AGE": 60, "CONN_HEALTH_CHECKS": False},
+        )
+
+    @skipUnless(find_spec("psycopg_pool"), "needs psycopg[pool]")
+    def test_pooled_postgresql(self):
+        from psycopg_pool import ConnectionPool
+
+        database = self.lifecycle(
+            self.POSTGRESQL,
+            DB_POOL=True,
+            DB_POOL_MIN_SIZE=2,
+            DB_POOL_MAX_SIZE=8,
+            DB_POOL_TIMEOUT=3,
+        )
+
+        # Persistent connections are left to the pool
+        self.assertEqual(database["CONN_MAX_AGE"], 0)
+        self.assertEqual(
+            database["OPTIONS"],
+            {
+                "sslmode": "require",
+                "pool": {
+                    "min_size": 2,
+                    "max_size": 8,
+                    "timeout": 3,
+                    "check": ConnectionPool.check_connection,
+                },
+            },
+        )
+        self.assertEqual(self.POSTGRESQL["OPTIONS"], {"sslmode": "require"})
+
+
+class ConnectionMetricsTests(TransactionTestCase):
+    def count(self, name):
+        return metrics.registry.counters.get((name, (("alias", "default"),)), 0)
+
+    def test_opened_and_reused_connections(self):
+        opened = self.count("db_connections_opened_total")
+        reused = self.count("db_connection_reuses_total")
+
+        # Connections are per thread, a new thread opens its own
+        responses = []
+        thread = threading.Thread(
+            target=lambda: responses.append(self.client.get("/api/v1/category/"))
+        )
+        thread.start()
+        thread.join()
+        self.assertEqual(responses[0].status_code, 200)
+        self.assertEqual(self.count("db_connections_opened_total"), opened + 1)
+        self.assertEqual(self.count("db_connection_reuses_total"), reused)
+
+        connection.ensure_connection()
+        self.client.get("/api/v1/category/")
+        self.assertEqual(self.count("db_connections_opened_total"), opened + 1)
+        self.assertEqual(self.count("db_connection_reuses_total"), reused + 1)
+
+        # Requests without queries neither open nor reuse one
+        self.client.get("/api/v1/no-such-page/")
+        self.assertEqual(self.count("db_connection_reuses_total"), reused + 1)
+        self.assertIn(
+            f'db_connection_reuses_total{{alias="default"}} {reused + 1}', metrics.render()
+        )
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user(
+            email="staff@example.com", username="staff", password="secret-pass-1", is_staff=True
+        )
+        cls.buyer = User.objects.create_user(
+            email="buyer@example.com", username="buyer", password="secret-pass-1"
+        )
+        Category.objects.create(title="Category", slug="category")
+
+    def bearer(self, user):
+        return {"Authorization": f"Bearer {RefreshToken.for_user(user).access_token}"}
+
+    def test_staff_requests_are_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.client.get("/api/v1/category/?profile=cprofile")
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response["X-Profile-Id"], str(profile.pk))
+        self.assertEqual(
+            (profile.method, profile.path, profile.status, profile.mode, profile.trigger),
+            ("GET", "/api/v1/category/?profile=cprofile", 200, "cprofile", "requested"),
+        )
+        self.assertEqual(profile.user, self.staff)
+        # cProfile stacks are caller;callee edges
+        self.assertIn("list (rest_framework/mixins.py)", profile.stacks)
+        self.assertIn("function calls", profile.report)
+        self.assertIsNotNone(profile.stats)
+        self.assertEqual(profile.queries, len(profile.sql))
+        self.assertTrue(any("store_category" in query["sql"] for query in profile.sql))
+        self.assertTrue(all(query["ms"] >= 0 for query in profile.sql))
+
+    def test_staff_access_tokens(self):
+        response = self.client.get(
+            "/api/v1/category/", {"profile": "1"}, headers=self.bearer(self.staff)
+        )
+
+        profile = RequestProfile.objects.get()
+        self.assertEqual(response["X-Profile-Id"], str(profile.pk))
+        self.assertEqual((profile.mode, profile.user), ("sample", self.staff))
+        self.assertTrue(profile.sql)
+
+    def test_other_requests_are_not_profiled(self):
+        for headers in ({}, self.bearer(self.buyer), {"Authorization": "Bearer invalid"}):
+            response = self.client.get("/api/v1/category/?profile=1", headers=headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn("X-Profile-Id", response)
+
+        self.client.force_login(self.buyer)
+        self.client.get("/api/v1/category/", headers={"X-Profile": "cprofile"})
+        # Staff not asking for a profile
+        self.client.force_login(self.staff)
+        self.client.get("/api/v1/category/")
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILING_SAMPLE_RATE=1, PROFILING_SAMPLE_PATHS=[r"^/api/v1/category/"])
+    def test_sampled_requests(self):
+        response = self.client.get("/api/v1/category/")
+        self.client.get("/api/v1/products/")
+
+        profile = RequestProfile.objects.get()
+        self.assertNotIn("X-Profile-Id", response)
+        self.assertEqual(
+            (profile.path, profile.trigger, profile.user), ("/api/v1/category/", "sampled", None)
+        )
+
+    @override_settings(PROFILING_KEEP=2)
+    def test_only_the_newest_profiles_are_kept(self):
+        self.client.force_login(self.staff)
+        ids = [
+            self.client.get(f"/api/v1/category/?profile=1&n={number}")["X-Profile-Id"]
+            for number in range(4)
+        ]
+
+        self.assertEqual(
+            [str(pk) for pk in RequestProfile.objects.order_by("pk").values_list("pk", flat=True)],
+            ids[2:],
+        )
+
+    def test_stack_sampler(self):
+        def busy():
+            deadline = time.monotonic() + 0.05
+            while time.monotonic() < deadline:
+                pass
+
+        sampler = StackSampler(0.001)
+        sampler.start(sys._getframe())
+        busy()
+        sampler.stop()
+
+        self.assertGreater(sampler.samples, 0)
+        stack, count = sampler.collapsed().splitlines()[0].rsplit(" ", 1)
+        self.assertTrue(stack.endswith(".test_stack_sampler.<locals>.busy (api/tests.py)"))
+        self.assertEqual(int(count), sampler.stacks.most_common(1)[0][1])
+
+
+class FaultInjectingHandler(BaseHTTPRequestHandler):
+    """
+    Stands in for an external service: answers 500 with fault "error",
+    after `delay` seconds with fault "slow" and with a tiny image otherwise
+    """
+
+    fault = None
+    delay = 1
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        if self.fault == "slow":
+            time.sleep(self.delay)
+        if self.fault == "error":
+            self.send_response(500)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", "3")
+        self.end_headers()
+        self.wfile.write(b"png")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(
+    EXTERNAL_SERVICES={
+        "cloudinary": {"timeout": 0.2, "concurrency": 2, "failures": 2, "reset": 60},
+    },
+    EXTERNAL_SERVICE_HOSTS={"127.0.0.1": "cloudinary"},
+    STORAGES={
+        "default": {
+            "BACKEND": "api.tiered_storage.TieredStorage",
+            "OPTIONS": {"tiers": ["cloudinary"], "primary": "cloudinary"},
+        },
+        "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+    },
+)
+class FaultInjectionTests(TestCase):
+    """
+    Calls to a local stub server mapped to the cloudinary service
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), FaultInjectingHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FaultInjectingHandler.fault = None
+        FaultInjectingHandler.hits = 0
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+        cache.clear()
+
+    def circuit_open(self):
+        gauges = {
+            (item["name"], item["labels"]["service"]): item["value"]
+            for item in metrics.service_gauges()
+        }
+        return gauges[("external_service_circuit_open", "cloudinary")]
+
+    def test_server_errors_open_the_circuit(self):
+        FaultInjectingHandler.fault = "error"
+        for _ in range(2):
+            self.assertEqual(requests.get(self.url).status_code, 500)
+        self.assertEqual(self.circuit_open(), 1)
+
+        with self.assertRaises(CircuitOpen):
+            requests.get(self.url)
+        self.assertEqual(FaultInjectingHandler.hits, 2)
+
+    def test_slow_calls_time_out(self):
+        FaultInjectingHandler.fault = "slow"
+        started = time.perf_counter()
+        for _ in range(2):
+            with self.assertRaises(requests.Timeout):
+                requests.get(self.url)
+        self.assertLess(time.perf_counter() - started, FaultInjectingHandler.delay * 2)
+
+        # Rejected at once, the connection error callers already handle
+        with self.assertRaises(requests.ConnectionError):
+            requests.get(self.url)
+        self.assertEqual(FaultInjectingHandler.hits, 2)
+
+    def test_media_placeholder_while_tier_is_down(self):
+        url = self.url
+
+        class StubCloudinary(CloudinaryStorage):
+            def url(self, name):
+                return url + name
+
+        get_media_storage().tiers = {"cloudinary": StubCloudinary()}
+        FaultInjectingHandler.fault = "error"
+
+        response = self.client.get("/media-proxy/products/shoe.png")
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertEqual(response["Cache-Control"], "no-store")
+        self.assertIn("Retry-After", response)
+        self.assertIsNone(cache.get(MISS_CACHE_KEY.format("products/shoe.png")))
+
+        # The open circuit answers without calling the stub
+        hits = FaultInjectingHandler.hits
+        self.assertEqual(self.client.get("/media-proxy/products/shoe.png").status_code, 503)
+        self.assertEqual(FaultInjectingHandler.hits, hits)
+
+        # Recovered, the trial call after the reset period closes the circuit
+        FaultInjectingHandler.fault = None
+        resilience.service("cloudinary").breaker.opened -= 60
+        response = self.client.get("/media-proxy/products/shoe.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Media-Tier"], "cloudinary")
+        self.assertEqual(self.circuit_open(), 0)
+
+
+class TieredStorageReadTests(TestCase):
+    """
+    A local cache in front of two remote tiers, stood in for by directories
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.storage = TieredStorage(tiers=["local", "s3", "cloudinary"], primary="s3")
+        self.storage.tiers = {}
+        for tier in ("local", "s3", "cloudinary"):
+            location = tempfile.mkdtemp()
+            self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+            self.storage.tiers[tier] = FileSystemStorage(location=location)
+
+    def test_candidates_put_the_indexed_tier_after_the_cache(self):
+        self.assertEqual(
+            self.storage.candidates("products/a.jpg"), (None, ["local", "s3", "cloudinary"])
+        )
+        MediaLocation.objects.create(key="products/a.jpg", tier="cloudinary")
+        self.assertEqual(
+            self.storage.candidates("products/a.jpg"),
+            ("cloudinary", ["local", "cloudinary", "s3"]),
+        )
+
+    def test_locate_indexes_and_caches_remote_reads(self):
+        self.storage.tiers["cloudinary"].save("products/a.jpg", ContentFile(b"old"))
+
+        tier, file, seconds = self.storage.locate("products/a.jpg")
+        self.assertEqual((tier, file.read()), ("cloudinary", b"old"))
+        self.assertEqual(MediaLocation.objects.get(key="products/a.jpg").tier, "cloudinary")
+        self.assertTrue(self.storage.tiers["local"].exists("products/a.jpg"))
+
+        tier, file, seconds = self.storage.locate("products/a.jpg")
+        self.assertEqual(tier, "local")
+        file.close()
+
+    def test_keys_on_the_first_tier_are_not_indexed(self):
+        self.storage.tiers["s3"].save("products/a.jpg", ContentFile(b"new"))
+        MediaLocation.objects.create(key="products/a.jpg", tier="cloudinary")
+
+        tier, file, seconds = self.storage.locate("products/a.jpg")
+        self.assertEqual(tier, "s3")
+        self.assertFalse(MediaLocation.objects.filter(key="products/a.jpg").exists())
+
+    def test_misses_are_remembered_until_saved(self):
+        MediaLocation.objects.create(key="products/a.jpg", tier="cloudinary")
+        with self.assertRaises(FileNotFoundError):
+            self.storage.locate("products/a.jpg")
+        self.assertTrue(cache.get(MISS_CACHE_KEY.format("products/a.jpg")))
+        self.assertFalse(MediaLocation.objects.exists())
+
+        # Answered from the cache without reading any tier
+        self.storage.tiers["cloudinary"].save("products/a.jpg", ContentFile(b"late"))
+        with mock.patch.object(FileSystemStorage, "open") as opened:
+            with self.assertRaises(FileNotFoundError):
+                self.storage.locate("products/a.jpg")
+            self.assertFalse(self.storage.exists("products/a.jpg"))
+        opened.assert_not_called()
+
+        self.storage.save("products/a.jpg", ContentFile(b"new"))
+        self.assertTrue(self.storage.exists("products/a.jpg"))
+
+    def test_failing_tier_is_not_taken_for_a_miss(self):
+        with mock.patch.object(
+            self.storage.tiers["cloudinary"], "open", side_effect=requests.ConnectionError
+        ):
+            with self.assertRaises(resilience.ServiceUnavailable):
+                self.storage.locate("products/a.jpg")
+        self.assertIsNone(cache.get(MISS_CACHE_KEY.format("products/a.jpg")))
+
+    def test_cloudinary_tier_is_read_only(self):
+        cloudinary = CloudinaryStorage(cloud_name="demo")
+        with self.assertRaisesMessage(PermissionError, "read-only"):
+            cloudinary._save("products/a.jpg", ContentFile(b"new"))
+        with self.assertRaisesMessage(PermissionError, "read-only"):
+            cloudinary.delete("products/a.jpg")
+
+        # Deleting through the tiered storage skips it
+        self.storage.tiers["cloudinary"] = cloudinary
+        self.storage.tiers["s3"].save("products/a.jpg", ContentFile(b"new"))
+        self.storage.delete("products/a.jpg")
+        self.assertFalse(self.storage.tiers["s3"].exists("products/a.jpg"))
+
+
+class BenchmarkDriverTests(SimpleTestCase):
+    def test_client_mode_sends_no_email(self):
+        with ClientDriver().settings():
+            self.assertEqual(emails.NewEmail("key").send({}), "202\n")
+        self.assertIsNot(emails.NewEmail.send, accept_email)
+
+
+class LocalMediaTestCase(TestCase):
+    """
+    Media on a local tier in a temporary MEDIA_ROOT
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(
+            MEDIA_ROOT=cls.media_root,
+            MEDIA_TIERS=["local"],
+            MEDIA_PRIMARY_TIER="local",
+            IMAGE_PROCESSING="off",
+            STORAGES={
+                "default": {"BACKEND": "api.tiered_storage.TieredStorage"},
+                "staticfiles": {
+                    "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"
+                },
+            },
+        )
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        os.makedirs(self.media_root)
+
+    def make_product(self, **kwargs):
+        user = User.objects.create_user(
+            email=f"media{User.objects.count()}@example.com",
+            username=f"media{User.objects.count()}",
+            password="secret-pass-1",
+        )
+        vendor = Vendor.objects.create(user=user, name="Media", slug=f"media-{user.pk}")
+        return Product.objects.create(title="Product", vendor=vendor, price=Decimal("10.00"), **kwargs)
+
+
+def digest(name):
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+class UploadSessionTests(LocalMediaTestCase):
+    """
+    The direct upload flow with the local file system as the primary tier
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.product = self.make_product()
+        self.owner = self.product.vendor.user
+
+    def upload(self, target="product", object_id=None, content=b"image bytes"):
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {
+                "target": target,
+                "object_id": object_id or self.product.id,
+                "filename": "photo.JPG",
+                "content_type": "image/jpeg",
+                "size": len(content),
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        session = response.data
+        self.assertTrue(session["key"].endswith(".jpg"))
+
+        upload = session["upload"]
+        sent = self.client.post(
+            upload["url"],
+            {**upload["fields"], "file": SimpleUploadedFile("photo.jpg", content)},
+        )
+        self.assertEqual(sent.status_code, 204, sent.content)
+        return session
+
+    def test_upload_replaces_the_product_image(self):
+        self.client.force_login(self.owner)
+        for content in (b"first image", b"second image"):
+            session = self.upload(content=content)
+            response = self.client.post(session["complete"])
+            self.assertEqual(response.status_code, 200, response.content)
+
+            self.product.refresh_from_db()
+            self.assertEqual(self.product.image.name, session["key"])
+            with default_storage.open(session["key"]) as file:
+                self.assertEqual(file.read(), content)
+
+        self.assertEqual(UploadSession.objects.filter(status="completed").count(), 2)
+        # A completed session cannot be replayed
+        self.assertEqual(self.client.post(session["complete"]).status_code, 400)
+
+    def test_gallery_upload_adds_an_image(self):
+        self.client.force_login(self.owner)
+        session = self.upload(target="gallery")
+        self.assertEqual(self.client.post(session["complete"]).status_code, 200)
+        self.assertTrue(Gallery.objects.filter(product=self.product, image=session["key"]).exists())
+
+    def test_completing_before_the_upload_fails(self):
+        self.client.force_login(self.owner)
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {
+                "target": "product",
+                "object_id": self.product.id,
+                "filename": "photo.jpg",
+                "content_type": "image/jpeg",
+                "size": 10,
+            },
+        )
+        self.assertEqual(self.client.post(response.data["complete"]).status_code, 400)
+
+    def test_oversized_files_are_refused(self):
+        self.client.force_login(self.owner)
+        response = self.client.post(
+            "/api/v1/uploads/",
+            {
+                "target": "product",
+                "object_id": self.product.id,
+                "filename": "photo.jpg",
+                "content_type": "image/jpeg",
+                "size": 4,
+            },
+        )
+        upload = response.data["upload"]
+        sent = self.client.post(
+            upload["url"],
+            {**upload["fields"], "file": SimpleUploadedFile("photo.jpg", b"too large")},
+        )
+        self.assertEqual(sent.status_code, 400)
+
+    def test_only_the_owner_may_upload(self):
+        data = {
+            "target": "product",
+            "object_id": self.product.id,
+            "filename": "photo.jpg",
+            "content_type": "image/jpeg",
+            "size": 10,
+        }
+        self.assertIn(self.client.post("/api/v1/uploads/", data).status_code, (401, 403))
+
+        other = self.make_product().vendor.user
+        self.client.force_login(other)
+        self.assertEqual(self.client.post("/api/v1/uploads/", data).status_code, 403)
+        vendor = {**data, "target": "vendor", "object_id": self.product.vendor_id}
+        self.assertEqual(self.client.post("/api/v1/uploads/", vendor).status_code, 403)
+
+    def test_sessions_are_completed_by_their_user(self):
+        self.client.force_login(self.owner)
+        session = self.upload()
+
+        self.client.force_login(self.make_product().vendor.user)
+        self.assertEqual(self.client.post(session["complete"]).status_code, 403)
+        self.product.refresh_from_db()
+        self.assertNotEqual(self.product.image.name, session["key"])
+
+
+def jpeg(color="red", size=(40, 20), orientation=None):
+    """
+    A small JPEG carrying a camera make and a GPS position
+    """
+    exif = Image.Exif()
+    exif[ExifTags.Base.Make] = "Camera"
+    exif[ExifTags.IFD.GPSInfo] = {
+        ExifTags.GPS.GPSLatitudeRef: "N",
+        ExifTags.GPS.GPSLatitude: (52.0, 22.0, 12.0),
+    }
+    if orientation:
+        exif[ExifTags.Base.Orientation] = orientation
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_PROCESSING="sync")
+class ImageProcessingTests(LocalMediaTestCase):
+    def stored_image(self, name):
+        with default_storage.open(name) as file:
+            image = Image.open(BytesIO(file.read()))
+            image.load()
+        return image
+
+    def save_product(self, content, name="photo.jpg"):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.make_product(image=SimpleUploadedFile(name, content))
+        product.refresh_from_db()
+        return product
+
+    def test_strip_metadata(self):
+        stripped = strip_metadata(ContentFile(jpeg(orientation=6), name="photo.jpg"))
+        image = Image.open(stripped)
+        self.assertEqual(dict(image.getexif()), {})
+        # Rotated as the orientation tag said
+        self.assertEqual(image.size, (20, 40))
+
+        plain = BytesIO()
+        Image.new("RGB", (4, 4)).save(plain, "JPEG")
+        self.assertIsNone(strip_metadata(ContentFile(plain.getvalue())))
+        self.assertIsNone(strip_metadata(ContentFile(b"not an image")))
+
+    def test_saved_images_are_processed_without_metadata(self):
+        product = self.save_product(jpeg())
+
+        self.assertEqual(dict(self.stored_image(product.image.name).getexif()), {})
+        self.assertEqual((product.image_width, product.image_height), (40, 20))
+        self.assertTrue(product.image_lqip.startswith("data:image/webp;base64,"))
+        self.assertEqual(product.image_source, product.image.name)
+        self.assertEqual(set(product.image_variants), set(VARIANT_SIZES))
+        for name in product.image_variants.values():
+            self.assertEqual(self.stored_image(name).format, "WEBP")
+        self.assertEqual(set(product.image_thumbnails()), set(VARIANT_SIZES))
+
+    def test_originals_uploaded_directly_are_rewritten(self):
+        name = default_storage.save("uploads/direct.jpg", ContentFile(jpeg(orientation=6)))
+        product = self.make_product()
+        product.image = name
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+
+        product.refresh_from_db()
+        self.assertEqual(product.image.name, name)
+        image = self.stored_image(name)
+        self.assertEqual((dict(image.getexif()), image.size), ({}, (20, 40)))
+        self.assertEqual((product.image_width, product.image_height), (20, 40))
+
+    def test_rows_sharing_an_image_share_its_variants(self):
+        first = self.save_product(jpeg())
+        variants = os.listdir(os.path.join(self.media_root, "products", "variants"))
+
+        second = self.save_product(jpeg(), name="copy.jpg")
+
+        self.assertEqual(second.image.name, first.image.name)
+        self.assertEqual(second.image_variants, first.image_variants)
+        self.assertEqual(
+            os.listdir(os.path.join(self.media_root, "products", "variants")), variants
+        )
+
+    def test_replaced_images_drop_their_variants(self):
+        product = self.save_product(jpeg())
+        old = product.image_variants
+
+        product.image = SimpleUploadedFile("new.jpg", jpeg(color="blue"))
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+
+        self.assertNotEqual(product.image_variants, old)
+        for name in old.values():
+            self.assertFalse(default_storage.exists(name))
+        for name in product.image_variants.values():
+            self.assertTrue(default_storage.exists(name))
+
+    def test_variants_still_shared_are_kept(self):
+        first = self.save_product(jpeg())
+        second = self.save_product(jpeg(), name="copy.jpg")
+
+        second.image = SimpleUploadedFile("new.jpg", jpeg(color="blue"))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.save()
+
+        for name in first.image_variants.values():
+            self.assertTrue(default_storage.exists(name))
+
+    def test_off_leaves_images_unprocessed(self):
+        with self.settings(IMAGE_PROCESSING="off"):
+            product = self.save_product(jpeg())
+        self.assertEqual((product.image_variants, product.image_source), ({}, ""))
+
+
+class DedupStorageTests(LocalMediaTestCase):
+    def setUp(self):
+        super().setUp()
+        self.storage = Product._meta.get_field("image").storage
+
+    def test_same_content_is_stored_once(self):
+        first = self.storage.save("products/a.jpg", ContentFile(b"same bytes"))
+        second = self.storage.save("products/b.jpg", ContentFile(b"same bytes"))
+        other = self.storage.save("products/c.jpg", ContentFile(b"other bytes"))
+
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+        self.assertEqual(len(default_storage.listdir("products")[1]), 2)
+
+    def test_rows_count_references(self):
+        name = self.storage.save("products/a.jpg", ContentFile(b"counted"))
+        first = self.make_product(image=name)
+        second = self.make_product(image=name)
+        blob = MediaBlob.objects.get(name=name)
+        self.assertEqual(blob.refs, 2)
+        self.assertIsNone(blob.unreferenced_since)
+
+        # Still referenced by the second product, the file stays
+        first.delete()
+        self.storage.delete(name)
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(MediaBlob.objects.get(name=name).refs, 1)
+
+        second.image = self.storage.save("products/b.jpg", ContentFile(b"replacement"))
+        second.save()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refs, 0)
+        self.assertIsNotNone(blob.unreferenced_since)
+
+        # Referenced again, no longer up for collection
+        Gallery.objects.create(product=second, image=name)
+        blob.refresh_from_db()
+        self.assertEqual(blob.refs, 1)
+        self.assertIsNone(blob.unreferenced_since)
+
+
+class DedupeMediaCommandTests(LocalMediaTestCase):
+    def test_moves_files_to_content_names_and_counts_them(self):
+        original = default_storage.save("products/original.jpg", ContentFile(b"legacy"))
+        copy = default_storage.save("products/copy.jpg", ContentFile(b"legacy"))
+        first = self.make_product(image=original)
+        second = self.make_product(image=copy)
+
+        call_command("dedupe_media", stdout=StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(MediaBlob.objects.get(name=first.image.name).refs, 2)
+        # Without --delete-originals the old files stay
+        self.assertTrue(default_storage.exists(original))
+
+    def test_collects_blobs_unreferenced_for_gc_hours(self):
+        storage = Product._meta.get_field("image").storage
+        stale = storage.save("products/stale.jpg", ContentFile(b"stale"))
+        recent = storage.save("products/recent.jpg", ContentFile(b"recent"))
+        long_ago = timezone.now() - timedelta(hours=48)
+        MediaBlob.objects.create(
+            name=stale, sha256=digest(stale), refs=0, unreferenced_since=long_ago
+        )
+        # An old blob that only just lost its last reference
+        MediaBlob.objects.create(name=recent, sha256=digest(recent), refs=1)
+        MediaBlob.objects.filter(name=recent).update(date=long_ago)
+        product = self.make_product(image=recent)
+        product.delete()
+
+        call_command("dedupe_media", "--gc-hours", "24", stdout=StringIO())
+
+        self.assertFalse(storage.exists(stale))
+        self.assertFalse(MediaBlob.objects.filter(name=stale).exists())
+        self.assertTrue(storage.exists(recent))
+        self.assertTrue(MediaBlob.objects.filter(name=recent).exists())
+
+    def test_delete_originals_keeps_files_shared_by_several_models(self):
+        original = default_storage.save("products/original.jpg", ContentFile(b"shared image"))
+        product = self.make_product(image=original)
+        gallery = Gallery.objects.create(product=product, image=original)
+
+        call_command("dedupe_media", "--delete-originals", stdout=StringIO())
+
+        product.refresh_from_db()
+        gallery.refresh_from_db()
+        self.assertNotEqual(product.image.name, original)
+        self.assertEqual(gallery.image.name, product.image.name)
+        self.assertTrue(default_storage.exists(product.image.name))
+        self.assertFalse(default_storage.exists(original))
+
+
+def reload_urls():
+    importlib.reload(api_urls)
+    importlib.reload(backend_urls)
+    clear_url_caches()
+
+
+@contextmanager
+def async_views():
+    """
+    The async media and payment views routed, as with ASYNC_VIEWS set at
+    startup
+    """
+    routing = override_settings(ASYNC_VIEWS=True)
+    routing.enable()
+    reload_urls()
+    try:
+        yield
+    finally:
+        routing.disable()
+        reload_urls()
+
+
+class StubResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.content = json.dumps(body).encode()
+        self.text = self.content.decode()
+        self.headers = {"Content-Type": "application/json"}
+
+    def json(self):
+        return self.body
+
+
+class StubUpstream:
+    """
+    Stands in for the pooled httpx client, answering each URL with its
+    StubResponse after `delay` seconds
+    """
+
+    def __init__(self, responses, delay=0.01):
+        self.responses = responses
+        self.delay = delay
+        self.calls = []
+
+    async def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        await asyncio.sleep(self.delay)
+        return self.responses[url]
+
+
+@override_settings(METRICS_SERVER_TIMING=True, METRICS_DIR=None)
+class AsyncViewsTests(LocalMediaTestCase):
+    """
+    The async views through the async middleware chain, as an ASGI worker
+    serves them. Upstream services are stubbed at the pooled client
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.enterClassContext(async_views())
+
+    def setUp(self):
+        super().setUp()
+        default_storage.save("products/shoe.png", ContentFile(b"png"))
+        resilience.reset()
+        self.addCleanup(resilience.reset)
+
+    def upstream(self, responses):
+        stub = StubUpstream(responses)
+        patcher = mock.patch.object(async_http, "client", return_value=stub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        mailer = mock.patch.object(emails.NewEmail, "send", accept_email)
+        mailer.start()
+        self.addCleanup(mailer.stop)
+        return stub
+
+    def order(self, **kwargs):
+        return CartOrder.objects.create(total=Decimal("10.00"), **kwargs)
+
+    async def pay(self, order, **payload):
+        return await self.async_client.post(
+            f"/api/v1/payment-success/{order.oid}/",
+            {"order_oid": order.oid, **payload},
+            content_type="application/json",
+        )
+
+    async def test_media_hit(self):
+        self.assertTrue(iscoroutinefunction(resolve("/media-proxy/products/shoe.png").func))
+        self.assertTrue(iscoroutinefunction(resolve("/api/v1/payment-success/x/").func))
+
+        response = await self.async_client.get("/media-proxy/products/shoe.png")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"png")
+        self.assertEqual(response["X-Media-Tier"], "local")
+        # Server-Timing of both the view and the metrics middleware
+        self.assertIn('media;desc="local"', response["Server-Timing"])
+        self.assertIn("total;dur=", response["Server-Timing"])
+
+    async def test_media_miss(self):
+        response = await self.async_client.get("/media-proxy/products/missing.png")
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response["Content-Type"], "image/svg+xml")
+        self.assertTrue(await cache.aget(MISS_CACHE_KEY.format("products/missing.png")))
+
+    async def test_media_unavailable(self):
+        with mock.patch.object(TieredStorage, "aread", side_effect=requests.ConnectionError):
+            response = await self.async_client.get("/media-proxy/products/shoe.png")
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertIsNone(await cache.aget(MISS_CACHE_KEY.format("products/shoe.png")))
+
+    async def test_cash_on_delivery(self):
+        stub = self.upstream({})
+        order = await sync_to_async(self.order)(payment_method="Cash On Delivery")
+
+        response = await self.pay(order)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "success")
+        await order.arefresh_from_db()
+        self.assertEqual((order.payment_status, order.order_status), ("pending", "processing"))
+        self.assertEqual(stub.calls, [])
+
+    async def test_stripe(self):
+        stub = self.upstream(
+            {
+                STRIPE_SESSION_URL.format("cs_paid"): StubResponse(200, {"payment_status": "paid"}),
+                STRIPE_SESSION_URL.format("cs_bad"): StubResponse(
+                    404, {"error": {"message": "No such checkout session"}}
+                ),
+            }
+        )
+        order = await sync_to_async(self.order)(payment_method="stripe")
+
+        response = await self.pay(order, session_id="cs_bad")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["error"], "No such checkout session")
+
+        response = await self.pay(order, session_id="cs_paid")
+        self.assertEqual(response.json()["status"], "success")
+        await order.arefresh_from_db()
+        self.assertEqual(order.payment_status, "paid")
+        self.assertEqual(len(stub.calls), 2)
+
+        # The stubbed call is timed toward the request's upstream time
+        timing = response["Server-Timing"]
+        upstream = float(timing.split("upstream;dur=")[1].split(",")[0])
+        self.assertGreaterEqual(upstream, stub.delay * 1000)
+        self.assertTrue(
+            any(
+                name == "http_request_upstream_seconds" and values[-1] > 0
+                for (name, labels), values in metrics.registry.histograms.items()
+            )
+        )
+
+    async def test_paypal(self):
+        await cache.adelete(PAYPAL_TOKEN_CACHE_KEY)
+        stub = self.upstream(
+            {
+                PAYPAL_TOKEN_URL: StubResponse(
+                    200, {"access_token": "token", "expires_in": 3600}
+                ),
+                PAYPAL_ORDER_URL.format("PAY-1"): StubResponse(200, {"status": "COMPLETED"}),
+                PAYPAL_ORDER_URL.format("PAY-2"): StubResponse(200, {"status": "APPROVED"}),
+            }
+        )
+        first = await sync_to_async(self.order)(payment_method="paypal")
+        second = await sync_to_async(self.order)(payment_method="paypal")
+
+        response = await self.pay(second, paypal_order_id="PAY-2")
+        self.assertEqual(response.json()["status"], "warning")
+
+        response = await self.pay(first, paypal_order_id="PAY-1")
+        self.assertEqual(response.json()["status"], "success")
+        await first.arefresh_from_db()
+        self.assertEqual(first.payment_status, "paid")
+
+        # One token for both payments
+        self.assertEqual([url for method, url in stub.calls].count(PAYPAL_TOKEN_URL), 1)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """
+    Routing against a second SQLite database standing in for a replica.
+    It is not a test mirror, so rows only written to one database show
+    which one a request read from. The replica is a temporary file added
+    after the test databases are set up. Not a TestCase: reads inside a
+    transaction always go to the primary
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        handle, cls.replica_path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(handle)
+        connections.settings["replica"] = {
+            **connections.settings["default"],
+            "NAME": cls.replica_path,
+            "TEST": {**connections.settings["default"]["TEST"], "MIRROR": None},
+        }
+        # Unknown to the test runner's database checks, allowed from here on
+        cls.databases = {*cls.databases, "replica"}
+        call_command("migrate", database="replica", verbosity=0)
+        cls.replica_settings = override_settings(
+            REPLICA_DATABASES={"replica": connections.settings["replica"]}
+        )
+        cls.replica_settings.enable()
+        Category.objects.using("replica").create(title="On the replica", slug="replica")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.replica_settings.disable()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.settings["replica"]
+        os.remove(cls.replica_path)
+        super().tearDownClass()
+
+    def setUp(self):
+        Category.objects.create(title="On the primary", slug="primary")
+        cache.clear()
+        replicas.unavailable.clear()
+
+    def test_safe_requests_read_from_the_replica(self):
+        response = self.client.get("/api/v1/category/")
+        self.assertContains(response, "On the replica")
+        self.assertNotContains(response, "On the primary")
+
+    def test_writes_stick_the_client_to_the_primary(self):
+        response = self.client.post(
+            "/api/v1/user/register/",
+            {
+                "full_name": "New Buyer",
+                "email": "new@example.com",
+                "phone": "123",
+                "password": "Secret-pass-2",
+                "password2": "Secret-pass-2",
+            },
+        )
+        self.assertIn(replicas.STICKY_COOKIE, response.cookies)
+        self.assertTrue(User.objects.filter(email="new@example.com").exists())
+        self.assertFalse(User.objects.using("replica").filter(email="new@example.com").exists())
+
+        # The cookie, then the flag on the client address without it
+        self.assertContains(self.client.get("/api/v1/category/"), "On the primary")
+        self.client.cookies.clear()
+        self.assertContains(self.client.get("/api/v1/category/"), "On the primary")
+
+    async def test_async_requests_are_routed(self):
+        with async_views():
+            response = await self.async_client.get("/api/v1/category/")
+            self.assertContains(response, "On the replica")
+
+            response = await self.async_client.post(
+                "/api/v1/user/register/",
+                {
+                    "full_name": "Async Buyer",
+                    "email": "async@example.com",
+                    "phone": "123",
+                    "password": "Secret-pass-2",
+                    "password2": "Secret-pass-2",
+                },
+            )
+            self.assertIn(replicas.STICKY_COOKIE, response.cookies)
+            response = await self.async_client.get("/api/v1/category/")
+            self.assertContains(response, "On the primary")
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        router = replicas.ReplicaRouter()
+        token = replicas.routing.set(replicas.Routing("replica"))
+        try:
+            self.assertEqual(router.db_for_read(Category), "replica")
+            self.assertEqual(router.db_for_write(Category), "default")
+            self.assertEqual(router.db_for_read(Category), "default")
+            self.assertTrue(replicas.routing.get().wrote)
+        finally:
+            replicas.routing.reset(token)
+
+    def test_use_primary_views_read_from_the_primary(self):
+        user = User.objects.create_user(
+            email="buyer@example.com", username="buyer", password="secret-pass-1"
+        )
+        notification = Notification.objects.create(user=user)
+
+        response = self.client.get(f"/api/v1/customer/notification/{user.id}/{notification.id}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_unreachable_replica_falls_back_to_the_primary(self):
+        with mock.patch.object(
+            connections["replica"], "ensure_connection", side_effect=DatabaseError("down")
+        ):
+            response = self.client.get("/api/v1/category/")
+        self.assertContains(response, "On the primary")
+        self.assertIn("replica", replicas.unavailable)
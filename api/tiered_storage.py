@@ -0,0 +1,357 @@
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from io import BytesIO
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage, Storage, storages
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+
+from api import async_http, resilience
+from api.models import MediaLocation
+
+logger = logging.getLogger(__name__)
+
+MISS_CACHE_KEY = "media-miss:{}"
+
+# Tiers read without requests, behind their own EXTERNAL_SERVICES guard.
+# Cloudinary is guarded by host like every call made with requests
+GUARDED_TIERS = ("s3",)
+
+
+def check_status(response, name):
+    """
+    Missing objects raise FileNotFoundError, server errors HTTPError so the
+    key is not taken for missing while the tier is down
+    """
+    if response.status_code >= 500:
+        raise requests.HTTPError(f"{response.status_code} reading {name}")
+    if response.status_code != 200:
+        raise FileNotFoundError(name)
+
+
+class CloudinaryStorage(Storage):
+    """
+    Read-only access to images already delivered by Cloudinary
+
+    Cloudinary is kept as the last tier for media uploaded while it was the
+    production storage, new files are written to the primary tier.
+    """
+
+    def __init__(self, cloud_name=None, timeout=None):
+        self.cloud_name = cloud_name or settings.CLOUDINARY_CLOUD_NAME
+        self.timeout = timeout or settings.MEDIA_TIER_TIMEOUT
+
+    def url(self, name):
+        return f"https://res.cloudinary.com/{self.cloud_name}/image/upload/{name}"
+
+    def _open(self, name, mode="rb"):
+        response = requests.get(self.url(name), timeout=self.timeout)
+        check_status(response, name)
+        file = File(BytesIO(response.content), name=name)
+        file.content_type = response.headers.get("Content-Type")
+        return file
+
+    def _save(self, name, content):
+        raise PermissionError("The Cloudinary tier is read-only")
+
+    def exists(self, name):
+        response = requests.head(self.url(name), timeout=self.timeout)
+        return response.status_code == 200
+
+    def size(self, name):
+        response = requests.head(self.url(name), timeout=self.timeout)
+        check_status(response, name)
+        return int(response.headers.get("Content-Length", 0))
+
+    def delete(self, name):
+        raise PermissionError("The Cloudinary tier is read-only")
+
+
+def build_tier(name):
+    if name == "local":
+        return FileSystemStorage(location=settings.MEDIA_ROOT, base_url=settings.MEDIA_URL)
+    if name == "s3":
+        return import_string("storages.backends.s3.S3Storage")()
+    if name == "cloudinary":
+        return CloudinaryStorage()
+    raise ValueError(f"Unknown media tier {name!r}, expected local, s3 or cloudinary")
+
+
+class TierStats:
+    """
+    Per process read counts and time spent in each tier
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tiers = {}
+
+    def record(self, tier, hit, seconds):
+        with self.lock:
+            stats = self.tiers.setdefault(tier, {"hits": 0, "misses": 0, "seconds": 0.0})
+            stats["hits" if hit else "misses"] += 1
+            stats["seconds"] += seconds
+
+    def snapshot(self):
+        with self.lock:
+            return {tier: dict(stats) for tier, stats in self.tiers.items()}
+
+
+tier_stats = TierStats()
+
+
+@deconstructible
+class TieredStorage(Storage):
+    """
+    One storage over an ordered list of tiers, MEDIA_TIERS
+
+    Writes go to MEDIA_PRIMARY_TIER. Reads return the object from the first
+    tier holding it, starting with the tier recorded for the key in
+    MediaLocation by earlier reads. Objects read from a remote tier are copied into the
+    local tier when it is listed first, so it acts as a disk cache. Keys
+    found nowhere are remembered for MEDIA_MISS_TTL seconds, unless a tier
+    failed or was skipped by its circuit breaker: those reads raise
+    ServiceUnavailable instead.
+    """
+
+    def __init__(self, tiers=None, primary=None):
+        self._tier_names = tiers
+        self._primary_name = primary
+
+    @cached_property
+    def tiers(self):
+        names = self._tier_names or settings.MEDIA_TIERS
+        return {name: build_tier(name) for name in names}
+
+    @property
+    def primary_name(self):
+        return self._primary_name or settings.MEDIA_PRIMARY_TIER
+
+    @property
+    def primary(self):
+        return self.tiers[self.primary_name]
+
+    @property
+    def cache_name(self):
+        first = next(iter(self.tiers))
+        if first == "local" and first != self.primary_name:
+            return first
+        return None
+
+    def candidates(self, name):
+        """
+        Tier names to try in order, the indexed tier first after the cache
+        """
+        indexed = (
+            MediaLocation.objects.filter(key=name).values_list("tier", flat=True).first()
+        )
+        order = list(self.tiers)
+        if indexed in self.tiers:
+            order.remove(indexed)
+            order.insert(0, indexed)
+            if self.cache_name and indexed != self.cache_name:
+                order.remove(self.cache_name)
+                order.insert(0, self.cache_name)
+        return indexed, order
+
+    def locate(self, name):
+        """
+        Open `name` from the first tier that has it, returns
+        (tier name, file, seconds spent reading)
+        """
+        if cache.get(MISS_CACHE_KEY.format(name)):
+            raise FileNotFoundError(name)
+
+        indexed, order = self.candidates(name)
+        started = time.perf_counter()
+        failed = []
+        for tier in order:
+            tier_started = time.perf_counter()
+            try:
+                with self.guard(tier):
+                    file = self.tiers[tier].open(name)
+            except FileNotFoundError:
+                file = None
+            except Exception as e:
+                logger.warning(f"Media tier {tier} failed reading {name}: {e}")
+                failed.append(tier)
+                file = None
+            tier_stats.record(tier, file is not None, time.perf_counter() - tier_started)
+
+            if file is not None:
+                if tier != self.cache_name and tier != indexed:
+                    self.index(name, tier, indexed)
+                if self.cache_name and tier != self.cache_name:
+                    file = self.fill_cache(name, file)
+                return tier, file, time.perf_counter() - started
+
+        if failed:
+            raise resilience.ServiceUnavailable(f"{name}: media tiers {failed} unavailable")
+        MediaLocation.objects.filter(key=name).delete()
+        cache.set(MISS_CACHE_KEY.format(name), True, settings.MEDIA_MISS_TTL)
+        raise FileNotFoundError(name)
+
+    async def alocate(self, name):
+        """
+        locate for async views, returns (tier name, content, content type,
+        seconds spent reading). Cloudinary and S3 objects are fetched over
+        HTTP with the pooled async client, other tiers on a worker thread
+        """
+        if await cache.aget(MISS_CACHE_KEY.format(name)):
+            raise FileNotFoundError(name)
+
+        indexed, order = await sync_to_async(self.candidates)(name)
+        started = time.perf_counter()
+        failed = []
+        for tier in order:
+            tier_started = time.perf_counter()
+            try:
+                content, content_type = await self.aread(tier, name)
+            except FileNotFoundError:
+                content = None
+            except Exception as e:
+                logger.warning(f"Media tier {tier} failed reading {name}: {e}")
+                failed.append(tier)
+                content = None
+            tier_stats.record(tier, content is not None, time.perf_counter() - tier_started)
+
+            if content is not None:
+                if tier != self.cache_name and tier != indexed:
+                    await sync_to_async(self.index)(name, tier, indexed)
+                if self.cache_name and tier != self.cache_name:
+                    await sync_to_async(self.fill_cache)(name, ContentFile(content, name=name))
+                return tier, content, content_type, time.perf_counter() - started
+
+        if failed:
+            raise resilience.ServiceUnavailable(f"{name}: media tiers {failed} unavailable")
+        await MediaLocation.objects.filter(key=name).adelete()
+        await cache.aset(MISS_CACHE_KEY.format(name), True, settings.MEDIA_MISS_TTL)
+        raise FileNotFoundError(name)
+
+    async def aread(self, tier, name):
+        """
+        (content, content type) of `name` on one tier
+        """
+        storage = self.tiers[tier]
+        if isinstance(storage, CloudinaryStorage) or tier == "s3":
+            # S3 URLs are presigned locally, the first call may look up
+            # credentials
+            url = await sync_to_async(storage.url)(name)
+            response = await async_http.request(
+                "GET", url, timeout=settings.MEDIA_TIER_TIMEOUT, service=tier
+            )
+            check_status(response, name)
+            return response.content, response.headers.get("Content-Type")
+
+        def read():
+            with storage.open(name) as file:
+                return file.read(), getattr(file, "content_type", None)
+
+        return await sync_to_async(read)()
+
+    def guard(self, tier):
+        """
+        Circuit breaker and bulkhead of a tier in GUARDED_TIERS
+        """
+        if tier in GUARDED_TIERS:
+            return resilience.service(tier).guard()
+        return nullcontext()
+
+    def index(self, name, tier, indexed):
+        # Keys on the first tier are found without the index
+        first = next(t for t in self.tiers if t != self.cache_name)
+        if tier != first:
+            MediaLocation.objects.update_or_create(key=name, defaults={"tier": tier})
+        elif indexed:
+            MediaLocation.objects.filter(key=name).delete()
+
+    def fill_cache(self, name, file):
+        local = self.tiers[self.cache_name]
+        content = ContentFile(file.read(), name=name)
+        file.close()
+        try:
+            if not local.exists(name):
+                local.save(name, content)
+        except Exception as e:
+            logger.warning(f"Could not cache {name} on local disk: {e}")
+        content.seek(0)
+        return content
+
+    def _open(self, name, mode="rb"):
+        return self.locate(name)[1]
+
+    def _save(self, name, content):
+        # The index is filled in by reads, saving may run on upload threads
+        with self.guard(self.primary_name):
+            name = self.primary.save(name, content)
+        cache.delete(MISS_CACHE_KEY.format(name))
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        return self.primary.get_available_name(name, max_length=max_length)
+
+    def generate_filename(self, filename):
+        return self.primary.generate_filename(filename)
+
+    def delete(self, name):
+        for tier, storage in self.tiers.items():
+            if isinstance(storage, CloudinaryStorage):
+                continue
+            storage.delete(name)
+        MediaLocation.objects.filter(key=name).delete()
+
+    def exists(self, name):
+        if cache.get(MISS_CACHE_KEY.format(name)):
+            return False
+        indexed, order = self.candidates(name)
+        for tier in order:
+            try:
+                if self.tiers[tier].exists(name):
+                    return True
+            except Exception as e:
+                logger.warning(f"Media tier {tier} failed checking {name}: {e}")
+        return False
+
+    def size(self, name):
+        indexed, order = self.candidates(name)
+        for tier in order:
+            try:
+                return self.tiers[tier].size(name)
+            except Exception:
+                continue
+        raise FileNotFoundError(name)
+
+    def url(self, name):
+        # Serialized URLs point at the primary tier, objects living on
+        # another tier are still served by the media proxy
+        return self.primary.url(name)
+
+    def path(self, name):
+        return self.primary.path(name)
+
+    def listdir(self, path):
+        return self.primary.listdir(path)
+
+    def get_modified_time(self, name):
+        return self.primary.get_modified_time(name)
+
+
+media_storage = TieredStorage()
+
+
+def get_media_storage():
+    """
+    The default storage when it is tiered, otherwise one built from the
+    MEDIA_TIERS settings
+    """
+    if isinstance(storages["default"], TieredStorage):
+        return storages["default"]
+    return media_storage
@@ -0,0 +1,229 @@
+import logging
+import os
+import posixpath
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.core.exceptions import PermissionDenied
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import UploadSession
+from store.models import Gallery, Product
+from userauths.models import Profile
+from vendor.models import Vendor
+
+logger = logging.getLogger(__name__)
+
+# target: (model the object_id refers to, model whose image field is set)
+TARGETS = {
+    "product": (Product, Product),
+    "gallery": (Product, Gallery),
+    "vendor": (Vendor, Vendor),
+    "profile": (Profile, Profile),
+}
+
+# target: lookup from the object_id model to the user allowed to change it
+OWNERS = {
+    "product": "vendor__user",
+    "gallery": "vendor__user",
+    "vendor": "user",
+    "profile": "user",
+}
+
+SIGNING_SALT = "api.uploads"
+
+
+class UploadError(Exception):
+    """
+    Raised with a user facing message when an upload session is invalid
+    """
+
+
+def image_field(session):
+    return TARGETS[session.target][1]._meta.get_field("image")
+
+
+def upload_storage(session):
+    # Keys are chosen up front, so skip the content-hash naming of DedupStorage,
+    # and clients upload straight to the primary tier of TieredStorage
+    storage = image_field(session).storage
+    storage = getattr(storage, "backing", storage)
+    return getattr(storage, "primary", storage)
+
+
+def is_s3(storage):
+    return getattr(storage, "bucket_name", None) is not None
+
+
+def check_owner(target, object_id, user):
+    """
+    Raise PermissionDenied unless user may change the image of the target
+    object: its vendor's user for products and galleries, its user for
+    vendors and profiles, or staff
+    """
+    if user is None or not user.is_authenticated:
+        raise PermissionDenied("Sign in to upload images")
+    if user.is_staff:
+        return
+    owner_model = TARGETS[target][0]
+    if not owner_model.objects.filter(pk=object_id, **{OWNERS[target]: user}).exists():
+        raise PermissionDenied(f"You cannot change the images of this {target}")
+
+
+def create_session(target, object_id, filename, content_type, size, user=None):
+    if target not in TARGETS:
+        raise UploadError(f"target must be one of: {', '.join(TARGETS)}")
+    if not content_type or not content_type.startswith("image/"):
+        raise UploadError("Only image uploads are supported")
+    try:
+        size = int(size)
+        object_id = int(object_id)
+    except (TypeError, ValueError):
+        raise UploadError("size and object_id must be integers")
+    if not 0 < size <= settings.UPLOAD_MAX_BYTES:
+        raise UploadError(f"size must be between 1 and {settings.UPLOAD_MAX_BYTES} bytes")
+
+    owner_model, model = TARGETS[target]
+    if not owner_model.objects.filter(pk=object_id).exists():
+        raise UploadError(f"{owner_model.__name__} {object_id} does not exist")
+    check_owner(target, object_id, user)
+
+    field = model._meta.get_field("image")
+    extension = os.path.splitext(filename or "")[1].lower()[:10]
+    key = field.generate_filename(model(), f"{uuid.uuid4().hex}{extension}")
+
+    return UploadSession.objects.create(
+        user=user,
+        target=target,
+        object_id=object_id,
+        key=key,
+        content_type=content_type,
+        size=size,
+        expires=timezone.now() + timedelta(seconds=settings.UPLOAD_SESSION_TTL),
+    )
+
+
+def presign(session, local_upload_url):
+    """
+    How the client sends the file: a form POST of `fields` plus a `file`
+    part to `url`
+
+    S3 storages (including S3 compatible servers set with
+    AWS_S3_ENDPOINT_URL) get a presigned POST so the bytes go straight to the
+    bucket. The local file system storage gets a signed form for
+    local_upload_url instead.
+    """
+    storage = upload_storage(session)
+
+    if is_s3(storage):
+        key = posixpath.join(storage.location, session.key) if storage.location else session.key
+        post = storage.connection.meta.client.generate_presigned_post(
+            Bucket=storage.bucket_name,
+            Key=key,
+            Fields={"Content-Type": session.content_type},
+            Conditions=[
+                {"Content-Type": session.content_type},
+                ["content-length-range", 1, session.size],
+            ],
+            ExpiresIn=settings.UPLOAD_SESSION_TTL,
+        )
+        return {"method": "POST", "url": post["url"], "fields": post["fields"]}
+
+    if isinstance(storage, FileSystemStorage):
+        return {
+            "method": "POST",
+            "url": local_upload_url,
+            "fields": {
+                "signature": signing.TimestampSigner(salt=SIGNING_SALT).sign(
+                    str(session.id)
+                ),
+            },
+        }
+
+    raise UploadError(
+        f"Direct uploads are not supported by {type(storage).__name__}, "
+        "upload the image with the regular form endpoints"
+    )
+
+
+def get_pending(session_id):
+    try:
+        session = UploadSession.objects.get(id=session_id)
+    except UploadSession.DoesNotExist:
+        raise UploadError("Upload session does not exist")
+
+    if session.status != "pending":
+        raise UploadError(f"Upload session is {session.status}")
+    if session.expires <= timezone.now():
+        session.status = "expired"
+        session.save(update_fields=["status"])
+        raise UploadError("Upload session has expired")
+
+    return session
+
+
+def receive_local_upload(session_id, signature, file):
+    """
+    Store a file sent to the local storage upload endpoint
+    """
+    try:
+        signed_id = signing.TimestampSigner(salt=SIGNING_SALT).unsign(
+            signature or "", max_age=settings.UPLOAD_SESSION_TTL
+        )
+    except signing.BadSignature:
+        raise UploadError("Invalid or expired upload signature")
+    if signed_id != str(session_id):
+        raise UploadError("Invalid or expired upload signature")
+
+    session = get_pending(session_id)
+
+    if file is None:
+        raise UploadError("No file was sent")
+    if file.size > session.size:
+        raise UploadError(f"File is larger than the {session.size} bytes requested")
+
+    storage = upload_storage(session)
+    if storage.exists(session.key):
+        storage.delete(session.key)
+    storage.save(session.key, file)
+
+    return session
+
+
+def complete_session(session_id, user=None):
+    """
+    Check the uploaded object and attach its key to the target, returns
+    (session, instance). Only the user who started the session completes it
+    """
+    session = get_pending(session_id)
+    if session.user_id != getattr(user, "pk", None) and not getattr(user, "is_staff", False):
+        raise PermissionDenied("This upload session belongs to another user")
+    check_owner(session.target, session.object_id, user)
+    storage = upload_storage(session)
+
+    if not storage.exists(session.key):
+        raise UploadError("The file has not been uploaded yet")
+    if storage.size(session.key) > session.size:
+        storage.delete(session.key)
+        raise UploadError(f"File is larger than the {session.size} bytes requested")
+
+    with transaction.atomic():
+        if session.target == "gallery":
+            instance = Gallery.objects.create(
+                product_id=session.object_id, image=session.key
+            )
+        else:
+            model = TARGETS[session.target][1]
+            instance = model.objects.select_for_update().get(pk=session.object_id)
+            instance.image = session.key
+            instance.save()
+
+        session.status = "completed"
+        session.completed = timezone.now()
+        session.save(update_fields=["status", "completed"])
+
+    return session, instance
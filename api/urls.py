@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from django.http import HttpResponseRedirect
 
@@ -7,18 +8,26 @@ from userauths import views as userauths_views
 from store import views as store_views
 from customer import views as customer_views
 from vendor import views as vendor_views
-from . import views
+from store import async_views as store_async_views
+from . import async_views, views
 
 # Import logging for URL troubleshooting
 import logging
 logger = logging.getLogger(__name__)
 
+if settings.ASYNC_VIEWS:
+    media_proxy = async_views.media_proxy
+    payment_success = store_async_views.payment_success
+else:
+    media_proxy = views.media_proxy
+    payment_success = store_views.PaymentSuccessView.as_view()
+
 urlpatterns = [
     # Root URL - API information
     path('', views.api_root, name='api_root'),
     
     # Media proxy for handling images
-    path('media-proxy/<path:path>', views.media_proxy, name='media_proxy'),
+    path('media-proxy/<path:path>', media_proxy, name='media_proxy'),
     
     # Version 1 API endpoints
     path('v1/', include([
@@ -37,6 +46,19 @@ urlpatterns = [
         path("category/", store_views.CategoryListAPIView.as_view()),
         path("products/", store_views.ProductListAPIView.as_view()),
         path("products/<slug>/", store_views.ProductDetailAPIView.as_view()),
+        path("trending-products/", store_views.TrendingProductsAPIView.as_view()),
+        # DIRECT UPLOADS
+        path("uploads/", views.create_upload_session, name="create_upload_session"),
+        path(
+            "uploads/<uuid:upload_id>/file/",
+            views.upload_session_file,
+            name="upload_session_file",
+        ),
+        path(
+            "uploads/<uuid:upload_id>/complete/",
+            views.complete_upload_session,
+            name="complete_upload_session",
+        ),
         path("cart-view/", store_views.CartAPIView.as_view()),
         path("cart-list/<str:cart_id>/<int:user_id>/", store_views.CartListView.as_view()),
         path("cart-list/<str:cart_id>/null/", store_views.CartListView.as_view()),
@@ -61,7 +83,7 @@ urlpatterns = [
         # PAYMENT ENDPOINTS
         path("stripe-checkout/<order_oid>/", store_views.StripeCheckoutAPIView.as_view()),
         path("order/cod/<order_oid>/", store_views.CashOnDeliveryAPIView.as_view()),
-        path("payment-success/<order_oid>/", store_views.PaymentSuccessView.as_view()),
+        path("payment-success/<order_oid>/", payment_success),
         # CUSTOMER ENDPOINTS
         path("customer/orders/<user_id>/", customer_views.OrdersAPIView.as_view()),
         path(
@@ -79,10 +101,13 @@ urlpatterns = [
         ),
         # VENDOR ENDPOINTS
         path("vendor/stats/<vendor_id>/", vendor_views.DashboardStatsAPIView.as_view()),
+        path("vendor/overview/<vendor_id>/", vendor_views.VendorOverviewAPIView.as_view()),
         path("vendor-orders-chart/<vendor_id>/", vendor_views.MonthlyOrderChartAPIView),
         path("vendor-products-chart/<vendor_id>/", vendor_views.MonthlyProductChartAPIView),
+        path("vendor/analytics/<vendor_id>/", vendor_views.VendorAnalyticsAPIView),
         path("vendor/products/<vendor_id>/", vendor_views.ProductAPIView.as_view()),
         path("vendor/orders/<vendor_id>/", vendor_views.OrderAPIView.as_view()),
+        path("vendor/export/<vendor_id>/<kind>/", vendor_views.VendorExportView),
         path(
             "vendor/orders/<vendor_id>/<order_oid>/",
             vendor_views.OrderDetailAPIView.as_view(),
@@ -155,9 +180,10 @@ urlpatterns = [
     
     # Debugging/testing endpoints - also make them available directly at root level for easier testing
     path('debug-images/', views.debug_image_paths, name='debug_image_paths'),
+    path('debug-images/inventory/', views.media_inventory, name='media_inventory'),
     path('debug-cloudinary/', views.debug_cloudinary, name='debug_cloudinary'),
     path('test-image/<str:format>/', views.test_image, name='test_image'),
     
     # Redirect from media paths directly to the proxy
-    path('media/<path:path>', views.media_proxy, name='media_direct'),
+    path('media/<path:path>', media_proxy, name='media_direct'),
 ]
@@ -1,13 +1,27 @@
 from django.shortcuts import render, redirect
 import requests
-from django.http import HttpResponse, Http404, JsonResponse, HttpResponseRedirect
+from django.http import FileResponse, HttpResponse, Http404, JsonResponse, HttpResponseRedirect, StreamingHttpResponse
 from django.conf import settings
+import json
 import mimetypes
 import os
 import datetime
+import hmac
 import logging
-from rest_framework.decorators import api_view
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authentication import SessionAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from api import inventory, metrics, resilience, uploads
+from api.inventory import manifest_entry
+from api.models import MediaInventoryScan, MediaManifest
+from api.tiered_storage import get_media_storage, tier_stats
+
+logger = logging.getLogger(__name__)
 
 # Register AVIF MIME type to ensure proper content type detection
 mimetypes.add_type('image/avif', '.avif')
@@ -34,334 +48,84 @@ def api_root(request):
         }
     })
 
+PLACEHOLDER_SVG = (
+    b'<svg xmlns="http://www.w3.org/2000/svg" width="200" height="200" viewBox="0 0 200 200">'
+    b'<rect width="200" height="200" fill="#f0f0f0"/>'
+    b'<text x="50%" y="50%" font-family="Arial" font-size="14" text-anchor="middle" fill="#999">Image Not Found</text>'
+    b'</svg>'
+)
+
+
+def media_names(path):
+    """
+    Keys a requested media path may be stored under, older links add or
+    drop the media/ and products/ prefixes
+    """
+    path = path.lstrip('/')
+    for prefix in ('static/media/', 'media/'):
+        if path.startswith(prefix):
+            path = path[len(prefix):]
+    if path.startswith('products/'):
+        return [path, path[len('products/'):]]
+    return [path, f"products/{path}"]
+
+
+def serve_media(path):
+    """
+    Serve a media file from the first storage tier that has it, with the
+    tier and its read time in the X-Media-Tier and Server-Timing headers
+    """
+    storage = get_media_storage()
+    unavailable = False
+    for name in media_names(path):
+        try:
+            tier, file, seconds = storage.locate(name)
+        except FileNotFoundError:
+            continue
+        except resilience.ServiceUnavailable:
+            unavailable = True
+            continue
+
+        content_type = getattr(file, 'content_type', None) or mimetypes.guess_type(name)[0]
+        response = FileResponse(file, content_type=content_type or 'application/octet-stream')
+        response['Cache-Control'] = 'max-age=86400, public'
+        response['X-Media-Tier'] = tier
+        response['Server-Timing'] = f'media;desc="{tier}";dur={seconds * 1000:.1f}'
+        return response
+
+    if unavailable:
+        return media_unavailable(path)
+    logger.warning(f"Media file not found on any tier: {path}")
+    return HttpResponse(PLACEHOLDER_SVG, content_type='image/svg+xml', status=404)
+
+
+def media_unavailable(path):
+    """
+    The placeholder while a tier that may hold the file is down, not cached
+    so the image shows once the tier is back
+    """
+    logger.warning(f"Media tiers unavailable, serving a placeholder: {path}")
+    response = HttpResponse(PLACEHOLDER_SVG, content_type='image/svg+xml', status=503)
+    response['Cache-Control'] = 'no-store'
+    response['Retry-After'] = str(settings.MEDIA_UNAVAILABLE_RETRY_AFTER)
+    return response
+
+
 @api_view(['GET'])
 def media_proxy(request, path):
     """
-    Media proxy view to forward requests to Cloudinary
-    
-    This method directly serves the image content rather than redirecting
-    to prevent redirect loops
+    Serve media files through the tiered media storage
     """
-    logger.info(f"Media proxy request for: {path}")
-    
-    # Get Cloudinary cloud name from settings
-    cloud_name = getattr(settings, 'CLOUDINARY_STORAGE', {}).get('CLOUD_NAME', 'deepsimage')
-    
-    # Build Cloudinary URL
-    if path.startswith('products/'):
-        cloudinary_url = f"https://res.cloudinary.com/{cloud_name}/image/upload/{path}"
-    else:
-        # If it's not explicitly in the products folder but likely is a product
-        cloudinary_url = f"https://res.cloudinary.com/{cloud_name}/image/upload/products/{path}"
-    
-    logger.info(f"Fetching image from Cloudinary: {cloudinary_url}")
-    
-    try:
-        # Forward the request to Cloudinary
-        cloudinary_response = requests.get(cloudinary_url, stream=True, timeout=5)
-        
-        if cloudinary_response.status_code == 200:
-            # Set content type from response
-            content_type = cloudinary_response.headers.get('Content-Type', 'application/octet-stream')
-            
-            # Create direct response with the image content
-            response = HttpResponse(
-                cloudinary_response.content,
-                content_type=content_type
-            )
-            # Cache for 24 hours
-            response['Cache-Control'] = 'max-age=86400, public'
-            return response
-        else:
-            # Try direct file from local media
-            local_path = os.path.join(settings.MEDIA_ROOT, path)
-            if os.path.exists(local_path) and os.path.isfile(local_path):
-                logger.info(f"Serving file from local media (fallback): {local_path}")
-                with open(local_path, 'rb') as f:
-                    content = f.read()
-                    
-                # Determine content type
-                content_type, _ = mimetypes.guess_type(local_path)
-                response = HttpResponse(
-                    content,
-                    content_type=content_type or 'application/octet-stream'
-                )
-                response['Cache-Control'] = 'max-age=86400, public'
-                return response
-            
-            # If not found, try with products/ prefix
-            if not path.startswith('products/'):
-                alt_cloudinary_url = f"https://res.cloudinary.com/{cloud_name}/image/upload/products/{path}" 
-                alt_response = requests.get(alt_cloudinary_url, stream=True, timeout=5)
-                
-                if alt_response.status_code == 200:
-                    content_type = alt_response.headers.get('Content-Type', 'application/octet-stream')
-                    response = HttpResponse(
-                        alt_response.content,
-                        content_type=content_type
-                    )
-                    response['Cache-Control'] = 'max-age=86400, public'
-                    return response
-            
-            # If still not found, return a placeholder image
-            logger.warning(f"Media file not found: {path}")
-            placeholder_svg = (
-                b'<svg xmlns="http://www.w3.org/2000/svg" width="200" height="200" viewBox="0 0 200 200">'
-                b'<rect width="200" height="200" fill="#f0f0f0"/>'
-                b'<text x="50%" y="50%" font-family="Arial" font-size="14" text-anchor="middle" fill="#999">Image Not Found</text>'
-                b'</svg>'
-            )
-            return HttpResponse(placeholder_svg, content_type='image/svg+xml')
-            
-    except Exception as e:
-        logger.error(f"Error in media proxy: {str(e)}")
-        # Return a placeholder image on error
-        placeholder_svg = (
-            b'<svg xmlns="http://www.w3.org/2000/svg" width="200" height="200" viewBox="0 0 200 200">'
-            b'<rect width="200" height="200" fill="#f0f0f0"/>'
-            b'<text x="50%" y="50%" font-family="Arial" font-size="14" text-anchor="middle" fill="#999">Error Loading Image</text>'
-            b'</svg>'
-        )
-        return HttpResponse(placeholder_svg, content_type='image/svg+xml')
+    return serve_media(path)
+
 
 def proxy_s3_media(request, path):
     """
-    Proxy for S3 media files to bypass CORS restrictions.
-    This fetches and serves files from S3 through the Django backend.
+    Older media proxy URL, served the same way as media_proxy
     """
-    # Import logging for troubleshooting
-    logger = logging.getLogger(__name__)
-    
     if not path:
-        logger.warning("No path specified in proxy request")
         raise Http404("No path specified")
-    
-    logger.info(f"Proxying media request for path: {path}")
-    
-    # Try different possible image paths
-    possible_paths = [
-        # Original path as requested
-        path,
-        
-        # Without 'products/' prefix if it exists
-        path.replace('products/', '') if path.startswith('products/') else None,
-        
-        # With 'products/' prefix if not already there
-        f"products/{path}" if not path.startswith('products/') else None,
-        
-        # Try with media/ prefix
-        f"media/{path}" if not path.startswith('media/') else None,
-        
-        # Remove static/media/ prefix if it exists (to handle frontend requests)
-        path.replace('static/media/', '') if 'static/media/' in path else None,
-        
-        # Common variations
-        path.replace('_', '-') if '_' in path else None,
-        path.replace('-', '_') if '-' in path else None
-    ]
-    
-    # Filter out None values
-    possible_paths = [p for p in possible_paths if p]
-    logger.info(f"Will try these paths: {possible_paths}")
-    
-    # Get the current S3 bucket name and region
-    current_bucket = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', 'koshimart-api')
-    s3_region = getattr(settings, 'AWS_S3_REGION_NAME', 'eu-north-1')
-    
-    # Try all possible paths
-    last_error = None
-    for try_path in possible_paths:
-        try:
-            # Build the full S3 URL with region
-            s3_url = f"https://{current_bucket}.s3.{s3_region}.amazonaws.com/{try_path}"
-            logger.info(f"Trying S3 URL: {s3_url}")
-            
-            # Fetch the file from S3
-            response = requests.get(s3_url, stream=True)
-            
-            if response.status_code == 200:
-                logger.info(f"Found image at {s3_url}")
-                # Success! Return the image
-                content_type = response.headers.get('Content-Type', 'application/octet-stream')
-                django_response = HttpResponse(
-                    response.content,
-                    content_type=content_type
-                )
-                django_response['Cache-Control'] = 'max-age=86400'
-                return django_response
-            else:
-                # Try URL without region
-                alt_s3_url_1 = f"https://{current_bucket}.s3.amazonaws.com/{try_path}"
-                logger.info(f"Trying S3 URL without region: {alt_s3_url_1}")
-                
-                alt_response_1 = requests.get(alt_s3_url_1, stream=True)
-                if alt_response_1.status_code == 200:
-                    logger.info(f"Found image at URL without region: {alt_s3_url_1}")
-                    content_type = alt_response_1.headers.get('Content-Type', 'application/octet-stream')
-                    django_response = HttpResponse(
-                        alt_response_1.content,
-                        content_type=content_type
-                    )
-                    django_response['Cache-Control'] = 'max-age=86400'
-                    return django_response
-                
-                # Try alternative bucket name
-                alternative_bucket = 'koshimart-media' if current_bucket == 'koshimart-api' else 'koshimart-api'
-                alt_s3_url_2 = f"https://{alternative_bucket}.s3.{s3_region}.amazonaws.com/{try_path}"
-                logger.info(f"Trying alternative bucket with region: {alt_s3_url_2}")
-                
-                alt_response_2 = requests.get(alt_s3_url_2, stream=True)
-                if alt_response_2.status_code == 200:
-                    logger.info(f"Found image at alternative bucket with region: {alt_s3_url_2}")
-                    content_type = alt_response_2.headers.get('Content-Type', 'application/octet-stream')
-                    django_response = HttpResponse(
-                        alt_response_2.content,
-                        content_type=content_type
-                    )
-                    django_response['Cache-Control'] = 'max-age=86400'
-                    return django_response
-                
-                # Try alternative bucket without region
-                alt_s3_url_3 = f"https://{alternative_bucket}.s3.amazonaws.com/{try_path}"
-                logger.info(f"Trying alternative bucket without region: {alt_s3_url_3}")
-                
-                alt_response_3 = requests.get(alt_s3_url_3, stream=True)
-                if alt_response_3.status_code == 200:
-                    logger.info(f"Found image at alternative bucket without region: {alt_s3_url_3}")
-                    content_type = alt_response_3.headers.get('Content-Type', 'application/octet-stream')
-                    django_response = HttpResponse(
-                        alt_response_3.content, 
-                        content_type=content_type
-                    )
-                    django_response['Cache-Control'] = 'max-age=86400'
-                    return django_response
-                
-                last_error = f"S3 returned status {response.status_code} for URL {s3_url}"
-                logger.warning(last_error)
-        except Exception as e:
-            last_error = str(e)
-            logger.warning(f"Error fetching {s3_url}: {last_error}")
-    
-    # Try Cloudinary as the next option
-    try:
-        # Check if Cloudinary is configured - first try env vars, then settings
-        cloudinary_storage = getattr(settings, 'DEFAULT_FILE_STORAGE', '')
-        cloudinary_name = os.environ.get('CLOUDINARY_CLOUD_NAME') or getattr(settings, 'CLOUDINARY_STORAGE', {}).get('CLOUD_NAME')
-        
-        logger.info(f"Checking Cloudinary with name: {cloudinary_name}, storage: {cloudinary_storage}")
-        
-        if 'cloudinary' in cloudinary_storage and cloudinary_name:
-            logger.info(f"Trying Cloudinary with cloud name: {cloudinary_name}")
-            
-            for try_path in possible_paths:
-                # Try both with and without the products/ prefix
-                cloudinary_paths = [try_path]
-                if not try_path.startswith('products/') and 'products/' not in try_path:
-                    cloudinary_paths.append(f"products/{try_path}")
-                elif try_path.startswith('products/'):
-                    cloudinary_paths.append(try_path[9:])  # Remove 'products/'
-                
-                # Also try without any file extension for raw assets
-                base_path = try_path.rsplit('.', 1)[0] if '.' in try_path else try_path
-                if base_path not in cloudinary_paths:
-                    cloudinary_paths.append(base_path)
-                
-                for cloud_path in cloudinary_paths:
-                    try:
-                        # Construct Cloudinary URL
-                        # Format: https://res.cloudinary.com/{cloud_name}/image/upload/{path}
-                        cloudinary_url = f"https://res.cloudinary.com/{cloudinary_name}/image/upload/{cloud_path}"
-                        logger.info(f"Trying Cloudinary URL: {cloudinary_url}")
-                        
-                        cloud_response = requests.get(cloudinary_url, stream=True)
-                        if cloud_response.status_code == 200:
-                            logger.info(f"Found image at Cloudinary: {cloudinary_url}")
-                            # Detect content type - if it's AVIF, explicitly set it
-                            content_type = cloud_response.headers.get('Content-Type', 'application/octet-stream')
-                            if try_path.lower().endswith('.avif'):
-                                content_type = 'image/avif'
-                                
-                            django_response = HttpResponse(
-                                cloud_response.content,
-                                content_type=content_type
-                            )
-                            django_response['Cache-Control'] = 'max-age=86400'
-                            return django_response
-                    except Exception as cloud_err:
-                        logger.warning(f"Error fetching from Cloudinary: {str(cloud_err)}")
-        else:
-            logger.info(f"Cloudinary not configured properly. Storage: {cloudinary_storage}, Name: {cloudinary_name}")
-    except Exception as e:
-        logger.warning(f"Error checking Cloudinary: {str(e)}")
-    
-    # If we get here, all S3 and Cloudinary paths failed
-    logger.error(f"All cloud storage paths failed for {path}. Last error: {last_error}")
-    
-    # Try Django's local media folder as a last resort
-    try:
-        # Check if the file exists in the media directory
-        media_root = settings.MEDIA_ROOT
-        logger.info(f"Checking local media folder: {media_root}")
-        
-        for local_path in possible_paths:
-            local_file_path = os.path.join(media_root, local_path)
-            logger.info(f"Checking if file exists: {local_file_path}")
-            
-            if os.path.exists(local_file_path):
-                # File exists in media directory, serve it directly
-                logger.info(f"Found image in local media folder: {local_file_path}")
-                with open(local_file_path, 'rb') as f:
-                    content = f.read()
-                
-                # Determine content type
-                content_type, _ = mimetypes.guess_type(local_file_path)
-                # Force AVIF content type if needed
-                if local_file_path.lower().endswith('.avif'):
-                    content_type = 'image/avif'
-                
-                django_response = HttpResponse(
-                    content,
-                    content_type=content_type or 'application/octet-stream'
-                )
-                django_response['Cache-Control'] = 'max-age=86400'
-                return django_response
-    except Exception as e:
-        logger.error(f"Error checking local media: {str(e)}")
-    
-    # Generate placeholder as last resort
-    logger.info("Generating placeholder image")
-    try:
-        # Extract a name from the path to personalize the placeholder
-        path_parts = path.split('/')
-        filename = path_parts[-1] if path_parts else 'unknown'
-        
-        # Use filename in placeholder
-        logger.info(f"Generating placeholder for: {filename}")
-        
-        # Generate a placeholder URL - use the first part of the filename
-        name_part = filename.split('_')[0] if '_' in filename else filename.split('.')[0]
-        placeholder_url = f"https://placehold.co/400x400/EEE/999?text=Image:{name_part[:10]}"
-        
-        # Fetch the placeholder
-        placeholder_response = requests.get(placeholder_url, stream=True)
-        
-        if placeholder_response.status_code == 200:
-            logger.info("Successfully generated placeholder")
-            return HttpResponse(
-                placeholder_response.content,
-                content_type=placeholder_response.headers.get('Content-Type', 'image/jpeg')
-            )
-    except Exception as e:
-        logger.error(f"Error generating placeholder: {str(e)}")
-        
-    # If even the placeholder fails, return a simple 1x1 transparent GIF
-    logger.info("Returning fallback transparent GIF")
-    transparent_gif = (
-        b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x80\x00\x00\xff\xff\xff'
-        b'\x00\x00\x00\x21\xf9\x04\x01\x00\x00\x00\x00\x2c\x00\x00\x00\x00'
-        b'\x01\x00\x01\x00\x00\x02\x01\x44\x00\x3b'
-    )
-    return HttpResponse(transparent_gif, content_type='image/gif')
+    return serve_media(path)
 
 def debug_image_paths(request):
     """
@@ -392,6 +156,11 @@ def debug_image_paths(request):
         result['static_url'] = settings.STATIC_URL
         result['static_root'] = str(settings.STATIC_ROOT)
         result['debug_mode'] = settings.DEBUG
+        result['media_tiers'] = {
+            'tiers': settings.MEDIA_TIERS,
+            'primary': settings.MEDIA_PRIMARY_TIER,
+            'reads': tier_stats.snapshot(),
+        }
         
         # Get hostname for URLs
         host = request.get_host()
@@ -449,131 +218,37 @@ def debug_image_paths(request):
             'png': mimetypes.guess_type('test.png')[0]
         }
         
-        # Try to get bucket name
-        aws_bucket = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', None)
-        result['bucket_name'] = aws_bucket
-        
-        # Check for AWS credentials
-        aws_key = getattr(settings, 'AWS_ACCESS_KEY_ID', None)
-        aws_secret = getattr(settings, 'AWS_SECRET_ACCESS_KEY', None)
-        
-        # Only try S3 if we have credentials
-        if aws_key and aws_secret and aws_bucket:
-            try:
-                # Get a list of S3 objects
-                import boto3
-                
-                # Use the AWS credentials from settings
-                s3 = boto3.client(
-                    's3',
-                    aws_access_key_id=aws_key,
-                    aws_secret_access_key=aws_secret,
-                )
-                
-                # Get a list of objects in the bucket
-                max_objects = 100  # Limit to prevent excessive responses
-                
-                # Get bucket objects
-                s3_result = s3.list_objects_v2(Bucket=aws_bucket, MaxKeys=max_objects)
-                
-                # Format the results
-                if 'Contents' in s3_result:
-                    for obj in s3_result['Contents']:
-                        key = obj['Key']
-                        # Build the full S3 URL
-                        s3_url = f"https://{aws_bucket}.s3.amazonaws.com/{key}"
-                        result['s3_objects'].append({
-                            'key': key,
-                            'size': obj['Size'],
-                            'last_modified': obj['LastModified'].isoformat(),
-                            'url': s3_url,
-                            'proxy_url': f"/media-proxy/{key}"
-                        })
-            except Exception as e:
-                result['s3_error'] = f"S3 error: {str(e)}"
-        else:
-            result['s3_error'] = "AWS credentials not configured"
-        
-        # Try to get Cloudinary images if configured
-        if result['is_cloudinary_configured']:
-            try:
-                import cloudinary
-                import cloudinary.api
-                
-                # Get API credentials from env vars or settings
-                api_key = os.environ.get('CLOUDINARY_API_KEY') or getattr(settings, 'CLOUDINARY_STORAGE', {}).get('API_KEY')
-                api_secret = os.environ.get('CLOUDINARY_API_SECRET') or getattr(settings, 'CLOUDINARY_STORAGE', {}).get('API_SECRET')
-                
-                # Configure Cloudinary
-                cloudinary.config(
-                    cloud_name=cloudinary_name,
-                    api_key=api_key,
-                    api_secret=api_secret,
-                )
-                
-                # List Cloudinary resources
-                max_results = 100  # Limit to prevent excessive responses
-                cloud_result = cloudinary.api.resources(max_results=max_results)
-                
-                if 'resources' in cloud_result:
-                    for resource in cloud_result['resources']:
-                        public_id = resource.get('public_id', '')
-                        # Build the full Cloudinary URL
-                        cloud_url = resource.get('secure_url', '')
-                        
-                        # Also get a few transformed URLs for reference
-                        format = resource.get('format', '')
-                        transformed_url = f"https://res.cloudinary.com/{cloudinary_name}/image/upload/c_fill,h_300,w_300/{public_id}.{format}"
-                        auto_url = f"https://res.cloudinary.com/{cloudinary_name}/image/upload/f_auto,q_auto/{public_id}.{format}"
-                        
-                        result['cloudinary_objects'].append({
-                            'public_id': public_id,
-                            'resource_type': resource.get('resource_type', ''),
-                            'type': resource.get('type', ''),
-                            'format': format,
-                            'url': cloud_url,
-                            'transformed_url': transformed_url,
-                            'auto_url': auto_url,
-                            'proxy_url': f"/media-proxy/{public_id}.{format}"
-                        })
-                        
-                        # Use the first image as a test image
-                        if not result['test_image'] and format in ['jpg', 'jpeg', 'png', 'webp', 'avif']:
-                            result['test_image'] = {
-                                'original': cloud_url,
-                                'transformed': transformed_url,
-                                'auto': auto_url,
-                                'proxy': f"{base_url}/media-proxy/{public_id}.{format}",
-                                'via_frontend': f"{base_url}/media/{public_id}.{format}"
-                            }
-            except Exception as e:
-                result['cloudinary_error'] = f"Cloudinary error: {str(e)}"
-        else:
-            result['cloudinary_error'] = "Cloudinary not configured"
-        
-        # Also list files from local media directory
-        try:
-            media_files = []
-            for root, dirs, files in os.walk(settings.MEDIA_ROOT):
-                for file in files:
-                    if file.endswith(('.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif')):
-                        full_path = os.path.join(root, file)
-                        rel_path = os.path.relpath(full_path, settings.MEDIA_ROOT)
-                        media_files.append({
-                            'path': rel_path,
-                            'size': os.path.getsize(full_path),
-                            'url': f"{settings.MEDIA_URL}{rel_path}"
-                        })
-                        
-            # Sort by newest first (using file modification time)
-            sorted_media = sorted(
-                media_files,
-                key=lambda x: os.path.getmtime(os.path.join(settings.MEDIA_ROOT, x['path'])),
-                reverse=True
-            )
-            result['local_media'] = sorted_media[:50]  # Limit to 50 files
-        except Exception as e:
-            result['local_media_error'] = f"Local media error: {str(e)}"
+        # Objects come from the manifest written by the media_inventory
+        # command, listing the tiers here timed out on large trees
+        result['bucket_name'] = getattr(settings, 'AWS_STORAGE_BUCKET_NAME', None)
+        result['inventory'] = {
+            scan.tier: {
+                'entries': scan.entries,
+                'started': scan.started.isoformat(),
+                'finished': scan.finished.isoformat() if scan.finished else None,
+            }
+            for scan in MediaInventoryScan.objects.all()
+        }
+        tiers = get_media_storage().tiers
+        for tier, key, limit in (('local', 'local_media', 50), ('s3', 's3_objects', 100), ('cloudinary', 'cloudinary_objects', 100)):
+            rows = MediaManifest.objects.filter(tier=tier).order_by('-modified')[:limit]
+            result[key] = [
+                {
+                    'key': row.key,
+                    'size': row.size,
+                    'last_modified': row.modified.isoformat() if row.modified else None,
+                    'url': tiers[tier].url(row.key) if tier in tiers else None,
+                    'proxy_url': f"/media-proxy/{row.key}",
+                }
+                for row in rows
+            ]
+        if result['cloudinary_objects']:
+            sample = result['cloudinary_objects'][0]['key']
+            result['test_image'] = {
+                'original': f"https://res.cloudinary.com/{cloudinary_name}/image/upload/{sample}",
+                'proxy': f"{base_url}/media-proxy/{sample}",
+                'via_frontend': f"{base_url}/media/{sample}",
+            }
         
         # Add environment info for debugging
         import platform
@@ -595,6 +270,85 @@ def debug_image_paths(request):
         result['traceback'] = traceback.format_exc()
         return JsonResponse(result)
 
+def positive_int(request, name, default, maximum):
+    """
+    Query parameter `name` as an integer from 1 to maximum, None when it is
+    not a positive integer
+    """
+    try:
+        value = int(request.GET.get(name) or default)
+    except ValueError:
+        return None
+    return min(value, maximum) if value > 0 else None
+
+
+def media_inventory(request):
+    """
+    Stream a media tier listing as NDJSON, one object per line
+
+    ?tier= lists the tier itself a page at a time: the last line holds the
+    next_token to pass back as ?token=, null once the listing is complete.
+    ?source=manifest streams the stored manifest instead, ordered by key
+    and continued with ?after=<last key>.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        return JsonResponse({'message': 'Staff only'}, status=403)
+
+    tier = request.GET.get('tier')
+    limit = positive_int(request, 'limit', 1000, 5000)
+    if limit is None:
+        return JsonResponse({'message': 'limit must be a positive integer'}, status=400)
+
+    if request.GET.get('source') == 'manifest':
+        rows = MediaManifest.objects.order_by('key')
+        if tier:
+            rows = rows.filter(tier=tier)
+        if request.GET.get('after'):
+            rows = rows.filter(key__gt=request.GET['after'])
+        rows = rows.values('tier', 'key', 'size', 'modified')[:limit]
+
+        def lines():
+            for row in rows.iterator(chunk_size=1000):
+                yield json.dumps(manifest_entry(row, row['tier'])) + '\n'
+
+        return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+    if not tier:
+        return JsonResponse({'message': 'tier is required'}, status=400)
+    pages = positive_int(request, 'pages', 1, 20)
+    if pages is None:
+        return JsonResponse({'message': 'pages must be a positive integer'}, status=400)
+
+    def lines():
+        token = request.GET.get('token') or None
+        for _ in range(pages):
+            try:
+                entries, token = inventory.walk(tier, token, limit)
+            except inventory.InventoryError as e:
+                yield json.dumps({'error': str(e)}) + '\n'
+                return
+            for entry in entries:
+                yield json.dumps(manifest_entry(entry, tier)) + '\n'
+            if token is None:
+                break
+        yield json.dumps({'next_token': token}) + '\n'
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+def prometheus_metrics(request):
+    """
+    Request metrics of all workers in the Prometheus text format, for
+    scrapers holding METRICS_TOKEN and staff, and anyone in DEBUG without a
+    token set
+    """
+    token = settings.METRICS_TOKEN
+    scraper = token and hmac.compare_digest(
+        request.headers.get('Authorization', '').encode(), f"Bearer {token}".encode()
+    )
+    if not (scraper or request.user.is_staff or (settings.DEBUG and not token)):
+        return HttpResponse(status=401)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 def test_image(request, format):
     """
     Generate a test image in the requested format.
@@ -892,3 +646,82 @@ def debug_cloudinary(request):
             result['test_results'][-1]['status'] = f"Failed: {str(e)}"
     
     return JsonResponse(result)
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def create_upload_session(request):
+    """
+    Start a direct-to-storage image upload
+
+    Body: target (product, gallery, vendor or profile), object_id, filename,
+    content_type and size. The response says where to send the file, then
+    POST to the complete URL to attach it. Only the owner of the target
+    object, or staff, may upload
+    """
+    data = request.data
+    try:
+        session = uploads.create_session(
+            data.get('target'),
+            data.get('object_id'),
+            data.get('filename'),
+            data.get('content_type'),
+            data.get('size'),
+            user=request.user,
+        )
+        upload = uploads.presign(
+            session,
+            request.build_absolute_uri(
+                reverse('upload_session_file', args=[session.id])
+            ),
+        )
+    except uploads.UploadError as e:
+        return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'id': session.id,
+        'key': session.key,
+        'expires': session.expires,
+        'upload': upload,
+        'complete': request.build_absolute_uri(
+            reverse('complete_upload_session', args=[session.id])
+        ),
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['POST'])
+def upload_session_file(request, upload_id):
+    """
+    Receives the file of an upload session when media is stored locally
+    """
+    try:
+        uploads.receive_local_upload(
+            upload_id, request.data.get('signature'), request.FILES.get('file')
+        )
+    except uploads.UploadError as e:
+        return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(['POST'])
+@authentication_classes([JWTAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def complete_upload_session(request, upload_id):
+    """
+    Attach an uploaded file to its product, gallery, vendor or profile
+    """
+    try:
+        session, instance = uploads.complete_session(upload_id, request.user)
+    except uploads.UploadError as e:
+        return Response({'message': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'id': session.id,
+        'target': session.target,
+        'object_id': session.object_id,
+        'instance_id': instance.pk,
+        'key': session.key,
+        'url': instance.image.url,
+    })
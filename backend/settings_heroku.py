@@ -3,7 +3,7 @@ import dj_database_url
 from .settings_prod import *
 
 # Heroku database configuration
-DATABASES['default'] = dj_database_url.config(conn_max_age=600, ssl_require=True)
+DATABASES['default'] = connection_lifecycle(dj_database_url.config(ssl_require=True))
 
 # Allow Heroku host
 ALLOWED_HOSTS = ['.herokuapp.com', 'koshimart.com', 'www.koshimart.com']
@@ -18,14 +18,15 @@ SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 # Database settings - use PostgreSQL for production
 DATABASES = {
-    'default': {
+    'default': connection_lifecycle({
         'ENGINE': 'django.db.backends.postgresql',
         'NAME': env('DB_NAME'),
         'USER': env('DB_USER'),
         'PASSWORD': env('DB_PASSWORD'),
         'HOST': env('DB_HOST'),
         'PORT': env('DB_PORT', '5432'),
-    }
+    }),
+    **REPLICA_DATABASES,
 }
 
 # Cors settings
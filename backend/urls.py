@@ -25,7 +25,10 @@ from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
 from store.views import CartDeleteAPIView
-from api.views import proxy_s3_media, debug_image_paths, api_root, debug_cloudinary, test_image, media_proxy
+from api.views import proxy_s3_media, debug_image_paths, api_root, debug_cloudinary, test_image, media_proxy, prometheus_metrics
+
+if settings.ASYNC_VIEWS:
+    from api.async_views import proxy_s3_media, media_proxy
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -46,6 +49,8 @@ urlpatterns = [
     
     path('admin/', admin.site.urls),
     
+    path('metrics', prometheus_metrics, name='metrics'),
+    
     path('api/', include('api.urls')),
     
     # Direct media proxy endpoints
@@ -64,9 +69,8 @@ urlpatterns = [
     
 ]
 
-# Debug-only settings
+# Debug-only settings, media is always served by media_proxy
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
 urlpatterns += [
@@ -11,6 +11,7 @@ from rest_framework.response import Response
 from userauths.models import User
 
 from store.models import Category, Product, Gallery, Specification, Size, Color, Cart, CartOrder, CartOrderItem, ProductFaq, Review, Wishlist, Notification, Coupon, Tax
+from store.eager import eager, order_items
 from store.serializers import ProductSerializer, CategorySerializer, CartSerializer, CartOrderSerializer, CartOrderItemSerializer, CouponSerializer, NotificationSerializer, ReviewSerializer, WishlistSerializer
 
 # Create your views here.
@@ -39,11 +40,13 @@ class OrdersAPIView(generics.ListAPIView):
     
     # Show all orders regardless of payment status
     orders = CartOrder.objects.filter(buyer=user)
-    return orders
+    return eager(orders, prefetch=[order_items()])
   
 class OrderDetailAPIView(generics.RetrieveAPIView):
   serializer_class = CartOrderSerializer
   permission_classes = [AllowAny,]
+  # Assigns guest orders to the signed in buyer
+  use_primary = True
   
   def get_object(self):
     user_id = self.kwargs['user_id']
@@ -67,7 +70,7 @@ class OrderDetailAPIView(generics.RetrieveAPIView):
     
     try:
       # First try to get order associated with this user
-      order = CartOrder.objects.get(buyer=user, oid=order_oid)
+      order = eager(CartOrder.objects.all(), prefetch=[order_items()]).get(buyer=user, oid=order_oid)
       return order
     except CartOrder.DoesNotExist:
       try:
@@ -105,7 +108,7 @@ class WishlistAPIVIew(generics.ListCreateAPIView):
         return Wishlist.objects.none()
     
     wishlists = Wishlist.objects.filter(user=user)
-    return wishlists
+    return eager(wishlists)
   
   def create(self, request, *args, **kwargs):
     payload = request.data
@@ -155,11 +158,12 @@ class CustomerNotification(generics.ListAPIView):
         # Return empty queryset if user doesn't exist or ID is invalid
         return Notification.objects.none()
     
-    return Notification.objects.filter(user=user, seen=False)
+    return eager(Notification.objects.filter(user=user, seen=False))
   
 class MarkCustomerNotificationAsSeen(generics.RetrieveAPIView):
   serializer_class = NotificationSerializer
   permission_classes = [AllowAny,]
+  use_primary = True
   
   def get_object(self):
     user_id = self.kwargs['user_id']
@@ -182,7 +186,7 @@ class MarkCustomerNotificationAsSeen(generics.RetrieveAPIView):
         raise Http404("User not found")
     
     try:
-      noti = Notification.objects.get(id=noti_id, user=user)
+      noti = eager(Notification.objects.all()).get(id=noti_id, user=user)
       
       if noti.seen != True:
         noti.seen = True
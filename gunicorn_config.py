@@ -1,14 +1,21 @@
+import glob
 import multiprocessing
+import os
 
 # Bind to this socket
 bind = "127.0.0.1:8001"
 
 # Number of workers
-workers = multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
 
-# Worker class
-worker_class = "gthread"
-threads = 2
+# Worker class, each thread holds its own database connection so the
+# database has to accept workers x threads of them (DB_POOL_MAX_SIZE
+# defaults to GUNICORN_THREADS).
+# ASGI mode serves the async views (ASYNC_VIEWS=True) on an event loop:
+#   GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \
+#   gunicorn backend.asgi:application -c gunicorn_config.py
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 2))
 
 # Logging
 errorlog = "logs/gunicorn-error.log"
@@ -27,4 +34,21 @@ proc_name = "koshimart_gunicorn"
 # Security
 limit_request_line = 4094
 limit_request_fields = 100
-limit_request_field_size = 8190 
\ No newline at end of file
+limit_request_field_size = 8190 
+
+
+def on_starting(server):
+    # Request metrics snapshots of the previous run, see api.metrics
+    metrics_dir = os.environ.get("METRICS_DIR")
+    if metrics_dir:
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            os.remove(path)
+
+
+def when_ready(server):
+    server.log.info(
+        "Up to %d database connections per database: %d workers x %d threads",
+        workers * threads,
+        workers,
+        threads,
+    )
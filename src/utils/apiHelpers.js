@@ -1,24 +1,36 @@
 import apiInstance from "./axios";
 
 /**
- * Safely fetches reviews for a product, handles undefined IDs gracefully
+ * Fetches one page of a product's reviews, handles undefined IDs gracefully
  * @param {number|string|undefined} productId - The product ID
- * @returns {Promise<Array>} - Array of reviews or empty array
+ * @param {string|null} cursor - The `next` URL of the previous page, null for the first page
+ * @returns {Promise<Object>} - { results, next, previous, rating_avg, rating_count, rating_histogram }
  */
-export const safelyFetchReviews = async (productId) => {
+export const fetchReviewPage = async (productId, cursor = null) => {
+  const empty = { results: [], next: null, previous: null };
   if (!productId || productId === "undefined") {
     console.warn("Invalid product ID:", productId);
-    return [];
+    return empty;
   }
   try {
-    const response = await apiInstance.get(`reviews/${productId}/`);
-    return response.data || [];
+    const response = await apiInstance.get(cursor || `reviews/${productId}/`);
+    return { ...empty, ...response.data };
   } catch (error) {
     console.error("Error fetching reviews:", error);
-    return [];
+    return empty;
   }
 };
 
+/**
+ * Safely fetches the newest page of reviews for a product
+ * @param {number|string|undefined} productId - The product ID
+ * @returns {Promise<Array>} - Array of reviews or empty array
+ */
+export const safelyFetchReviews = async (productId) => {
+  const page = await fetchReviewPage(productId);
+  return page.results;
+};
+
 /**
  * Safely submits a product review, handles undefined IDs gracefully
  * @param {number|string|undefined} productId - The product ID
@@ -17,6 +17,8 @@ from store.models import (
     Coupon,
     Tax,
     SiteSettings,
+    VendorDailySales,
+    ProductDailyViews,
 )
 
 # Register your models here.
@@ -88,6 +90,18 @@ class CartOrderAdmin(admin.ModelAdmin):
     search_fields = ["oid"]
 
 
+class VendorDailySalesAdmin(admin.ModelAdmin):
+    list_display = ["vendor", "date", "orders", "units", "revenue", "shipping"]
+    list_filter = ["date"]
+    search_fields = ["vendor__name"]
+
+
+class ProductDailyViewsAdmin(admin.ModelAdmin):
+    list_display = ["product", "date", "views"]
+    list_filter = ["date"]
+    search_fields = ["product__title"]
+
+
 class SiteSettingsAdmin(admin.ModelAdmin):
     """
     Admin interface for SiteSettings model.
@@ -116,3 +130,5 @@ admin.site.register(Notification)
 admin.site.register(Coupon)
 admin.site.register(Tax)
 admin.site.register(SiteSettings, SiteSettingsAdmin)
+admin.site.register(VendorDailySales, VendorDailySalesAdmin)
+admin.site.register(ProductDailyViews, ProductDailyViewsAdmin)
@@ -0,0 +1,187 @@
+import json
+import logging
+import traceback
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from api import async_http
+from store.models import CartOrder, CartOrderItem
+from store.views import PaymentSuccessView
+
+logger = logging.getLogger(__name__)
+
+# Async variant of PaymentSuccessView, routed instead of it with
+# ASYNC_VIEWS: PayPal and Stripe are asked for the payment status over the
+# pooled async client, the order is then processed by the sync view's code
+
+PAYPAL_TOKEN_URL = "https://api.sandbox.paypal.com/v1/oauth2/token"
+PAYPAL_ORDER_URL = "https://api-m.sandbox.paypal.com/v2/checkout/orders/{}"
+PAYPAL_TOKEN_CACHE_KEY = "paypal-access-token"
+STRIPE_SESSION_URL = "https://api.stripe.com/v1/checkout/sessions/{}"
+
+
+class PaymentVerificationError(Exception):
+    pass
+
+
+async def paypal_access_token():
+    """
+    A PayPal access token, cached until shortly before it expires instead
+    of requested for every payment
+    """
+    token = await cache.aget(PAYPAL_TOKEN_CACHE_KEY)
+    if token:
+        return token
+
+    response = await async_http.request(
+        "POST",
+        PAYPAL_TOKEN_URL,
+        data={"grant_type": "client_credentials"},
+        auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET_ID),
+    )
+    if response.status_code != 200:
+        raise PaymentVerificationError(
+            f"Failed to get access token: {response.status_code} - {response.text}"
+        )
+    body = response.json()
+    token = body["access_token"]
+    await cache.aset(PAYPAL_TOKEN_CACHE_KEY, token, max(body.get("expires_in", 0) - 60, 0))
+    return token
+
+
+async def paypal_order_status(paypal_order_id):
+    """
+    Status of a PayPal order, None when it could not be checked
+    """
+    try:
+        token = await paypal_access_token()
+        response = await async_http.request(
+            "GET",
+            PAYPAL_ORDER_URL.format(paypal_order_id),
+            headers={"Authorization": f"Bearer {token}"},
+        )
+    except Exception as e:
+        logger.warning(f"PayPal verification error: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+    return response.json().get("status")
+
+
+async def stripe_payment_status(session_id):
+    """
+    payment_status of a Stripe checkout session
+    """
+    response = await async_http.request(
+        "GET", STRIPE_SESSION_URL.format(session_id), auth=(settings.STRIPE_SECRET_KEY, "")
+    )
+    if response.status_code != 200:
+        try:
+            message = response.json()["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = response.text
+        raise PaymentVerificationError(message)
+    return response.json().get("payment_status")
+
+
+@csrf_exempt
+@require_POST
+async def payment_success(request, order_oid):
+    """
+    PaymentSuccessView for async deployments
+    """
+    try:
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"message": "Invalid JSON", "status": "error"}, status=400)
+
+    order_oid = payload.get("order_oid")
+    session_id = payload.get("session_id")
+    paypal_order_id = payload.get("paypal_order_id")
+
+    if not order_oid:
+        return JsonResponse({"message": "Order ID is required"}, status=400)
+
+    try:
+        order = await CartOrder.objects.aget(oid=order_oid)
+    except CartOrder.DoesNotExist:
+        return JsonResponse({"message": "Order not found"}, status=404)
+    order_items = CartOrderItem.objects.filter(order=order)
+
+    async def process(transaction_id=None):
+        view = PaymentSuccessView()
+        response = await sync_to_async(view._process_successful_payment)(
+            order, order_items, transaction_id=transaction_id
+        )
+        return JsonResponse(response.data, status=response.status_code)
+
+    try:
+        # Cash on Delivery payment
+        if order.payment_method == "Cash On Delivery":
+            return await process()
+
+        # PayPal Payment
+        if paypal_order_id and paypal_order_id != "null":
+            paypal_status = await paypal_order_status(paypal_order_id)
+
+            if paypal_status == "COMPLETED":
+                return await process(transaction_id=paypal_order_id)
+            elif paypal_status:
+                return JsonResponse(
+                    {
+                        "message": "Payment pending. Please complete your payment",
+                        "status": "warning",
+                    }
+                )
+
+        # Stripe Payment
+        if session_id and session_id != "null":
+            try:
+                payment_status = await stripe_payment_status(session_id)
+            except PaymentVerificationError as e:
+                return JsonResponse(
+                    {
+                        "message": "Payment verification failed. Please try again or contact support",
+                        "error": str(e),
+                        "status": "error",
+                    },
+                    status=400,
+                )
+
+            if payment_status == "paid":
+                return await process()
+            elif payment_status == "unpaid":
+                return JsonResponse(
+                    {
+                        "message": "Payment pending. Please complete your payment",
+                        "status": "warning",
+                    }
+                )
+            elif payment_status == "cancelled":
+                return JsonResponse(
+                    {
+                        "message": "Payment cancelled. Please try again or contact support",
+                        "status": "error",
+                    }
+                )
+
+        return JsonResponse(
+            {"message": "Invalid payment information provided", "status": "error"},
+            status=400,
+        )
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {traceback.format_exc()}")
+        return JsonResponse(
+            {
+                "message": "An unexpected error occurred",
+                "error": str(e),
+                "status": "error",
+            },
+            status=500,
+        )
@@ -0,0 +1,62 @@
+from functools import lru_cache
+
+from django.db.models import Prefetch
+
+from store.models import CartOrderItem
+
+
+@lru_cache(maxsize=None)
+def depth_related(model, depth):
+    """
+    (select_related, prefetch_related) paths covering what a ModelSerializer
+    with Meta.depth = depth reads from an instance of model
+
+    Forward relations are nested while depth lasts, below that only many to
+    many fields still query, for their primary keys.
+    """
+    select, prefetch = [], []
+
+    def walk(model, depth, prefix, prefetched):
+        for field in model._meta.get_fields():
+            if not field.is_relation or field.auto_created or not field.concrete:
+                continue
+            path = prefix + field.name
+            if field.many_to_many:
+                prefetch.append(path)
+            elif not depth:
+                continue
+            elif prefetched:
+                prefetch.append(path)
+            else:
+                select.append(path)
+            if depth:
+                walk(field.related_model, depth - 1, path + "__", prefetched or field.many_to_many)
+
+    walk(model, depth, "", False)
+    return tuple(select), tuple(prefetch)
+
+
+def eager(queryset, depth=3, prefetch=()):
+    """
+    queryset loading everything its depth serializer reads in a fixed number
+    of queries, plus the extra prefetch lookups
+    """
+    select, many = depth_related(queryset.model, depth)
+    return queryset.select_related(*select).prefetch_related(*many, *prefetch)
+
+
+def product_details(prefix=""):
+    """
+    Prefetches of the reverse relations ProductSerializer lists
+    """
+    return [
+        f"{prefix}{name}_set" for name in ("gallery", "color", "specification", "size")
+    ]
+
+
+def order_items():
+    """
+    Prefetch of the items CartOrderSerializer lists, as the nested serializer
+    reads them
+    """
+    return Prefetch("cartorderitem_set", queryset=eager(CartOrderItem.objects.order_by("id")))
@@ -0,0 +1,136 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from store import synthetic
+from store.models import Product, VendorDailySales
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the database with generated vendors, products, orders, reviews, "
+        "carts and notifications for load testing"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--vendors", type=int, default=50)
+        parser.add_argument("--buyers", type=int, default=1000)
+        parser.add_argument("--products", type=int, default=5000)
+        parser.add_argument(
+            "--orders",
+            type=int,
+            default=10000,
+            help="Orders to create, with 1.9 items each on average",
+        )
+        parser.add_argument("--reviews", type=int, default=20000)
+        parser.add_argument("--carts", type=int, default=2000)
+        parser.add_argument("--categories", type=int, default=12)
+        parser.add_argument(
+            "--days", type=int, default=365, help="Spread the history over this many days"
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Processes writing orders, reviews and carts, on SQLite they take turns",
+        )
+        parser.add_argument("--seed", type=int, help="Generate the same data again")
+        parser.add_argument(
+            "--password", default="password", help="Password of every generated user"
+        )
+
+    def handle(self, *args, **options):
+        workers = options["workers"]
+        if workers > 1 and connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.stderr.write("Processes cannot share an in-memory database, using one worker")
+            workers = 1
+
+        generator = synthetic.Generator(
+            seed=options["seed"],
+            days=options["days"],
+            batch_size=options["batch_size"],
+            password=options["password"],
+        )
+        self.stdout.write(f"Run {generator.run}, seed {generator.seed}")
+
+        started = time.monotonic()
+        count = generator.categories(options["categories"])
+        self.report(f"Created {count} categories", started)
+
+        started = time.monotonic()
+        vendors = generator.vendors(options["vendors"])
+        self.report(f"Created {len(vendors)} vendors", started)
+        if not vendors:
+            raise CommandError("Products need at least one vendor")
+
+        started = time.monotonic()
+        count = generator.buyers(options["buyers"])
+        self.report(f"Created {count} buyers", started)
+
+        started = time.monotonic()
+        created = 0
+        for count in generator.products(options["products"], vendors):
+            created += count
+            self.progress("products", created, options["products"])
+        self.report(f"Created {created} products", started)
+
+        catalog = generator.catalog()
+        if catalog is None:
+            raise CommandError("Orders need published products and buyers")
+
+        size = options["batch_size"] * 5
+        tasks = (
+            generator.chunks("orders", options["orders"], size)
+            + generator.chunks("reviews", options["reviews"], size)
+            + generator.chunks("carts", options["carts"], size)
+        )
+        totals = {kind: options[kind] for kind in ("orders", "reviews", "carts")}
+        done = dict.fromkeys(totals, 0)
+        rows = dict.fromkeys(totals, 0)
+        started = time.monotonic()
+
+        if workers > 1:
+            # Children open their own connections, none may be inherited, and
+            # are forked to start with the configured Django of this process
+            connections.close_all()
+            with multiprocessing.get_context("fork").Pool(
+                workers, initializer=synthetic.init_worker, initargs=(catalog,)
+            ) as pool:
+                for (kind, count), task in zip(
+                    pool.imap(synthetic.run_chunk, tasks), tasks
+                ):
+                    done[kind] += task[2]
+                    rows[kind] += count
+                    self.progress(kind, done[kind], totals[kind])
+        else:
+            synthetic.init_worker(catalog)
+            for task in tasks:
+                kind, count = synthetic.run_chunk(task)
+                done[kind] += task[2]
+                rows[kind] += count
+                self.progress(kind, done[kind], totals[kind])
+
+        self.report(
+            f"Created {done['orders']} orders with {rows['orders']} items, "
+            f"{rows['reviews']} reviews and {rows['carts']} cart items",
+            started,
+        )
+
+        # bulk_create skips the signals keeping these up to date
+        started = time.monotonic()
+        Product.reconcile_ratings()
+        Product.reconcile_sales()
+        VendorDailySales.rebuild()
+        self.report("Rebuilt the product and vendor rollups", started)
+
+    def progress(self, kind, done, total):
+        self.stderr.write(f"\r{kind}: {done}/{total}", ending="")
+        if done >= total:
+            self.stderr.write("")
+
+    def report(self, message, started):
+        seconds = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f"{message} in {seconds:.1f}s"))
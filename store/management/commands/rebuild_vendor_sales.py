@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.models import VendorDailySales
+from vendor.models import Vendor
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-vendor daily sales rollups from paid order items"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--vendor",
+            type=int,
+            help="Only rebuild the rollups of this vendor id",
+        )
+
+    def handle(self, *args, **options):
+        vendor = None
+        if options["vendor"] is not None:
+            try:
+                vendor = Vendor.objects.get(id=options["vendor"])
+            except Vendor.DoesNotExist:
+                raise CommandError(f"Vendor {options['vendor']} does not exist")
+
+        count = VendorDailySales.rebuild(vendor=vendor)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rebuilt {count} vendor daily sales rows")
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized product rating aggregates from active reviews"
+
+    def handle(self, *args, **options):
+        count = Product.reconcile_ratings()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Corrected the rating aggregates of {count} products")
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from store.models import Product
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized product sales counters from paid orders"
+
+    def handle(self, *args, **options):
+        count = Product.reconcile_sales()
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Corrected the sales counters of {count} products")
+        )
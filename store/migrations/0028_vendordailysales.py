@@ -0,0 +1,66 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def backfill_vendor_daily_sales(apps, schema_editor):
+    CartOrderItem = apps.get_model('store', 'CartOrderItem')
+    VendorDailySales = apps.get_model('store', 'VendorDailySales')
+
+    daily_totals = (
+        CartOrderItem.objects.filter(order__payment_status='paid')
+        .annotate(day=TruncDate('order__date'))
+        .values('vendor', 'day')
+        .annotate(
+            orders=models.Count('order', distinct=True),
+            units=models.Sum('qty'),
+            revenue=models.Sum('sub_total'),
+            shipping=models.Sum('shipping_amount'),
+        )
+        .order_by()
+    )
+    VendorDailySales.objects.bulk_create(
+        [
+            VendorDailySales(
+                vendor_id=row['vendor'],
+                date=row['day'],
+                orders=row['orders'],
+                units=row['units'] or 0,
+                revenue=row['revenue'] or 0,
+                shipping=row['shipping'] or 0,
+            )
+            for row in daily_totals
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0027_sitesettings'),
+        ('vendor', '0002_alter_vendor_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('orders', models.PositiveIntegerField(default=0)),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('shipping', models.DecimalField(decimal_places=2, default=0.0, max_digits=14)),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='vendor.vendor')),
+            ],
+            options={
+                'verbose_name_plural': 'Vendor Daily Sales',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('vendor', 'date'), name='unique_vendor_daily_sales')],
+            },
+        ),
+        migrations.RunPython(backfill_vendor_daily_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0028_vendordailysales'),
+        ('vendor', '0002_alter_vendor_image'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartorderitem',
+            index=models.Index(fields=['vendor', 'date'], name='orderitem_vendor_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['vendor', 'date'], name='product_vendor_date_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0029_vendor_date_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailyViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='store.product')),
+            ],
+            options={
+                'verbose_name_plural': 'Product Daily Views',
+                'indexes': [models.Index(fields=['date'], name='product_daily_views_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'date'), name='unique_product_daily_views')],
+            },
+        ),
+    ]
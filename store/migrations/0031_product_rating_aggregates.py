@@ -0,0 +1,81 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:49
+
+from django.db import migrations, models
+
+
+def backfill_product_ratings(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    Review = apps.get_model('store', 'Review')
+
+    stars = {
+        f'rating_{star}': models.Count('id', filter=models.Q(rating=star))
+        for star in range(1, 6)
+    }
+    rows = (
+        Review.objects.filter(active=True, product__isnull=False)
+        .values('product')
+        .annotate(rating_count=models.Count('id'), **stars)
+        .order_by()
+    )
+    products = []
+    for row in rows:
+        total = sum(row[f'rating_{star}'] * star for star in range(1, 6))
+        products.append(
+            Product(
+                id=row['product'],
+                rating_avg=total / row['rating_count'],
+                rating_count=row['rating_count'],
+                **{f'rating_{star}': row[f'rating_{star}'] for star in range(1, 6)},
+            )
+        )
+    Product.objects.bulk_update(
+        products,
+        ['rating_avg', 'rating_count', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0030_productdailyviews'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_avg',
+            field=models.FloatField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_product_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.5 on 2026-10-19 16:50
+
+from django.db import migrations, models
+
+
+def backfill_product_sales(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    CartOrderItem = apps.get_model('store', 'CartOrderItem')
+
+    rows = (
+        CartOrderItem.objects.filter(order__payment_status='paid', product__isnull=False)
+        .values('product')
+        .annotate(
+            units_sold=models.Sum('qty'),
+            paid_orders=models.Count('order', distinct=True),
+        )
+        .order_by()
+    )
+    Product.objects.bulk_update(
+        [
+            Product(
+                id=row['product'],
+                units_sold=row['units_sold'] or 0,
+                paid_orders=row['paid_orders'],
+            )
+            for row in rows
+        ],
+        ['units_sold', 'paid_orders'],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0031_product_rating_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='paid_orders',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_product_sales, migrations.RunPython.noop),
+    ]
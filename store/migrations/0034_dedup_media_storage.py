@@ -0,0 +1,24 @@
+# Generated by Django 5.1.5 on 2026-10-19 17:00
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0033_image_processing'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='gallery',
+            name='image',
+            field=models.FileField(blank=True, default='product.jpg', null=True, storage=api.storage.get_dedup_storage, upload_to='products'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.FileField(blank=True, default='product.jpg', null=True, storage=api.storage.get_dedup_storage, upload_to='products'),
+        ),
+    ]
@@ -1,13 +1,24 @@
-from django.db import models
+import logging
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models.functions import Cast, Greatest, TruncDate
+from django.utils import timezone
 from django.utils.text import slugify
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
 
+from shortuuid import ShortUUID
 from shortuuid.django_fields import ShortUUIDField
 
+from api.imaging import ProcessedImageModel, image_saved
+from api.storage import count_media, get_dedup_storage, release_media, remember_media
+
 from vendor.models import Vendor
 from userauths.models import User, Profile
 
+logger = logging.getLogger(__name__)
+
 # Create your models here.
 
 # def send_notification(user=None, vendor=None, order=None, order_item=None):
@@ -29,7 +40,7 @@ class Category(models.Model):
         ordering = ["-title"]
 
 
-class Product(models.Model):
+class Product(ProcessedImageModel):
     STATUS = (
         ("draft", "Draft"),
         ("disabled", "Disabled"),
@@ -39,7 +50,11 @@ class Product(models.Model):
 
     title = models.CharField(max_length=100)
     image = models.FileField(
-        upload_to="products", default="product.jpg", null=True, blank=True
+        upload_to="products",
+        default="product.jpg",
+        null=True,
+        blank=True,
+        storage=get_dedup_storage,
     )
     description = models.TextField(null=True, blank=True)
     category = models.ForeignKey(
@@ -56,37 +71,174 @@ class Product(models.Model):
     featured = models.BooleanField(default=False)
     views = models.PositiveIntegerField(default=0, null=True, blank=True)
     rating = models.PositiveIntegerField(default=0, null=True, blank=True)
+    # Aggregates of the active reviews, kept up to date by the Review signals
+    rating_avg = models.FloatField(default=0, db_index=True)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    # Totals over paid orders, kept up to date when an order's payment status changes
+    units_sold = models.PositiveIntegerField(default=0, db_index=True)
+    paid_orders = models.PositiveIntegerField(default=0)
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
     pid = ShortUUIDField(unique=True, length=10, alphabet="abcdefghi12345")
     slug = models.SlugField(null=True, blank=True)
     date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["vendor", "date"], name="product_vendor_date_idx"),
+        ]
+
     def __str__(self):
         return self.title
 
     def product_rating(self):
-        product_rating = Review.objects.filter(product=self).aggregate(
-            avg_rating=models.Avg("rating")
+        return self.rating_avg if self.rating_count else None
+
+    def rating_histogram(self):
+        return {star: getattr(self, f"rating_{star}") for star in range(1, 6)}
+
+    @classmethod
+    def add_rating(cls, product_id, rating, sign=1):
+        """
+        Add (or with sign=-1 remove) one review rating in a single UPDATE,
+        ratings outside Review.RATING are logged and left out. Removals stop
+        at zero like the sales counters
+        """
+        try:
+            rating = int(rating)
+        except (TypeError, ValueError):
+            rating = None
+        if rating not in dict(Review.RATING):
+            logger.warning(f"Rating {rating!r} of product {product_id} is not counted")
+            return
+        star = f"rating_{rating}"
+        star_count = Greatest(models.F(star) + sign, 0)
+        count = Greatest(models.F("rating_count") + sign, 0)
+        total = models.Value(0.0, output_field=models.FloatField())
+        for other in range(1, 6):
+            column = star_count if other == rating else models.F(f"rating_{other}")
+            total += Cast(column, models.FloatField()) * other
+
+        # Every right hand side reads the row as it was before the UPDATE
+        cls.objects.filter(pk=product_id).update(
+            **{star: star_count},
+            rating_count=count,
+            rating_avg=models.Case(
+                models.When(rating_count__lte=-sign, then=models.Value(0.0)),
+                default=total / Cast(count, models.FloatField()),
+                output_field=models.FloatField(),
+            ),
+        )
+
+    @classmethod
+    def reconcile_ratings(cls):
+        """
+        Recompute the rating aggregates of every product from the active
+        reviews, returns the number of products that were corrected
+        """
+        fields = ["rating_avg", "rating_count"] + [
+            f"rating_{star}" for star in range(1, 6)
+        ]
+        stars = {
+            f"rating_{star}": models.Count("id", filter=models.Q(rating=star))
+            for star in range(1, 6)
+        }
+        totals = {
+            row["product"]: row
+            for row in Review.objects.filter(active=True, product__isnull=False)
+            .values("product")
+            .annotate(rating_count=models.Count("id"), **stars)
+            .order_by()
+        }
+
+        changed = []
+        for product in cls.objects.only(*fields).iterator(chunk_size=2000):
+            row = totals.get(product.id, {})
+            values = {field: row.get(field, 0) for field in fields[1:]}
+            total = sum(values[f"rating_{star}"] * star for star in range(1, 6))
+            values["rating_avg"] = (
+                total / values["rating_count"] if values["rating_count"] else 0
+            )
+            if any(getattr(product, field) != value for field, value in values.items()):
+                for field, value in values.items():
+                    setattr(product, field, value)
+                changed.append(product)
+
+        cls.objects.bulk_update(changed, fields, batch_size=1000)
+        return len(changed)
+
+    @classmethod
+    def record_order(cls, order, sign=1):
+        """
+        Add (or with sign=-1 remove) an order's items to its products' sales,
+        removals stop at zero like the vendor rollups
+        """
+        product_totals = (
+            CartOrderItem.objects.filter(order=order, product__isnull=False)
+            .values("product")
+            .annotate(units=models.Sum("qty"))
+            .order_by()
         )
-        return product_rating["avg_rating"]
 
-    def rating_count(self):
-        return Review.objects.filter(product=self).count()
+        with transaction.atomic():
+            for row in product_totals:
+                cls.objects.filter(pk=row["product"]).update(
+                    units_sold=Greatest(models.F("units_sold") + sign * row["units"], 0),
+                    paid_orders=Greatest(models.F("paid_orders") + sign, 0),
+                )
+
+    @classmethod
+    def reconcile_sales(cls):
+        """
+        Recompute units_sold and paid_orders from the paid order items,
+        returns the number of products that were corrected
+        """
+        totals = {
+            row["product"]: row
+            for row in CartOrderItem.objects.filter(
+                order__payment_status="paid", product__isnull=False
+            )
+            .values("product")
+            .annotate(
+                units_sold=models.Sum("qty"),
+                paid_orders=models.Count("order", distinct=True),
+            )
+            .order_by()
+        }
+
+        changed = []
+        for product in cls.objects.only("units_sold", "paid_orders").iterator(
+            chunk_size=2000
+        ):
+            row = totals.get(product.id, {})
+            units_sold = row.get("units_sold") or 0
+            paid_orders = row.get("paid_orders") or 0
+            if (product.units_sold, product.paid_orders) != (units_sold, paid_orders):
+                product.units_sold = units_sold
+                product.paid_orders = paid_orders
+                changed.append(product)
+
+        cls.objects.bulk_update(changed, ["units_sold", "paid_orders"], batch_size=1000)
+        return len(changed)
 
     def gallery(self):
-        return Gallery.objects.filter(product=self)
+        return self.gallery_set.all()
 
     def color(self):
-        return Color.objects.filter(product=self)
+        return self.color_set.all()
 
     def orders(self):
-        return CartOrderItem.objects.filter(product=self).count()
+        return self.paid_orders
 
     def specification(self):
-        return Specification.objects.filter(product=self)
+        return self.specification_set.all()
 
     def size(self):
-        return Size.objects.filter(product=self)
+        return self.size_set.all()
 
     def save(self, *args, **kwargs):
         if self.slug == "" or self.slug == None:
@@ -102,10 +254,37 @@ class Product(models.Model):
         super(Product, self).save(*args, **kwargs)
 
 
-class Gallery(models.Model):
+class ProductDailyViews(models.Model):
+    """
+    Product detail views per day, written in batches by store.product_views
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    date = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Product Daily Views"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "date"], name="unique_product_daily_views"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["date"], name="product_daily_views_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} - {self.date}"
+
+
+class Gallery(ProcessedImageModel):
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     image = models.FileField(
-        upload_to="products", default="product.jpg", null=True, blank=True
+        upload_to="products",
+        default="product.jpg",
+        null=True,
+        blank=True,
+        storage=get_dedup_storage,
     )
     active = models.BooleanField(default=True)
     date = models.DateTimeField(auto_now_add=True)
@@ -172,6 +351,13 @@ class Cart(models.Model):
         return f"{self.cart_id} - {self.product.title}"
 
 
+def new_oid():
+    # oid used to be a ShortUUIDField with this alphabet and length, as a
+    # plain CharField it has to be filled in or every order after the first
+    # one clashes on the empty string
+    return ShortUUID(alphabet="abcdefghi12345").random(length=10)
+
+
 class CartOrder(models.Model):
     PAYMENT_STATUS = (
         ("paid", "Paid"),
@@ -236,8 +422,13 @@ class CartOrder(models.Model):
     def __str__(self):
         return self.oid
 
+    def save(self, *args, **kwargs):
+        if not self.oid:
+            self.oid = new_oid()
+        super(CartOrder, self).save(*args, **kwargs)
+
     def orderitem(self):
-        return CartOrderItem.objects.filter(order=self)
+        return self.cartorderitem_set.all()
 
 
 class CartOrderItem(models.Model):
@@ -265,9 +456,19 @@ class CartOrderItem(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     oid = models.CharField(max_length=20, unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["vendor", "date"], name="orderitem_vendor_date_idx"),
+        ]
+
     def __str__(self):
         return self.oid
 
+    def save(self, *args, **kwargs):
+        if not self.oid:
+            self.oid = new_oid()
+        super(CartOrderItem, self).save(*args, **kwargs)
+
 
 class ProductFaq(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
@@ -311,13 +512,43 @@ class Review(models.Model):
         verbose_name_plural = "Reviews & Rating"
 
     def profile(self):
-        return Profile.objects.get(user=self.user)
+        if self.user_id is None:
+            return None
+        # Served from select_related("user__profile") when the caller used it
+        return self.user.profile
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk)
+            .values_list("product", "rating", "active")
+            .first()
+        )
 
 
 @receiver(post_save, sender=Review)
 def update_product_rating(sender, instance, **kwargs):
-    if instance.product:
-        instance.product.save()
+    previous = getattr(instance, "_previous_rating", None)
+    current = (instance.product_id, int(instance.rating), instance.active)
+    was_counted = bool(previous and previous[0] and previous[2])
+    is_counted = bool(instance.product_id and instance.active)
+    if previous == current or not (was_counted or is_counted):
+        return
+
+    with transaction.atomic():
+        if was_counted:
+            Product.add_rating(previous[0], previous[1], sign=-1)
+        if is_counted:
+            Product.add_rating(instance.product_id, instance.rating)
+
+
+@receiver(post_delete, sender=Review)
+def remove_product_rating(sender, instance, **kwargs):
+    if instance.product_id and instance.active:
+        Product.add_rating(instance.product_id, instance.rating, sign=-1)
 
 
 class Wishlist(models.Model):
@@ -419,3 +650,143 @@ class SiteSettings(models.Model):
         """
         settings, created = cls.objects.get_or_create(pk=1)
         return settings
+
+
+class VendorDailySales(models.Model):
+    """
+    Per-vendor, per-day totals of paid orders used by the vendor dashboard
+    """
+    vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
+    date = models.DateField()
+
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(default=0.00, max_digits=14, decimal_places=2)
+    shipping = models.DecimalField(default=0.00, max_digits=14, decimal_places=2)
+
+    class Meta:
+        verbose_name_plural = "Vendor Daily Sales"
+        ordering = ["-date"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["vendor", "date"], name="unique_vendor_daily_sales"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.vendor} - {self.date}"
+
+    @classmethod
+    def record_order(cls, order, sign=1):
+        """
+        Add (or with sign=-1 remove) an order's items to the rollup of its day.
+        Removals stop at zero, the order may have been paid before the
+        rollups were built
+        """
+        day = timezone.localdate(order.date)
+        vendor_totals = (
+            CartOrderItem.objects.filter(order=order)
+            .values("vendor")
+            .annotate(
+                units=models.Sum("qty"),
+                revenue=models.Sum("sub_total"),
+                shipping=models.Sum("shipping_amount"),
+            )
+            .order_by()
+        )
+
+        with transaction.atomic():
+            for row in vendor_totals:
+                rollup, _ = cls.objects.get_or_create(
+                    vendor_id=row["vendor"], date=day
+                )
+                cls.objects.filter(pk=rollup.pk).update(
+                    orders=Greatest(models.F("orders") + sign, 0),
+                    units=Greatest(models.F("units") + sign * row["units"], 0),
+                    revenue=Greatest(
+                        models.F("revenue") + sign * row["revenue"], Decimal(0)
+                    ),
+                    shipping=Greatest(
+                        models.F("shipping") + sign * row["shipping"], Decimal(0)
+                    ),
+                )
+
+    @classmethod
+    def rebuild(cls, vendor=None):
+        """
+        Recompute the rollups from the paid order items, returns the row count
+        """
+        items = CartOrderItem.objects.filter(order__payment_status="paid")
+        rollups = cls.objects.all()
+        if vendor is not None:
+            items = items.filter(vendor=vendor)
+            rollups = rollups.filter(vendor=vendor)
+
+        daily_totals = (
+            items.annotate(day=TruncDate("order__date"))
+            .values("vendor", "day")
+            .annotate(
+                orders=models.Count("order", distinct=True),
+                units=models.Sum("qty"),
+                revenue=models.Sum("sub_total"),
+                shipping=models.Sum("shipping_amount"),
+            )
+            .order_by()
+        )
+
+        with transaction.atomic():
+            rollups.delete()
+            created = cls.objects.bulk_create(
+                [
+                    cls(
+                        vendor_id=row["vendor"],
+                        date=row["day"],
+                        orders=row["orders"],
+                        units=row["units"] or 0,
+                        revenue=row["revenue"] or 0,
+                        shipping=row["shipping"] or 0,
+                    )
+                    for row in daily_totals.iterator(chunk_size=2000)
+                ],
+                batch_size=1000,
+            )
+
+        return len(created)
+
+
+@receiver(pre_save, sender=CartOrder)
+def remember_payment_status(sender, instance, **kwargs):
+    instance._previous_payment_status = None
+    if instance.pk:
+        instance._previous_payment_status = (
+            CartOrder.objects.filter(pk=instance.pk)
+            .values_list("payment_status", flat=True)
+            .first()
+        )
+
+
+@receiver(post_save, sender=CartOrder)
+def record_order_rollups(sender, instance, **kwargs):
+    """
+    Add an order to the vendor daily sales and product sales counters when
+    it becomes paid, remove it when it stops being paid
+    """
+    previous = getattr(instance, "_previous_payment_status", None)
+
+    if previous != "paid" and instance.payment_status == "paid":
+        VendorDailySales.record_order(instance)
+        Product.record_order(instance)
+    elif previous == "paid" and instance.payment_status != "paid":
+        VendorDailySales.record_order(instance, sign=-1)
+        Product.record_order(instance, sign=-1)
+
+
+post_save.connect(image_saved, sender=Product)
+post_save.connect(image_saved, sender=Gallery)
+
+pre_save.connect(remember_media, sender=Product)
+post_save.connect(count_media, sender=Product)
+post_delete.connect(release_media, sender=Product)
+pre_save.connect(remember_media, sender=Gallery)
+post_save.connect(count_media, sender=Gallery)
+post_delete.connect(release_media, sender=Gallery)
@@ -0,0 +1,174 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models.functions import Cast, Coalesce
+from django.utils.timezone import localdate
+
+from store.eager import eager, product_details
+from store.models import Product, ProductDailyViews
+
+logger = logging.getLogger(__name__)
+
+# Products updated per UPDATE ... CASE statement
+FLUSH_BATCH_SIZE = 500
+
+
+class ProductViewBuffer:
+    """
+    Per-process buffer of product detail views
+
+    Views are counted in memory and written to Product.views and
+    ProductDailyViews in a few batched UPDATE ... CASE statements, either
+    every `flush_interval` seconds or once `max_pending` products are waiting.
+    With flush_interval=0 every view is written straight away.
+    """
+
+    def __init__(self, flush_interval=30, max_pending=1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def add(self, product_id, count=1):
+        with self._lock:
+            self._pending[product_id] += count
+            flush_now = (
+                self.flush_interval <= 0 or len(self._pending) >= self.max_pending
+            )
+            if not flush_now and self._timer is None:
+                self._start_timer()
+
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered views, returns the number of products updated
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+
+        if not pending:
+            return 0
+
+        try:
+            write_views(pending)
+        except Exception:
+            logger.exception("Failed to flush %s product view counts", len(pending))
+            with self._lock:
+                self._pending.update(pending)
+            return 0
+
+        return len(pending)
+
+    def _start_timer(self):
+        # Started lazily so each forked gunicorn worker gets its own thread
+        self._timer = threading.Thread(
+            target=self._run, name="product-view-flush", daemon=True
+        )
+        self._timer.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+            connection.close()
+
+
+def write_views(pending):
+    today = localdate()
+    items = list(pending.items())
+
+    with transaction.atomic():
+        for start in range(0, len(items), FLUSH_BATCH_SIZE):
+            batch = items[start : start + FLUSH_BATCH_SIZE]
+            product_ids = [product_id for product_id, count in batch]
+
+            Product.objects.filter(pk__in=product_ids).update(
+                views=models.Case(
+                    *[
+                        models.When(
+                            pk=product_id,
+                            then=Coalesce(models.F("views"), 0) + count,
+                        )
+                        for product_id, count in batch
+                    ],
+                    default=models.F("views"),
+                    output_field=models.PositiveIntegerField(),
+                )
+            )
+
+            existing = set(
+                Product.objects.filter(pk__in=product_ids).values_list("pk", flat=True)
+            )
+            ProductDailyViews.objects.bulk_create(
+                [
+                    ProductDailyViews(product_id=product_id, date=today)
+                    for product_id in product_ids
+                    if product_id in existing
+                ],
+                ignore_conflicts=True,
+            )
+            ProductDailyViews.objects.filter(
+                date=today, product_id__in=product_ids
+            ).update(
+                views=models.Case(
+                    *[
+                        models.When(product_id=product_id, then=models.F("views") + count)
+                        for product_id, count in batch
+                    ],
+                    default=models.F("views"),
+                    output_field=models.PositiveIntegerField(),
+                )
+            )
+
+
+def trending_products(limit=20, today=None):
+    """
+    Products ranked by daily views decayed by TRENDING_HALF_LIFE_DAYS
+    """
+    today = today or localdate()
+    half_life = settings.TRENDING_HALF_LIFE_DAYS
+    window = settings.TRENDING_WINDOW_DAYS
+
+    score = models.Case(
+        *[
+            models.When(
+                date=today - timedelta(days=age),
+                then=Cast("views", models.FloatField()) * (0.5 ** (age / half_life)),
+            )
+            for age in range(window)
+        ],
+        default=0.0,
+        output_field=models.FloatField(),
+    )
+
+    ranked = (
+        ProductDailyViews.objects.filter(
+            date__gt=today - timedelta(days=window),
+            product__status="published",
+        )
+        .values("product")
+        .annotate(score=models.Sum(score))
+        .order_by("-score", "product")[:limit]
+    )
+    scores = {row["product"]: row["score"] for row in ranked}
+
+    products = eager(Product.objects.all(), prefetch=product_details()).in_bulk(
+        list(scores)
+    )
+    return [products[product_id] for product_id in scores if product_id in products]
+
+
+product_view_buffer = ProductViewBuffer(
+    flush_interval=settings.PRODUCT_VIEW_FLUSH_INTERVAL,
+    max_pending=settings.PRODUCT_VIEW_MAX_PENDING,
+)
+atexit.register(product_view_buffer.flush)
@@ -28,6 +28,8 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class GallerySerializer(serializers.ModelSerializer):
+    image_thumbnails = serializers.ReadOnlyField()
+
     class Meta:
         model = Gallery
         fields = "__all__"
@@ -63,6 +65,10 @@ class ProductSerializer(serializers.ModelSerializer):
             "id",
             "title",
             "image",
+            "image_width",
+            "image_height",
+            "image_lqip",
+            "image_thumbnails",
             "description",
             "category",
             "price",
@@ -81,6 +87,7 @@ class ProductSerializer(serializers.ModelSerializer):
             "size",
             "product_rating",
             "rating_count",
+            "rating_histogram",
             "orders",
             "pid",
             "slug",
@@ -171,6 +178,8 @@ class ProductFaqSerializer(serializers.ModelSerializer):
 
 
 class VendorSerializer(serializers.ModelSerializer):
+    image_thumbnails = serializers.ReadOnlyField()
+
     class Meta:
         model = Vendor
         fields = "__all__"
@@ -267,3 +276,16 @@ class NotificationSummarySerializer(serializers.Serializer):
     un_read_noti = serializers.IntegerField()
     read_noti = serializers.IntegerField()
     all_noti = serializers.IntegerField()
+
+
+class VendorOverviewSerializer(serializers.Serializer):
+    vendor_id = serializers.IntegerField(source="id")
+    products = serializers.IntegerField()
+    orders = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    monthly_revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+    un_read_noti = serializers.IntegerField()
+    read_noti = serializers.IntegerField()
+    all_noti = serializers.IntegerField()
+    total_coupons = serializers.IntegerField()
+    active_coupons = serializers.IntegerField()
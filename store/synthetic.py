@@ -0,0 +1,500 @@
+import itertools
+import math
+import random
+import string
+from array import array
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from store.models import (
+    Cart,
+    CartOrder,
+    CartOrderItem,
+    Category,
+    Color,
+    Coupon,
+    Gallery,
+    Notification,
+    Product,
+    Review,
+    Size,
+    Specification,
+)
+from userauths.models import Profile, User
+from vendor.models import Vendor
+
+# Popularity exponents: a few vendors, products and buyers take most of the
+# catalog and the orders, as in a real marketplace
+VENDOR_SKEW = 1.1
+PRODUCT_SKEW = 1.0
+BUYER_SKEW = 0.7
+
+ITEMS_PER_ORDER = {1: 50, 2: 25, 3: 13, 4: 7, 5: 5}
+QUANTITIES = {1: 80, 2: 15, 3: 5}
+RATINGS = {1: 5, 2: 7, 3: 13, 4: 30, 5: 45}
+PAYMENT_STATUSES = {"paid": 80, "pending": 12, "processing": 3, "cancelled": 5}
+PAYMENT_METHODS = {"stripe": 60, "cod": 30, "paypal": 10}
+STATUSES = {"published": 90, "draft": 5, "in_review": 3, "disabled": 2}
+
+COUNTRIES = ["Nepal", "India", "United States", "United Kingdom", "Germany", "Japan"]
+COLORS = [("Black", "#000000"), ("White", "#ffffff"), ("Red", "#d32f2f"), ("Blue", "#1976d2")]
+SIZES = ["XS", "S", "M", "L", "XL"]
+SPECIFICATIONS = ["Material", "Weight", "Warranty", "Origin", "Model"]
+WORDS = (
+    "classic durable lightweight premium compact everyday organic handmade "
+    "wireless portable vintage modern soft waterproof"
+).split()
+NOUNS = "shirt lamp backpack mug speaker jacket watch bottle chair headphones".split()
+REVIEWS = [
+    "Exactly as described.",
+    "Good value for the price.",
+    "Arrived late but works well.",
+    "Would buy again.",
+    "Not what I expected.",
+]
+
+# Product.pid and Profile.pid are random ShortUUIDs, which collide at a
+# million rows, so generated rows get sequential ones from a random start
+PRODUCT_PID = ("abcdefghi12345", 10)
+PROFILE_PID = ("abcdefghijklmn", 10)
+
+
+def encode(number, alphabet, length):
+    digits = []
+    for _ in range(length):
+        number, digit = divmod(number, len(alphabet))
+        digits.append(alphabet[digit])
+    return "".join(reversed(digits))
+
+
+def pid_start(rng, alphabet, length, count):
+    return rng.randrange(len(alphabet) ** length - count)
+
+
+def skewed_weights(count, exponent):
+    """
+    Cumulative Zipf weights for random.choices, rank 1 first
+    """
+    return list(itertools.accumulate(1 / rank**exponent for rank in range(1, count + 1)))
+
+
+def pick(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def past(rng, now, days):
+    # More recent days get more rows, like a growing shop
+    age = days * (1 - math.sqrt(rng.random()))
+    return now - timedelta(days=age)
+
+
+@contextmanager
+def historical_dates(*models):
+    """
+    Let bulk_create keep the generated dates of auto_now_add fields
+    """
+    fields = [model._meta.get_field("date") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def bulk_insert(model, rows, batch_size, key):
+    """
+    bulk_create that fills in primary keys on backends that cannot return
+    them, by reading the rows back through the unique field `key`
+    """
+    rows = model.objects.bulk_create(rows, batch_size=batch_size)
+    if rows and rows[0].pk is None:
+        values = [getattr(row, key) for row in rows]
+        pks = {}
+        for start in range(0, len(values), batch_size):
+            pks.update(
+                model.objects.filter(**{f"{key}__in": values[start : start + batch_size]})
+                .values_list(key, "pk")
+            )
+        for row in rows:
+            row.pk = pks[getattr(row, key)]
+    return rows
+
+
+class Generator:
+    """
+    Creates the catalog in this process and hands order, review and cart
+    chunks to `run_chunk`, which may run in worker processes
+    """
+
+    def __init__(self, seed=None, days=365, batch_size=1000, password="password"):
+        self.rng = random.Random(seed)
+        self.seed = seed if seed is not None else self.rng.randrange(2**32)
+        self.days = days
+        self.batch_size = batch_size
+        self.now = timezone.now()
+        # Prefix of this run's unique names, so runs can be stacked
+        self.run = "".join(self.rng.choices(string.ascii_lowercase + string.digits, k=6))
+        self.password = make_password(password)
+
+    def categories(self, count):
+        existing = Category.objects.count()
+        rows = [
+            Category(title=f"Category {number}", slug=f"category-{self.run}-{number}")
+            for number in range(existing, count)
+        ]
+        Category.objects.bulk_create(rows, batch_size=self.batch_size)
+        return len(rows)
+
+    def users(self, count, kind):
+        rng = self.rng
+        start = pid_start(rng, *PROFILE_PID, count)
+        for offset in range(0, count, self.batch_size):
+            users = []
+            for number in range(offset, min(offset + self.batch_size, count)):
+                name = f"{kind}-{self.run}-{number}"
+                users.append(
+                    User(
+                        username=name,
+                        email=f"{name}@example.com",
+                        full_name=f"{kind.title()} {number}",
+                        password=self.password,
+                        date_joined=past(rng, self.now, self.days),
+                    )
+                )
+            with transaction.atomic():
+                users = bulk_insert(User, users, self.batch_size, "email")
+                # What the post_save handler of User does for single saves
+                Profile.objects.bulk_create(
+                    [
+                        Profile(
+                            user=user,
+                            full_name=user.full_name,
+                            country=rng.choice(COUNTRIES),
+                            pid=encode(start + offset + index, *PROFILE_PID),
+                        )
+                        for index, user in enumerate(users)
+                    ],
+                    batch_size=self.batch_size,
+                )
+            yield users
+
+    def vendors(self, count):
+        vendors = []
+        for users in self.users(count, "vendor"):
+            rows = [
+                Vendor(
+                    user=user,
+                    name=f"Shop {user.username}",
+                    slug=user.username,
+                    description="Generated shop",
+                    active=True,
+                )
+                for user in users
+            ]
+            vendors += bulk_insert(Vendor, rows, self.batch_size, "slug")
+
+        Coupon.objects.bulk_create(
+            [
+                Coupon(vendor=vendor, code=f"SAVE{vendor.pk}", discount=10, active=True)
+                for vendor in vendors
+                if self.rng.random() < 0.5
+            ],
+            batch_size=self.batch_size,
+        )
+        return vendors
+
+    def buyers(self, count):
+        created = 0
+        for users in self.users(count, "buyer"):
+            created += len(users)
+        return created
+
+    def products(self, count, vendors):
+        rng = self.rng
+        categories = list(Category.objects.values_list("pk", flat=True))
+        weights = skewed_weights(len(vendors), VENDOR_SKEW)
+        start = pid_start(rng, *PRODUCT_PID, count)
+
+        for offset in range(0, count, self.batch_size):
+            rows = []
+            for number in range(offset, min(offset + self.batch_size, count)):
+                price = Decimal(str(round(rng.lognormvariate(3.2, 0.8), 2)))
+                title = f"{rng.choice(WORDS).title()} {rng.choice(NOUNS)} {number}"
+                rows.append(
+                    Product(
+                        title=title,
+                        slug=f"{self.run}-{number}",
+                        pid=encode(start + number, *PRODUCT_PID),
+                        description=f"{title}, generated for load testing.",
+                        category_id=rng.choice(categories) if categories else None,
+                        vendor=rng.choices(vendors, cum_weights=weights)[0],
+                        price=price,
+                        old_price=(price * Decimal("1.2")).quantize(Decimal("0.01")),
+                        shipping_amount=Decimal(rng.choice([0, 2, 5, 10])),
+                        stock_qty=rng.randint(0, 500),
+                        status=pick(rng, STATUSES),
+                        featured=rng.random() < 0.02,
+                        date=past(rng, self.now, self.days),
+                    )
+                )
+
+            with historical_dates(Product), transaction.atomic():
+                rows = bulk_insert(Product, rows, self.batch_size, "pid")
+                self.product_details(rows)
+            yield len(rows)
+
+    def product_details(self, products):
+        rng = self.rng
+        galleries, colors, sizes, specifications = [], [], [], []
+        for product in products:
+            for _ in range(rng.randint(0, 3)):
+                galleries.append(Gallery(product=product, image=product.image.name))
+            for name, code in rng.sample(COLORS, rng.randint(1, 3)):
+                colors.append(Color(product=product, name=name, color_code=code))
+            for name in rng.sample(SIZES, rng.randint(0, 3)):
+                sizes.append(Size(product=product, name=name, price=product.price))
+            for title in rng.sample(SPECIFICATIONS, rng.randint(2, 4)):
+                specifications.append(
+                    Specification(product=product, title=title, content=rng.choice(WORDS))
+                )
+        for model, rows in (
+            (Gallery, galleries),
+            (Color, colors),
+            (Size, sizes),
+            (Specification, specifications),
+        ):
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+
+    def catalog(self):
+        """
+        What order, review and cart chunks pick from: every published
+        product and every user without a shop, most popular first
+        """
+        products = list(
+            Product.objects.filter(status="published").values_list(
+                "pk", "vendor_id", "price", "shipping_amount"
+            )
+        )
+        buyers = list(User.objects.filter(vendor__isnull=True).values_list("pk", flat=True))
+        if not products or not buyers:
+            return None
+        self.rng.shuffle(products)
+        self.rng.shuffle(buyers)
+        return Catalog(products, buyers, self.days, self.now, self.run, self.batch_size)
+
+    def chunks(self, kind, count, size):
+        """
+        (kind, start, count, seed) tasks for run_chunk
+        """
+        return [
+            (kind, start, min(size, count - start), self.seed * 1_000_003 + index)
+            for index, start in enumerate(range(0, count, size))
+        ]
+
+
+class Catalog:
+    """
+    Picklable snapshot of the rows generated orders, reviews and carts refer to
+    """
+
+    def __init__(self, products, buyers, days, now, run, batch_size):
+        self.product_ids = array("q", (row[0] for row in products))
+        self.vendor_ids = array("q", (row[1] for row in products))
+        self.prices = array("d", (float(row[2]) for row in products))
+        self.shipping = array("d", (float(row[3]) for row in products))
+        self.buyer_ids = array("q", buyers)
+        self.days = days
+        self.now = now
+        self.run = run
+        self.batch_size = batch_size
+        self.weights = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Rebuilt by each worker instead of being pickled
+        state["weights"] = None
+        return state
+
+    def prepare(self):
+        if self.weights is None:
+            self.weights = (
+                skewed_weights(len(self.product_ids), PRODUCT_SKEW),
+                skewed_weights(len(self.buyer_ids), BUYER_SKEW),
+            )
+
+    def product_index(self, rng):
+        return rng.choices(range(len(self.product_ids)), cum_weights=self.weights[0])[0]
+
+    def buyer(self, rng):
+        return rng.choices(self.buyer_ids, cum_weights=self.weights[1])[0]
+
+    def money(self, value):
+        return Decimal(value).quantize(Decimal("0.01"))
+
+
+_catalog = None
+
+
+def init_worker(catalog):
+    global _catalog
+    _catalog = catalog
+    _catalog.prepare()
+
+
+def run_chunk(task):
+    """
+    Generate one chunk of orders, reviews or carts, returns (kind, rows)
+    """
+    kind, start, count, seed = task
+    rng = random.Random(seed)
+    function = {"orders": order_chunk, "reviews": review_chunk, "carts": cart_chunk}[kind]
+    return kind, function(_catalog, rng, start, count)
+
+
+def order_chunk(catalog, rng, start, count):
+    orders, items = [], []
+    for number in range(start, start + count):
+        buyer = catalog.buyer(rng)
+        status = pick(rng, PAYMENT_STATUSES)
+        date = past(rng, catalog.now, catalog.days)
+        order = CartOrder(
+            oid=f"{catalog.run}{number:x}",
+            buyer_id=buyer,
+            payment_method=pick(rng, PAYMENT_METHODS),
+            payment_status=status,
+            order_status="fulfilled"
+            if status == "paid" and date < catalog.now - timedelta(days=7)
+            else "pending",
+            full_name=f"Buyer {buyer}",
+            email=f"buyer{buyer}@example.com",
+            country=rng.choice(COUNTRIES),
+            date=date,
+        )
+        order_items = []
+        for position in range(pick(rng, ITEMS_PER_ORDER)):
+            index = catalog.product_index(rng)
+            qty = pick(rng, QUANTITIES)
+            sub_total = catalog.money(catalog.prices[index] * qty)
+            shipping = catalog.money(catalog.shipping[index] * qty)
+            order_items.append(
+                CartOrderItem(
+                    oid=f"{order.oid}-{position}",
+                    vendor_id=catalog.vendor_ids[index],
+                    product_id=catalog.product_ids[index],
+                    qty=qty,
+                    price=catalog.money(catalog.prices[index]),
+                    sub_total=sub_total,
+                    shipping_amount=shipping,
+                    total=sub_total + shipping,
+                    initial_total=sub_total + shipping,
+                    country=order.country,
+                    date=date,
+                )
+            )
+        order.sub_total = sum(item.sub_total for item in order_items)
+        order.shipping_amount = sum(item.shipping_amount for item in order_items)
+        order.total = order.initial_total = order.sub_total + order.shipping_amount
+        orders.append(order)
+        items.append(order_items)
+
+    batch_size = catalog.batch_size
+    with historical_dates(CartOrder, CartOrderItem, Notification), transaction.atomic():
+        orders = bulk_insert(CartOrder, orders, batch_size, "oid")
+        order_vendors = set()
+        for order, order_items in zip(orders, items):
+            for item in order_items:
+                item.order = order
+                order_vendors.add((order.pk, item.vendor_id))
+        CartOrder.vendor.through.objects.bulk_create(
+            [
+                CartOrder.vendor.through(cartorder_id=order, vendor_id=vendor)
+                for order, vendor in order_vendors
+            ],
+            batch_size=batch_size,
+        )
+        flat = bulk_insert(
+            CartOrderItem, [item for group in items for item in group], batch_size, "oid"
+        )
+
+        # The notifications checkout sends: one per item to its vendor and
+        # one to the buyer
+        seen_before = catalog.now - timedelta(days=7)
+        notifications = [
+            Notification(
+                vendor_id=item.vendor_id,
+                order=item.order,
+                order_item=item,
+                type="order",
+                seen=item.date < seen_before,
+                date=item.date,
+            )
+            for item in flat
+        ] + [
+            Notification(
+                user_id=order.buyer_id,
+                order=order,
+                type="order",
+                seen=order.date < seen_before,
+                date=order.date,
+            )
+            for order in orders
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=batch_size)
+    return len(flat)
+
+
+def review_chunk(catalog, rng, start, count):
+    rows = []
+    for _ in range(count):
+        rows.append(
+            Review(
+                user_id=catalog.buyer(rng),
+                product_id=catalog.product_ids[catalog.product_index(rng)],
+                review=rng.choice(REVIEWS),
+                reply="Thank you!" if rng.random() < 0.1 else None,
+                rating=pick(rng, RATINGS),
+                active=rng.random() < 0.9,
+                date=past(rng, catalog.now, catalog.days),
+            )
+        )
+    with historical_dates(Review):
+        Review.objects.bulk_create(rows, batch_size=catalog.batch_size)
+    return len(rows)
+
+
+def cart_chunk(catalog, rng, start, count):
+    rows = []
+    for number in range(start, start + count):
+        cart_id = f"{catalog.run}-cart-{number}"
+        user = catalog.buyer(rng) if rng.random() < 0.6 else None
+        country = rng.choice(COUNTRIES)
+        date = past(rng, catalog.now, 30)
+        for _ in range(rng.randint(1, 4)):
+            index = catalog.product_index(rng)
+            qty = pick(rng, QUANTITIES)
+            sub_total = catalog.money(catalog.prices[index] * qty)
+            shipping = catalog.money(catalog.shipping[index] * qty)
+            rows.append(
+                Cart(
+                    cart_id=cart_id,
+                    user_id=user,
+                    product_id=catalog.product_ids[index],
+                    qty=qty,
+                    price=catalog.money(catalog.prices[index]),
+                    sub_total=sub_total,
+                    shipping_amount=shipping,
+                    total=sub_total + shipping,
+                    country=country,
+                    date=date,
+                )
+            )
+    with historical_dates(Cart):
+        Cart.objects.bulk_create(rows, batch_size=catalog.batch_size)
+    return len(rows)
@@ -1,3 +1,463 @@
-from django.test import TestCase
+import os
+import sqlite3
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from multiprocessing.pool import Pool
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.models import Count, F, Sum
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.utils.timezone import localdate
+
+from store import product_views
+from store.models import (
+    Cart,
+    CartOrder,
+    CartOrderItem,
+    Category,
+    Coupon,
+    Notification,
+    Product,
+    ProductDailyViews,
+    Review,
+    VendorDailySales,
+)
+from store.product_views import ProductViewBuffer, product_view_buffer, trending_products
+from store.views import ReviewListAPIView
+from userauths.models import Profile, User
+from vendor.models import Vendor
+
+
+class StoreTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email="buyer@example.com", username="buyer", password="secret-pass-1"
+        )
+        vendor_user = User.objects.create_user(
+            email="vendor@example.com", username="vendor", password="secret-pass-1"
+        )
+        cls.vendor = Vendor.objects.create(user=vendor_user, name="Vendor", slug="vendor")
+        cls.product = Product.objects.create(
+            title="Product", vendor=cls.vendor, price=Decimal("10.00"), stock_qty=10
+        )
+
+
+class ReviewListTests(StoreTestCase):
+    def test_reviews_are_paged_with_the_rating_summary(self):
+        for rating in (5, 3):
+            Review.objects.create(user=self.user, product=self.product, review="Ok", rating=rating, active=True)
+
+        response = self.client.get(f"/api/v1/reviews/{self.product.id}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIn("next", response.data)
+        self.assertEqual(response.data["rating_count"], 2)
+        self.assertEqual(response.data["rating_histogram"][5], 1)
+
+    def test_queryset_resolves_the_product_itself(self):
+        Review.objects.create(user=self.user, product=self.product, review="Ok", rating=4, active=True)
+        view = ReviewListAPIView()
+        view.setup(RequestFactory().get("/"), product_id=self.product.id)
+
+        self.assertEqual(view.get_queryset().count(), 1)
+
+
+class ProductRatingTests(StoreTestCase):
+    def test_reviews_update_the_rating_aggregates(self):
+        first = Review.objects.create(
+            user=self.user, product=self.product, review="Ok", rating=5, active=True
+        )
+        Review.objects.create(
+            user=self.user, product=self.product, review="Ok", rating=2, active=True
+        )
+        # Inactive reviews are not counted
+        Review.objects.create(user=self.user, product=self.product, review="Ok", rating=1)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 2)
+        self.assertEqual(self.product.rating_avg, 3.5)
+        self.assertEqual(self.product.rating_histogram(), {1: 0, 2: 1, 3: 0, 4: 0, 5: 1})
+
+        first.rating = 4
+        first.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_avg, 3.0)
+        self.assertEqual(self.product.rating_5, 0)
+
+        first.delete()
+        Review.objects.filter(rating=2).delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 0)
+        self.assertEqual(self.product.rating_avg, 0.0)
+
+    def test_add_rating(self):
+        Product.add_rating(self.product.id, 5)
+        Product.add_rating(self.product.id, "3")
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_avg), (2, 4.0))
+
+        Product.add_rating(self.product.id, 5, sign=-1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_avg), (1, 3.0))
+        self.assertEqual(self.product.rating_5, 0)
+
+        Product.add_rating(self.product.id, 3, sign=-1)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_avg), (0, 0.0))
+
+    def test_removing_a_rating_that_was_never_counted_stops_at_zero(self):
+        review = Review.objects.create(
+            user=self.user, product=self.product, review="Ok", rating=4, active=True
+        )
+        # Counters drifted, e.g. a queryset update or reviews older than the backfill
+        Product.objects.filter(pk=self.product.pk).update(rating_4=0, rating_count=0)
+
+        review.delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_4, self.product.rating_count), (0, 0))
+        self.assertEqual(self.product.rating_avg, 0.0)
+
+    def test_out_of_range_ratings_are_not_counted(self):
+        with self.assertLogs("store.models", "WARNING"):
+            Product.add_rating(self.product.id, 7)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 0)
+
+    def test_review_endpoint_rejects_out_of_range_ratings(self):
+        for rating in (0, 7, "five"):
+            response = self.client.post(
+                f"/api/v1/reviews/{self.product.id}/",
+                {
+                    "user_id": self.user.id,
+                    "product_id": self.product.id,
+                    "rating": rating,
+                    "review": "Ok",
+                },
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Review.objects.exists())
+
+
+class OrderTestCase(StoreTestCase):
+    def setUp(self):
+        self.order = CartOrder.objects.create(buyer=self.user, total=Decimal("25.00"))
+        CartOrderItem.objects.create(
+            order=self.order,
+            vendor=self.vendor,
+            product=self.product,
+            qty=2,
+            sub_total=Decimal("20.00"),
+            shipping_amount=Decimal("5.00"),
+        )
+
+    def set_status(self, status):
+        self.order.payment_status = status
+        self.order.save()
+
+
+class VendorDailySalesTests(OrderTestCase):
+    def totals(self):
+        return VendorDailySales.objects.values_list("orders", "units", "revenue", "shipping").get(
+            vendor=self.vendor
+        )
+
+    def test_paid_orders_are_added_and_cancellations_removed(self):
+        self.set_status("paid")
+        self.assertEqual(self.totals(), (1, 2, Decimal("20.00"), Decimal("5.00")))
+
+        # Saved again while paid, counted once
+        self.order.save()
+        self.assertEqual(self.totals(), (1, 2, Decimal("20.00"), Decimal("5.00")))
+
+        self.set_status("cancelled")
+        self.assertEqual(self.totals(), (0, 0, Decimal("0.00"), Decimal("0.00")))
+
+    def test_removal_of_an_order_paid_before_the_rollups_stops_at_zero(self):
+        self.set_status("paid")
+        VendorDailySales.objects.all().delete()
+
+        self.set_status("cancelled")
+        self.assertEqual(self.totals(), (0, 0, Decimal("0.00"), Decimal("0.00")))
+
+    def test_rebuild_command(self):
+        self.set_status("paid")
+        VendorDailySales.objects.update(orders=7, units=0)
+        out = StringIO()
+
+        call_command("rebuild_vendor_sales", vendor=self.vendor.id, stdout=out)
+
+        self.assertIn("Rebuilt 1 vendor daily sales rows", out.getvalue())
+        self.assertEqual(self.totals(), (1, 2, Decimal("20.00"), Decimal("5.00")))
+        with self.assertRaises(CommandError):
+            call_command("rebuild_vendor_sales", vendor=0, stdout=out)
+
+
+class ProductSalesTests(OrderTestCase):
+    def sales(self):
+        self.product.refresh_from_db()
+        return self.product.units_sold, self.product.paid_orders
+
+    def test_paid_orders_are_added_and_cancellations_removed(self):
+        self.set_status("paid")
+        self.assertEqual(self.sales(), (2, 1))
+
+        self.set_status("cancelled")
+        self.assertEqual(self.sales(), (0, 0))
+
+    def test_removal_of_an_order_paid_before_the_counters_stops_at_zero(self):
+        self.set_status("paid")
+        Product.objects.update(units_sold=0, paid_orders=0)
+
+        self.set_status("cancelled")
+        self.assertEqual(self.sales(), (0, 0))
+
+    def test_record_order(self):
+        Product.record_order(self.order)
+        Product.record_order(self.order)
+        self.assertEqual(self.sales(), (4, 2))
+
+        Product.record_order(self.order, sign=-1)
+        self.assertEqual(self.sales(), (2, 1))
+
+
+class ProductViewTests(StoreTestCase):
+    def setUp(self):
+        self.other = Product.objects.create(
+            title="Other", vendor=self.vendor, price=Decimal("5.00")
+        )
+
+    def buffer(self, **kwargs):
+        buffer = ProductViewBuffer(**{"flush_interval": 60, "max_pending": 100, **kwargs})
+        # No flush thread, the tests flush themselves
+        patcher = mock.patch.object(
+            buffer, "_start_timer", side_effect=lambda: setattr(buffer, "_timer", True)
+        )
+        self.start_timer = patcher.start()
+        self.addCleanup(patcher.stop)
+        return buffer
+
+    def views(self):
+        return {
+            product.id: (
+                product.views,
+                ProductDailyViews.objects.filter(product=product, date=localdate())
+                .values_list("views", flat=True)
+                .first(),
+            )
+            for product in Product.objects.all()
+        }
+
+    def test_views_are_buffered_until_flushed(self):
+        buffer = self.buffer()
+        buffer.add(self.product.id)
+        buffer.add(self.product.id)
+        buffer.add(self.other.id, 3)
+        # Views of a deleted product are dropped
+        buffer.add(0)
+
+        self.assertEqual(self.views(), {self.product.id: (0, None), self.other.id: (0, None)})
+        self.start_timer.assert_called_once()
+
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.views(), {self.product.id: (2, 2), self.other.id: (3, 3)})
+        self.assertEqual(ProductDailyViews.objects.count(), 2)
+
+        buffer.add(self.product.id)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(self.views()[self.product.id], (3, 3))
+
+    def test_flush_when_full_or_without_interval(self):
+        buffer = self.buffer(max_pending=2)
+        buffer.add(self.product.id)
+        buffer.add(self.other.id)
+        self.assertEqual(self.views(), {self.product.id: (1, 1), self.other.id: (1, 1)})
+
+        buffer = self.buffer(flush_interval=0)
+        buffer.add(self.product.id)
+        self.assertEqual(self.views()[self.product.id], (2, 2))
+        self.start_timer.assert_not_called()
+
+    def test_batches(self):
+        buffer = self.buffer()
+        buffer.add(self.product.id, 2)
+        buffer.add(self.other.id, 5)
+
+        with mock.patch.object(product_views, "FLUSH_BATCH_SIZE", 1):
+            buffer.flush()
+        self.assertEqual(self.views(), {self.product.id: (2, 2), self.other.id: (5, 5)})
+
+        # One batch: two CASE updates, the existing ids and the new daily rows
+        buffer.add(self.product.id)
+        buffer.add(self.other.id)
+        with self.assertNumQueries(6):
+            buffer.flush()
+
+    def test_failed_flush_keeps_the_views(self):
+        buffer = self.buffer()
+        buffer.add(self.product.id, 2)
+        with mock.patch.object(product_views, "write_views", side_effect=RuntimeError):
+            with self.assertLogs("store.product_views", "ERROR"):
+                self.assertEqual(buffer.flush(), 0)
+
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(self.views()[self.product.id], (2, 2))
+
+    def test_detail_requests_are_counted(self):
+        product_view_buffer.flush()
+        with mock.patch.object(product_view_buffer, "_start_timer"):
+            response = self.client.get(f"/api/v1/products/{self.product.slug}/")
+        self.assertEqual(response.status_code, 200)
+
+        product_view_buffer.flush()
+        self.assertEqual(self.views()[self.product.id], (1, 1))
+
+
+@override_settings(TRENDING_HALF_LIFE_DAYS=2, TRENDING_WINDOW_DAYS=14)
+class TrendingProductsTests(StoreTestCase):
+    def setUp(self):
+        self.today = localdate()
+        # Scores with a two day half life: old 10 / 4 = 2.5, new 4, recent
+        # 3 / sqrt(2) = 2.1
+        self.old = self.product
+        self.new = Product.objects.create(title="New", vendor=self.vendor, price=Decimal("5.00"))
+        self.recent = Product.objects.create(
+            title="Recent", vendor=self.vendor, price=Decimal("5.00")
+        )
+        draft = Product.objects.create(
+            title="Draft", vendor=self.vendor, price=Decimal("5.00"), status="draft"
+        )
+        for product, age, views in (
+            (self.old, 4, 10),
+            (self.old, 20, 100),
+            (self.new, 0, 4),
+            (self.recent, 1, 3),
+            (draft, 0, 50),
+        ):
+            ProductDailyViews.objects.create(
+                product=product, date=self.today - timedelta(days=age), views=views
+            )
+
+    def test_views_decay_with_age(self):
+        self.assertEqual(trending_products(today=self.today), [self.new, self.old, self.recent])
+
+        # Views older than the window are left out
+        with self.settings(TRENDING_WINDOW_DAYS=3):
+            self.assertEqual(trending_products(today=self.today), [self.new, self.recent])
+
+        # A longer half life: old 10 / sqrt(2) = 7.1 ranks first
+        with self.settings(TRENDING_HALF_LIFE_DAYS=8):
+            self.assertEqual(
+                trending_products(today=self.today), [self.old, self.new, self.recent]
+            )
+
+    def test_endpoint(self):
+        response = self.client.get("/api/v1/trending-products/?limit=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row["title"] for row in response.data], ["New", "Product"])
+
+
+class SyntheticDataTests(TransactionTestCase):
+    def generate(self, **options):
+        out, err = StringIO(), StringIO()
+        # Chunks of 10 rows: 2 of orders, 3 of reviews and 1 of carts
+        call_command(
+            "generate_synthetic_data",
+            vendors=3,
+            buyers=8,
+            products=20,
+            orders=15,
+            reviews=25,
+            carts=6,
+            categories=4,
+            days=30,
+            batch_size=2,
+            stdout=out,
+            stderr=err,
+            **{"seed": 7, **options},
+        )
+        return out.getvalue(), err.getvalue()
+
+    def assertGenerated(self, output):
+        self.assertEqual(Category.objects.count(), 4)
+        self.assertEqual(Vendor.objects.count(), 3)
+        self.assertEqual(User.objects.count(), 11)
+        self.assertEqual(Profile.objects.count(), 11)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertEqual(Coupon.objects.exclude(vendor__in=Vendor.objects.all()).count(), 0)
+        self.assertEqual(CartOrder.objects.count(), 15)
+        self.assertEqual(Review.objects.count(), 25)
+        self.assertEqual(Cart.objects.values("cart_id").distinct().count(), 6)
+
+        items = CartOrderItem.objects.count()
+        self.assertIn(f"Created 15 orders with {items} items, 25 reviews", output)
+        # One notification per item to its vendor and one per order to the buyer
+        self.assertEqual(Notification.objects.filter(vendor__isnull=False).count(), items)
+        self.assertEqual(Notification.objects.filter(user__isnull=False).count(), 15)
+
+        # Foreign keys point at existing rows and agree with each other
+        connection.check_constraints()
+        self.assertFalse(CartOrderItem.objects.exclude(vendor=F("product__vendor")).exists())
+        self.assertFalse(CartOrderItem.objects.filter(product__status="draft").exists())
+        self.assertFalse(CartOrder.objects.filter(buyer__vendor__isnull=False).exists())
+        self.assertFalse(Notification.objects.exclude(order=F("order_item__order")).exists())
+        for order in CartOrder.objects.annotate(items=Count("cartorderitem")):
+            self.assertGreater(order.items, 0)
+            self.assertEqual(
+                set(order.vendor.values_list("pk", flat=True)),
+                set(order.cartorderitem_set.values_list("vendor", flat=True)),
+            )
+
+        # Rollups rebuilt after the bulk inserts
+        self.assertEqual(
+            Product.objects.aggregate(Sum("rating_count"))["rating_count__sum"],
+            Review.objects.filter(active=True).count(),
+        )
+        self.assertEqual(
+            VendorDailySales.objects.aggregate(Sum("orders"))["orders__sum"],
+            CartOrderItem.objects.filter(order__payment_status="paid")
+            .values("order", "vendor")
+            .distinct()
+            .count(),
+        )
+
+    def test_generate(self):
+        output, _ = self.generate()
+        self.assertGenerated(output)
+
+        # Runs stack instead of colliding on unique names
+        self.generate(seed=8)
+        self.assertEqual(Product.objects.count(), 40)
+
+    def test_workers_fall_back_on_an_in_memory_database(self):
+        output, err = self.generate(workers=2)
+        self.assertIn("using one worker", err)
+        self.assertGenerated(output)
+
+    def test_workers_on_sqlite(self):
+        # The worker processes need a database they can open, a copy of the
+        # in-memory test database in a file takes the default's place
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "db.sqlite3")
+        memory = connections["default"]
+        memory.ensure_connection()
+        target = sqlite3.connect(path)
+        memory.connection.backup(target)
+        target.close()
+
+        file_db = type(memory)({**memory.settings_dict, "NAME": path}, "default")
+        connections["default"] = file_db
+        self.addCleanup(connections.__setitem__, "default", memory)
+        self.addCleanup(file_db.close)
+
+        with mock.patch.object(Pool, "imap", autospec=True, side_effect=Pool.imap) as imap:
+            output, err = self.generate(workers=2)
+
+        self.assertNotIn("using one worker", err)
+        imap.assert_called_once()
+        self.assertGenerated(output)
@@ -1,11 +1,13 @@
 from django.shortcuts import redirect
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.utils.functional import cached_property
 from django.core.mail import send_mail
 
 from mailersend import emails
 
 from rest_framework import generics, status
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
@@ -39,6 +41,8 @@ from store.serializers import (
     NotificationSerializer,
     ReviewSerializer,
 )
+from store.eager import eager, order_items, product_details
+from store.product_views import product_view_buffer, trending_products
 
 from decimal import Decimal
 
@@ -71,12 +75,18 @@ class CategoryListAPIView(generics.ListAPIView):
 
 
 class ProductListAPIView(generics.ListAPIView):
-    queryset = Product.objects.all()
+    queryset = eager(Product.objects.all(), prefetch=product_details())
     serializer_class = ProductSerializer
     permission_classes = [
         AllowAny,
     ]
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.GET.get("sort") == "best_selling":
+            queryset = queryset.order_by("-units_sold", "-paid_orders")
+        return queryset
+
 
 class ProductDetailAPIView(generics.RetrieveAPIView):
     serializer_class = ProductSerializer
@@ -86,7 +96,23 @@ class ProductDetailAPIView(generics.RetrieveAPIView):
 
     def get_object(self):
         slug = self.kwargs["slug"]
-        return Product.objects.get(slug=slug)
+        product = Product.objects.get(slug=slug)
+        product_view_buffer.add(product.id)
+        return product
+
+
+class TrendingProductsAPIView(generics.ListAPIView):
+    serializer_class = ProductSerializer
+    permission_classes = [
+        AllowAny,
+    ]
+
+    def get_queryset(self):
+        try:
+            limit = min(max(int(self.request.query_params.get("limit", 20)), 1), 100)
+        except ValueError:
+            limit = 20
+        return trending_products(limit=limit)
 
 
 class CartAPIView(generics.ListCreateAPIView):
@@ -226,7 +252,7 @@ class CartListView(generics.ListAPIView):
         else:
             queryset = Cart.objects.filter(cart_id=cart_id)
 
-        return queryset
+        return eager(queryset)
 
 
 class CartDetailView(generics.RetrieveAPIView):
@@ -506,7 +532,9 @@ class CheckoutView(generics.RetrieveAPIView):
         order_oid = self.kwargs["order_oid"]
         logger.info(f"Fetching CartOrder with oid: {order_oid}")
         try:
-            order = CartOrder.objects.get(oid=order_oid)
+            order = eager(CartOrder.objects.all(), prefetch=[order_items()]).get(
+                oid=order_oid
+            )
             return order
         except CartOrder.DoesNotExist:
             logger.error(f"CartOrder with oid {order_oid} does not exist.")
@@ -996,28 +1024,68 @@ class PaymentSuccessView(generics.CreateAPIView):
             )
 
 
+class ReviewCursorPagination(CursorPagination):
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+    ordering = "-id"
+
+
 class ReviewListAPIView(generics.ListCreateAPIView):
     serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
     permission_classes = [
         AllowAny,
     ]
 
-    def get_queryset(self):
+    @cached_property
+    def product(self):
+        return self.get_product()
+
+    def get_product(self):
         product_id = self.kwargs.get("product_id")
-        
+
         # Handle undefined or invalid product_id
         if product_id == 'undefined' or not product_id:
             logger.warning(f"Invalid product_id: {product_id}")
-            return Review.objects.none()
-        
+            return None
+
         try:
-            product = Product.objects.get(id=product_id)
-            reviews = Review.objects.filter(product=product)
-            return reviews
+            return Product.objects.only(
+                "id", "rating_avg", "rating_count", "rating_1", "rating_2",
+                "rating_3", "rating_4", "rating_5",
+            ).get(id=product_id)
         except (Product.DoesNotExist, ValueError):
             logger.warning(f"Product with id {product_id} does not exist")
+            return None
+
+    def get_queryset(self):
+        product = self.product
+        if product is None:
             return Review.objects.none()
 
+        return Review.objects.filter(product=product).select_related(
+            "user__profile",
+            "product__category",
+            "product__vendor__user",
+        ).prefetch_related(
+            "user__groups",
+            "user__user_permissions",
+            "product__vendor__user__groups",
+            "product__vendor__user__user_permissions",
+        )
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+
+        product = self.product
+        response.data["rating_avg"] = product.product_rating() if product else None
+        response.data["rating_count"] = product.rating_count if product else 0
+        response.data["rating_histogram"] = (
+            product.rating_histogram() if product else {star: 0 for star in range(1, 6)}
+        )
+        return response
+
     def create(self, request, *args, **kwargs):
         payload = request.data
 
@@ -1032,6 +1100,15 @@ class ReviewListAPIView(generics.ListCreateAPIView):
                 {"message": "Missing required fields", "status": "error"},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            rating = int(rating)
+        except (TypeError, ValueError):
+            rating = None
+        if rating not in dict(Review.RATING):
+            return Response(
+                {"message": "Rating must be between 1 and 5", "status": "error"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
         try:
             user = User.objects.get(id=user_id)
@@ -1101,11 +1178,13 @@ class SearchProductAPIView(generics.ListCreateAPIView):
             elif sort == "price_desc":
                 queryset = queryset.order_by("-price")
             elif sort == "rating":
-                queryset = queryset.order_by("-rating")
+                queryset = queryset.order_by("-rating_avg", "-rating_count")
             elif sort == "newest":
                 queryset = queryset.order_by("-date")
+            elif sort == "best_selling":
+                queryset = queryset.order_by("-units_sold", "-paid_orders")
 
-        return queryset
+        return eager(queryset, prefetch=product_details())
 
 
 from rest_framework.views import APIView
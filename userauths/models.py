@@ -4,6 +4,8 @@ from django.db.models.signals import post_save
 
 from shortuuid.django_fields import ShortUUIDField
 
+from api.imaging import ProcessedImageModel, image_saved
+
 # Create your models here.
 
 
@@ -35,7 +37,7 @@ class User(AbstractUser):
         super(User, self).save(*args, **kwargs)
 
 
-class Profile(models.Model):
+class Profile(ProcessedImageModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     image = models.FileField(upload_to="image", default="default/default_avatar.jpg")
     full_name = models.CharField(max_length=100, null=True, blank=True)
@@ -74,3 +76,4 @@ def save_user_profile(sender, instance, **kwargs):
 
 post_save.connect(create_user_profile, sender=User)
 post_save.connect(save_user_profile, sender=User)
+post_save.connect(image_saved, sender=Profile)
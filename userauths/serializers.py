@@ -69,6 +69,7 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class ProfileSerializer(serializers.ModelSerializer):
+    image_thumbnails = serializers.ReadOnlyField()
 
     class Meta:
         model = Profile